@@ -1,14 +1,39 @@
+"""
+Clean the efficiencies and fermentable yields of the recipes.
+
+clean_efficiency and clean_ferm_yield replace unacceptable values with means
+over the values they're given. To clean all_recipes without loading it at
+once, CleaningStats accumulates those means over all the recipes in a first
+chunked pass, and then cleans a chunk at a time with them: `write_cleaned`
+writes a cleaned copy of the store. The recipe vectors (beerai.data.recipe2vec)
+don't use efficiencies or yields, so they're the same with or without it.
+
+    python -m beerai.cleaning -o all_recipes_clean.h5
+"""
+
+import argparse
+import os
+
+from .config import DATA_DIR
+from .data.instrument import add_arguments, enable_from_args, iterate, stage
+from .data.store import CORE_TABLE, ING_TABLE, copy_store, open_store
 from .utils import split_series_on_range
 import pandas as pd
 import numpy as np
 
+RECIPE_FILE = os.path.join(DATA_DIR, "interim/all_recipes.h5")
+CLEAN_FILE = os.path.join(DATA_DIR, "interim/all_recipes_clean.h5")
+CHUNK_SIZE = 10000
+
 
-def clean_efficiency(series, acceptable_min=0.5, acceptable_max=1.0):
+def clean_efficiency(
+    series, acceptable_min=0.5, acceptable_max=1.0, mean_acceptable=None
+):
     """
     Clean the "efficiency" column of the core DataFrame.
 
     Replace unacceptable values with the mean acceptable value for 
-    all recipes. 
+    all recipes (or mean_acceptable, if given). 
 
     Parameters
     ==========
@@ -18,6 +43,10 @@ def clean_efficiency(series, acceptable_min=0.5, acceptable_max=1.0):
         The lowest efficiency to accept. Default: 0.5
     acceptable_max: float    
         The highest efficiency to accept. Default: 1.0
+    mean_acceptable: float
+        The value to replace unacceptable values with, e.g. the mean over
+        all the recipes from CleaningStats. Default: the mean acceptable
+        value in series.
 
     Return: 
     =======
@@ -26,20 +55,29 @@ def clean_efficiency(series, acceptable_min=0.5, acceptable_max=1.0):
     acceptable, unacceptable = split_series_on_range(
         series, acceptable_min, acceptable_max
     )
-    mean_acceptable = acceptable.groupby(acceptable.index).first().mean()
-    efficiency_cleaned = acceptable.append(
-        pd.Series(index=unacceptable.index, data=mean_acceptable)
+    if mean_acceptable is None:
+        mean_acceptable = acceptable.groupby(acceptable.index).first().mean()
+    efficiency_cleaned = pd.concat(
+        [acceptable, pd.Series(index=unacceptable.index, data=mean_acceptable)]
     ).sort_index()
     return efficiency_cleaned
 
 
-def clean_ferm_yield(df, ferm_yield_cutoff=0.03, exceptions=None):
+def clean_ferm_yield(
+    df,
+    ferm_yield_cutoff=0.03,
+    exceptions=None,
+    ferm_type_to_yield=None,
+    mean_yield=None,
+):
     """
     Clean the "ferm_yield" column of the core DataFrame.
 
     Replace unacceptable values with the mean acceptable value for 
-    that fermentable's "ferm_type". Do not replace values for fermentables
-    whose "ferm_name" is in the list of exceptions.
+    that fermentable's "ferm_type" (or from ferm_type_to_yield, if given),
+    or with the mean acceptable value of all the fermentables if its type is
+    missing or has no acceptable values. Do not replace values for
+    fermentables whose "ferm_name" is in the list of exceptions.
 
     Parameters
     ==========
@@ -50,6 +88,13 @@ def clean_ferm_yield(df, ferm_yield_cutoff=0.03, exceptions=None):
     exceptions: list of str
         The values of ferm_name for which ferm_yield will be left intact.
         Default: ["rice hulls"] 
+    ferm_type_to_yield: Series
+        The value to replace unacceptable yields with for each "ferm_type",
+        e.g. the means over all the recipes from CleaningStats. Default: the
+        mean acceptable yield of each "ferm_type" in df.
+    mean_yield: float
+        The value to replace unacceptable yields with when there's none for
+        their "ferm_type". Default: the mean acceptable yield in df.
 
     Return: 
     =======
@@ -63,21 +108,249 @@ def clean_ferm_yield(df, ferm_yield_cutoff=0.03, exceptions=None):
     )
     exceptions_mask = df["ferm_name"].isin(exceptions)
 
-    # Identify average yield for each ferm_type amongst the good ones
-    ferm_type_to_yield = (
-        df.loc[acceptable_mask].groupby("ferm_type")["ferm_yield"].mean()
-    )
+    if ferm_type_to_yield is None:
+        # Identify average yield for each ferm_type amongst the good ones
+        ferm_type_to_yield = (
+            df.loc[acceptable_mask].groupby("ferm_type")["ferm_yield"].mean()
+        )
+    if mean_yield is None:
+        mean_yield = df.loc[acceptable_mask, "ferm_yield"].astype(np.float64).mean()
 
     to_fix_mask = unacceptable_mask & ~exceptions_mask
     # Get rows to fix, set indices to iloc indices. For the bad ones, map their
-    # ferm type to the average ferm_yield for that type.
-    ferm_yield_cleaned = df.loc[to_fix_mask, "ferm_type"].map(ferm_type_to_yield)
+    # ferm type to the average ferm_yield for that type, or the overall average.
+    ferm_yield_cleaned = (
+        df.loc[to_fix_mask, "ferm_type"]
+        .astype(object)
+        .map(ferm_type_to_yield)
+        .astype(np.float64)
+        .fillna(mean_yield)
+    )
     ferm_yield_cleaned.index = np.where(to_fix_mask)[0]
     # Get good ones, set indices to iloc indices
     ferm_yield_untouched = df.loc[~to_fix_mask, "ferm_yield"]
     ferm_yield_untouched.index = np.where(~to_fix_mask)[0]
     # Append and fix index back to original
-    ferm_yield = ferm_yield_cleaned.append(ferm_yield_untouched).sort_index()
+    ferm_yield = pd.concat([ferm_yield_cleaned, ferm_yield_untouched]).sort_index()
     ferm_yield.index = df.index
 
     return ferm_yield
+
+
+def _with_ferm_type(ings):
+    """Stores written before ferm_type was kept don't have it, so every
+    fermentable has a missing type (and gets the mean yield of all of them)."""
+    if "ferm_type" in ings.columns:
+        return ings
+    return ings.assign(ferm_type=np.nan)
+
+
+class CleaningStats:
+    """
+    The values clean_efficiency and clean_ferm_yield replace unacceptable
+    ones with, accumulated a chunk of recipes at a time with update, so that
+    chunks can be cleaned with the means over all the recipes.
+
+    The parameters are those of clean_efficiency and clean_ferm_yield.
+    """
+
+    def __init__(
+        self,
+        acceptable_min=0.5,
+        acceptable_max=1.0,
+        ferm_yield_cutoff=0.03,
+        exceptions=None,
+    ):
+        self.acceptable_min = acceptable_min
+        self.acceptable_max = acceptable_max
+        self.ferm_yield_cutoff = ferm_yield_cutoff
+        self.exceptions = exceptions
+        self.efficiency_sum = 0.0
+        self.efficiency_count = 0
+        self.yield_sum = pd.Series(dtype=np.float64)
+        self.yield_count = pd.Series(dtype=np.float64)
+        self.all_yield_sum = 0.0
+        self.all_yield_count = 0
+
+    @property
+    def mean_efficiency(self):
+        if not self.efficiency_count:
+            return np.nan
+        return self.efficiency_sum / self.efficiency_count
+
+    @property
+    def ferm_type_to_yield(self):
+        return self.yield_sum / self.yield_count
+
+    @property
+    def mean_yield(self):
+        if not self.all_yield_count:
+            return np.nan
+        return self.all_yield_sum / self.all_yield_count
+
+    def update(self, core, ings):
+        """
+        Add the acceptable efficiencies of a chunk of recipes, and the
+        acceptable yields of their fermentables per "ferm_type" and over all
+        of them.
+
+        Parameters
+        ==========
+        core: DataFrame
+            The core rows of the recipes, with at least "efficiency".
+        ings: DataFrame
+            Their ingredient rows, with at least "ferm_yield".
+
+        Return:
+        =======
+        self
+        """
+        acceptable, _ = split_series_on_range(
+            core["efficiency"], self.acceptable_min, self.acceptable_max
+        )
+        # Count each recipe once, like clean_efficiency
+        acceptable = acceptable.groupby(acceptable.index).first().astype(np.float64)
+        self.efficiency_sum += acceptable.sum()
+        self.efficiency_count += len(acceptable)
+
+        ings = _with_ferm_type(ings)
+        acceptable_mask, _ = split_series_on_range(
+            ings["ferm_yield"], self.ferm_yield_cutoff, 1, return_mask=True
+        )
+        acceptable = ings.loc[acceptable_mask]
+        yields = acceptable["ferm_yield"].astype(np.float64)
+        grouped = yields.groupby(acceptable["ferm_type"].astype(object))
+        self.yield_sum = self.yield_sum.add(grouped.sum(), fill_value=0)
+        self.yield_count = self.yield_count.add(grouped.count(), fill_value=0)
+        self.all_yield_sum += yields.sum()
+        self.all_yield_count += yields.count()
+        return self
+
+    def clean_core(self, core):
+        """Return a copy of the core rows of recipes with the efficiencies
+        cleaned."""
+        core = core.copy()
+        core["efficiency"] = clean_efficiency(
+            core["efficiency"],
+            self.acceptable_min,
+            self.acceptable_max,
+            self.mean_efficiency,
+        )
+        return core
+
+    def clean_ingredients(self, ings):
+        """Return a copy of the ingredient rows of recipes (with at least
+        "ferm_name" and "ferm_yield") with the yields cleaned."""
+        ings = ings.copy()
+        ings["ferm_yield"] = clean_ferm_yield(
+            _with_ferm_type(ings),
+            self.ferm_yield_cutoff,
+            self.exceptions,
+            self.ferm_type_to_yield,
+            self.mean_yield,
+        ).astype(ings["ferm_yield"].dtype)
+        return ings
+
+    def clean(self, core, ings):
+        """Return copies of a chunk of recipes with their efficiencies and
+        yields cleaned."""
+        return self.clean_core(core), self.clean_ingredients(ings)
+
+    @classmethod
+    def fit(cls, store, chunksize=CHUNK_SIZE, **kwargs):
+        """
+        Accumulate the statistics over every recipe of a store (from
+        beerai.data.store.open_store), a chunk at a time.
+
+        Parameters
+        ==========
+        store: HDFBackend or ParquetBackend
+            The open all_recipes store.
+        chunksize: int
+            The number of recipes per chunk. Default: CHUNK_SIZE
+        kwargs:
+            The parameters of CleaningStats.
+
+        Return:
+        =======
+        CleaningStats
+        """
+        stats = cls(**kwargs)
+        table = "ferm" if "ferm" in store else ING_TABLE
+        stored = store.columns(table)
+        # Stores written before ferm_type was kept don't have it
+        columns = [col for col in ["ferm_yield", "ferm_type"] if col in stored]
+        chunks = store.select(CORE_TABLE, columns=["efficiency"], chunksize=chunksize)
+        for chunk, core in enumerate(iterate("select core", chunks)):
+            with stage("select", chunk=chunk) as s:
+                id_range = (core.index[0], core.index[-1] + 1)
+                ings = store.select(table, columns=columns, id_range=id_range)
+                s.rows = len(ings)
+            with stage("cleaning_stats", chunk=chunk) as s:
+                stats.update(core, ings)
+                s.rows = len(core)
+        return stats
+
+
+def write_cleaned(path=RECIPE_FILE, out_path=CLEAN_FILE, chunksize=CHUNK_SIZE):
+    """
+    Write a copy of the store at path to out_path with the efficiencies and
+    fermentable yields cleaned with the means over all the recipes: one pass
+    accumulates the means, a second cleans and writes a chunk at a time.
+
+    Parameters
+    ==========
+    path: str
+        The all_recipes store to clean. Default: RECIPE_FILE
+    out_path: str
+        Where to write the cleaned store (see open_store for the layouts).
+        Default: CLEAN_FILE
+    chunksize: int
+        The number of recipes per chunk. Default: CHUNK_SIZE
+
+    Return:
+    =======
+    The CleaningStats the recipes were cleaned with.
+    """
+    with open_store(path) as store:
+        stats = CleaningStats.fit(store, chunksize)
+
+    def clean(table, df):
+        if table == CORE_TABLE:
+            return stats.clean_core(df)
+        if table in ("ferm", ING_TABLE):
+            return stats.clean_ingredients(df)
+        return df
+
+    copy_store(path, out_path, clean, chunksize)
+    return stats
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to write a copy of all_recipes with the efficiencies "
+        "and fermentable yields cleaned."
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=RECIPE_FILE,
+        help=f"The all_recipes store. Default is {RECIPE_FILE}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=CLEAN_FILE,
+        help=f"Where to write the cleaned store. Default is {CLEAN_FILE}.",
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    stats = write_cleaned(args.file, args.output)
+    print(f"Replaced unacceptable efficiencies with {stats.mean_efficiency:.3f}.")
@@ -0,0 +1,172 @@
+"""Append-only, compressed archives of downloaded BeerXML files.
+
+Instead of writing one small file per recipe, the scrapers can append each
+recipe to an archive, and `xml2h5` can convert an archive by reading it
+sequentially. An archive is a series of records:
+
+    magic (4 bytes) | name length (uint32) | data length (uint32) | crc32 (uint32)
+    name (utf-8) | data (zlib compressed BeerXML)
+
+Records are only ever appended, so a crash can at worst leave a truncated last
+record, which is dropped (and overwritten by the next append). A damaged record
+anywhere else means the file was corrupted some other way, and raises a
+ValueError rather than losing the records after it.
+
+The origin of the recipes in an archive is the part of the file name before the
+first ".", so e.g. `brewtoad.xmllog` and `brewtoad.2.xmllog` both hold
+recipes from brewtoad.
+"""
+
+import os
+import struct
+import sys
+import zlib
+
+MAGIC = b"BXML"
+HEADER = struct.Struct("<4sIII")
+EXTENSION = ".xmllog"
+COMPRESSION_LEVEL = 6
+
+
+def archive_origin(path):
+    """Return the origin of the recipes in an archive, based on its name."""
+    return os.path.basename(path).split(".")[0]
+
+
+def _read_records(f, with_data=True):
+    """Yield (offset, name, data) for each complete record in an open archive.
+    If with_data is False, data is None and the payloads are skipped with a
+    seek rather than read (so their checksums aren't checked).
+
+    A truncated last record is skipped. Raise a ValueError for a damaged
+    record that more data follows."""
+    size = os.fstat(f.fileno()).st_size
+    while True:
+        offset = f.tell()
+        header = f.read(HEADER.size)
+        if not header:
+            return
+        if len(header) < HEADER.size:
+            print(f"Truncated record at {offset} in {f.name}.", file=sys.stderr)
+            return
+        magic, name_len, data_len, crc = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(
+                f"Corrupt record at {offset} in {f.name}, {size - offset} bytes "
+                "before the end."
+            )
+        end = offset + HEADER.size + name_len + data_len
+        if end > size:
+            print(f"Truncated record at {offset} in {f.name}.", file=sys.stderr)
+            return
+        name = f.read(name_len)
+        if with_data:
+            data = f.read(data_len)
+            if zlib.crc32(data) != crc:
+                # The data of the last record may not have been written yet
+                if end == size:
+                    print(f"Truncated record at {offset} in {f.name}.", file=sys.stderr)
+                    return
+                raise ValueError(
+                    f"Checksum mismatch in record at {offset} in {f.name}, "
+                    f"{size - end} bytes before the end."
+                )
+        else:
+            f.seek(data_len, os.SEEK_CUR)
+            data = None
+        yield offset, name.decode("utf-8"), data
+
+
+def read_archive(path):
+    """Yield (name, xml bytes) for every recipe in an archive, in the order
+    they were written."""
+    with open(path, "rb", buffering=1 << 20) as f:
+        for _, name, data in _read_records(f):
+            yield name, zlib.decompress(data)
+
+
+class ArchiveWriter:
+    """Append recipes to an archive. Supports `name in writer` to check if a
+    recipe has already been archived, so scrapers can skip it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.names = set()
+        end = 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                last = None
+                for offset, name, _ in _read_records(f, with_data=False):
+                    self.names.add(name)
+                    last = offset
+                    end = f.tell()
+                # Only the last record can have been cut short by a crash, so
+                # it's the only one whose data is checked
+                if last is not None:
+                    f.seek(last)
+                    if next(_read_records(f), None) is None:
+                        self.names.discard(name)
+                        end = last
+                size = os.fstat(f.fileno()).st_size
+            if end < size:
+                print(
+                    f"Dropping the truncated last record of {path} "
+                    f"({size - end} bytes).",
+                    file=sys.stderr,
+                )
+        self.f = open(path, "ab")
+        # Drop the truncated last record, if any
+        self.f.truncate(end)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, name, content):
+        """Append a recipe's BeerXML (bytes) to the archive under name."""
+        data = zlib.compress(content, COMPRESSION_LEVEL)
+        name_bytes = name.encode("utf-8")
+        self.f.write(HEADER.pack(MAGIC, len(name_bytes), len(data), zlib.crc32(data)))
+        self.f.write(name_bytes)
+        self.f.write(data)
+        self.names.add(name)
+
+    def flush(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+
+class DirectoryWriter:
+    """Write recipes as individual files in a directory. Has the same interface
+    as ArchiveWriter."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def __contains__(self, name):
+        return os.path.isfile(os.path.join(self.path, name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, name, content):
+        with open(os.path.join(self.path, name), "wb") as f:
+            f.write(content)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
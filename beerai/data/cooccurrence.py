@@ -0,0 +1,351 @@
+"""
+Count how often each pair of ingredients is used in the same recipe, over all
+the recipes and per style, to find ingredients that go together and the
+characteristic ingredients of a style.
+
+The counts are computed from recipe_vecs.h5, a chunk at a time in parallel:
+for the 0/1 matrix B of which ingredients each recipe of a chunk uses, B.T @ B
+counts the recipes using each pair, and for the matrix X of their amounts,
+X.T @ X is the amount-weighted co-occurrence (the sum over the recipes of the
+product of the amounts of the pair). Both are sparse, vocabulary x vocabulary,
+and summed over the chunks as they're done, so memory use depends on the
+number of pairs rather than of recipes.
+
+They're written to cooccurrence.h5, where the counts over all the recipes are
+under the style ALL (recipes without a style only count there), along with the
+number of recipes using each ingredient.
+
+    cooc = Cooccurrence()
+    cooc.partners("hop_cascade", style="american ipa")
+    cooc.characteristic("american ipa")
+
+or
+
+    python -m beerai.data.cooccurrence --partners hop_cascade --style "american ipa"
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+from joblib import delayed, Parallel
+from scipy import sparse
+
+from ..config import DATA_DIR
+from .instrument import add_arguments, enable_from_args, stage
+from .recipe2vec import (
+    CHUNK_SIZE,
+    RECIPE_FILE,
+    VECTOR_FILE,
+    VOCAB_FILE,
+    load_vocab,
+    n_vectors,
+)
+from .store import CORE_TABLE, open_store
+from .vocabulary import vocab_version
+from .xml2h5 import N_CPUS
+
+COOC_FILE = os.path.join(DATA_DIR, "processed/cooccurrence.h5")
+# The style under which the pairs of all the recipes are counted
+ALL = ""
+# Pairs used in fewer recipes than this are left out of the queries, as their
+# PMI is mostly noise
+MIN_COUNT = 5
+METRICS = ["pmi", "lift", "count", "amount"]
+
+
+def count_chunk(vec_path, recipe_path, start, columns, by_style):
+    """Return {style: (recipes, counts, amounts)} for the chunk of the vector
+    store starting at row start, where counts and amounts are the sparse
+    co-occurrence matrices of the ingredients in columns."""
+    with pd.HDFStore(vec_path, "r") as store:
+        vecs = store.select("vecs", start=start, stop=start + CHUNK_SIZE)
+    amounts = sparse.csr_matrix(
+        vecs.reindex(columns=columns, fill_value=0).to_numpy(np.float64)
+    )
+    used = amounts.copy()
+    used.data = (used.data > 0).astype(np.float64)
+    rows = {ALL: np.arange(len(vecs))}
+    if by_style:
+        with open_store(recipe_path) as store:
+            # The vectors are written in id order, so a range covers the chunk
+            core = store.select(
+                CORE_TABLE,
+                columns=["style_name"],
+                id_range=(vecs.index.min(), vecs.index.max() + 1),
+            )
+        styles = core["style_name"].astype(object).reindex(vecs.index).to_numpy()
+        for style in pd.unique(styles[pd.notna(styles)]):
+            rows[style] = np.flatnonzero(styles == style)
+    return {
+        style: (
+            len(r),
+            (used[r].T @ used[r]).tocsr(),
+            (amounts[r].T @ amounts[r]).tocsr(),
+        )
+        for style, r in rows.items()
+    }
+
+
+def count(
+    vec_path=VECTOR_FILE,
+    recipe_path=RECIPE_FILE,
+    vocab=None,
+    by_style=True,
+    jobs=N_CPUS,
+):
+    """Return {style: (recipes, counts, amounts)} over all the vectors in
+    vec_path (see count_chunk), with the chunks counted in parallel."""
+    if vocab is None:
+        vocab = load_vocab(VOCAB_FILE)
+    columns = sorted(vocab.values())
+    parts = Parallel(n_jobs=jobs, return_as="generator")(
+        delayed(count_chunk)(vec_path, recipe_path, start, columns, by_style)
+        for start in range(0, n_vectors(vec_path), CHUNK_SIZE)
+    )
+    totals = {}
+    for chunk, part in enumerate(parts):
+        with stage("merge", chunk=chunk) as s:
+            for style, (n, counts, amounts) in part.items():
+                if style in totals:
+                    n_total, counts_total, amounts_total = totals[style]
+                    n, counts, amounts = (
+                        n + n_total,
+                        counts + counts_total,
+                        amounts + amounts_total,
+                    )
+                totals[style] = (n, counts, amounts)
+            s.rows = part[ALL][0]
+    return totals
+
+
+def save(totals, vocab, path=COOC_FILE):
+    """Write the counts from count to path: the pairs (a < b) and the
+    ingredients of each style, and the number of recipes of each style."""
+    pairs, ingredients, recipes = [], [], {}
+    columns = np.array(sorted(vocab.values()))
+    for style, (n, counts, amounts) in totals.items():
+        used = counts.diagonal()
+        ingredients.append(
+            pd.DataFrame(
+                {
+                    "style": style,
+                    "ingredient": columns[used > 0],
+                    "count": used[used > 0].astype(np.int64),
+                }
+            )
+        )
+        upper = sparse.triu(counts, k=1).tocoo()
+        pairs.append(
+            pd.DataFrame(
+                {
+                    "style": style,
+                    "a": columns[upper.row],
+                    "b": columns[upper.col],
+                    "count": upper.data.astype(np.int64),
+                    "amount": np.asarray(amounts[upper.row, upper.col]).ravel(),
+                }
+            )
+        )
+        recipes[style] = n
+    pairs = pd.concat(pairs, ignore_index=True)
+    ingredients = pd.concat(ingredients, ignore_index=True)
+    min_itemsize = {"style": max(1, *(len(style) for style in recipes))}
+    with pd.HDFStore(path, "w", complevel=9, complib="blosc") as store:
+        store.put(
+            "pairs",
+            pairs,
+            format="table",
+            data_columns=["style", "a", "b"],
+            min_itemsize=min_itemsize,
+        )
+        store.put(
+            "ingredients",
+            ingredients,
+            format="table",
+            data_columns=["style"],
+            min_itemsize=min_itemsize,
+        )
+        store.put("recipes", pd.Series(recipes, name="recipes"))
+        store.put("meta", pd.Series({"vocab_version": vocab_version(vocab)}))
+
+
+class Cooccurrence:
+    """Queries on the counts written by save. Only the pairs a query needs are
+    read from the file."""
+
+    def __init__(self, path=COOC_FILE, vocab=None):
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        self.path = path
+        self.vocab = vocab
+        self.names = {i: name for name, i in vocab.items()}
+        with pd.HDFStore(path, "r") as store:
+            self.recipes = store.get("recipes")
+            version = store.get("meta")["vocab_version"]
+        if version != vocab_version(vocab):
+            raise ValueError(
+                f"{path} was counted with vocabulary {version}, but the "
+                f"vocabulary is {vocab_version(vocab)}. Rerun python -m "
+                "beerai.data.cooccurrence."
+            )
+
+    def _select(self, key, where):
+        with pd.HDFStore(self.path, "r") as store:
+            return store.select(key, where=where)
+
+    def _check_style(self, style):
+        if style not in self.recipes.index:
+            raise KeyError(f"No recipes of style {style!r}")
+
+    def ingredient_counts(self, style=ALL):
+        """Return the number of recipes of a style using each ingredient."""
+        self._check_style(style)
+        used = self._select("ingredients", f"style == {style!r}")
+        return used.set_index("ingredient")["count"].rename(index=self.names)
+
+    def partners(self, ingredient, style=ALL, by="pmi", k=10, min_count=MIN_COUNT):
+        """Return the k ingredients most used with ingredient (a name of the
+        vocabulary, e.g. "hop_cascade") in the recipes of a style, by:
+
+        - pmi: the log of the lift
+        - lift: how many times more often the pair is used than if the two
+          were used independently, P(a, b) / (P(a) P(b))
+        - count: the number of recipes using both
+        - amount: the amount-weighted co-occurrence
+
+        Pairs used in fewer than min_count recipes are left out."""
+        if by not in METRICS:
+            raise ValueError(f"by must be one of {METRICS}")
+        if ingredient not in self.vocab:
+            raise KeyError(f"{ingredient!r} isn't in the vocabulary")
+        self._check_style(style)
+        i = self.vocab[ingredient]
+        pairs = self._select("pairs", f"style == {style!r} & (a == {i} | b == {i})")
+        used = self.ingredient_counts(style).rename(index=self.vocab)
+        pairs["partner"] = pairs["b"].where(pairs["a"] == i, pairs["a"])
+        pairs = pairs[pairs["count"] >= min_count]
+        if i not in used.index:
+            pairs = pairs.iloc[:0]
+        pairs["lift"] = (
+            pairs["count"]
+            * self.recipes[style]
+            / (used.get(i, 0) * pairs["partner"].map(used))
+        )
+        pairs["pmi"] = np.log(pairs["lift"])
+        pairs["partner"] = pairs["partner"].map(self.names)
+        return (
+            pairs.set_index("partner")[["count", "amount", "lift", "pmi"]]
+            .sort_values(by, ascending=False)
+            .head(k)
+        )
+
+    def characteristic(self, style, k=10, min_count=MIN_COUNT):
+        """Return the k ingredients most over-represented in the recipes of a
+        style compared to all the recipes, with the share of the style's
+        recipes and of all the recipes using them, and the lift (the ratio of
+        the two)."""
+        in_style = self.ingredient_counts(style)
+        overall = self.ingredient_counts(ALL)
+        in_style = in_style[in_style >= min_count]
+        df = pd.DataFrame(
+            {
+                "count": in_style,
+                "share": in_style / self.recipes[style],
+                "share_all": overall.reindex(in_style.index) / self.recipes[ALL],
+            }
+        )
+        df["lift"] = df["share"] / df["share_all"]
+        return df.sort_values("lift", ascending=False).head(k)
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to count how often each pair of ingredients is "
+        "used in the same recipe, or to query the counts."
+    )
+    parser.add_argument(
+        "-v",
+        "--vectors",
+        default=VECTOR_FILE,
+        help=f"The recipe vectors. Default is {VECTOR_FILE}.",
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=RECIPE_FILE,
+        help=f"The all_recipes store with the styles. Default is {RECIPE_FILE}.",
+    )
+    parser.add_argument(
+        "--vocab",
+        default=VOCAB_FILE,
+        help=f"The vocabulary the vectors were made with. Default is {VOCAB_FILE}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=COOC_FILE,
+        help=f"Where to write the counts. Default is {COOC_FILE}.",
+    )
+    parser.add_argument(
+        "--no-styles",
+        action="store_true",
+        help="Only count the pairs over all the recipes, not per style.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=N_CPUS,
+        help="Number of processors to use. Default is all of them.",
+    )
+    parser.add_argument(
+        "-p",
+        "--partners",
+        metavar="INGREDIENT",
+        help="Rather than counting, print the top partners of INGREDIENT (e.g. "
+        "hop_cascade) from the counts in --output.",
+    )
+    parser.add_argument(
+        "-c",
+        "--characteristic",
+        action="store_true",
+        help="Rather than counting, print the characteristic ingredients of "
+        "--style from the counts in --output.",
+    )
+    parser.add_argument(
+        "-s",
+        "--style",
+        default=ALL,
+        help="The style to query. Default is all the recipes.",
+    )
+    parser.add_argument(
+        "--by",
+        choices=METRICS,
+        default="pmi",
+        help="What to rank the partners by. Default is pmi.",
+    )
+    parser.add_argument(
+        "-k", type=int, default=10, help="Number of ingredients. Default is 10."
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+    vocab = load_vocab(args.vocab)
+
+    if args.partners or args.characteristic:
+        cooc = Cooccurrence(args.output, vocab)
+        if args.partners:
+            print(cooc.partners(args.partners, args.style, args.by, args.k))
+        else:
+            print(cooc.characteristic(args.style, args.k))
+    else:
+        totals = count(args.vectors, args.file, vocab, not args.no_styles, args.jobs)
+        save(totals, vocab, args.output)
+        print(f"Counted the pairs of {totals[ALL][0]} recipes.")
@@ -0,0 +1,271 @@
+"""
+Find groups of near-duplicate recipes (clones, re-uploads and recipes copied
+with small changes) and pick a canonical recipe of each group.
+
+Each recipe is turned into a set of tokens from its vector in recipe_vecs.h5,
+so with the standard ingredient names: a token per ingredient, and two per
+ingredient and amount, with the amounts bucketed on a log scale (a bucket is
+AMOUNT_RATIO times bigger than the one before) twice, the second time shifted
+by half a bucket. Recipes with the same ingredients in slightly different
+amounts share most of their tokens.
+
+The MinHash signature of a recipe (NUM_HASHES minimums of random hash
+functions over its tokens) estimates the Jaccard similarity of two token sets
+as the fraction of equal minimums. The signatures are computed a chunk at a
+time in parallel, and split in BANDS bands: recipes with an identical band are
+candidates (LSH banding), which finds pairs with a similarity of about
+(1 / BANDS) ** (BANDS / NUM_HASHES) and over without comparing every pair.
+Candidates whose estimated similarity is at least THRESHOLD are linked, and
+the connected groups of recipes are the duplicates, whose canonical recipe is
+the one with the lowest id (the first one scraped).
+
+The canonical id of every recipe is written to DEDUP_FILE, indexed by recipe
+id so it can be joined to the `core` table, and canonical recipes (those whose
+canonical id is their own) are kept with:
+
+    canonical = load_canonical()
+    core = core[canonical.reindex(core.index).eq(core.index)]
+
+or
+
+    python -m beerai.data.dedup
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+from joblib import delayed, Parallel
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from ..config import DATA_DIR
+from .instrument import add_arguments, enable_from_args, stage
+from .recipe2vec import (
+    CHUNK_SIZE,
+    VECTOR_FILE,
+    VOCAB_FILE,
+    load_vocab,
+    n_vectors,
+)
+from .xml2h5 import N_CPUS
+
+DEDUP_FILE = os.path.join(DATA_DIR, "interim/recipe_duplicates.h5")
+NUM_HASHES = 64
+BANDS = 16
+# Minimum estimated Jaccard similarity of the token sets of duplicates
+THRESHOLD = 0.8
+AMOUNT_RATIO = 1.25
+# Amounts are bucketed between AMOUNT_RATIO ** -MAX_BUCKET and ** MAX_BUCKET
+MAX_BUCKET = 100
+# Tokens per ingredient: the amount buckets of the two bucketings (see
+# recipe_tokens) and the ingredient on its own
+TOKENS_PER_INGREDIENT = 2 * (2 * MAX_BUCKET + 1) + 1
+# The hash functions are (a * token + b) mod PRIME
+PRIME = (1 << 31) - 1
+PRIME_64 = np.uint64(PRIME)
+# Hash functions computed at once, to bound the memory of a chunk
+HASH_BLOCK = 16
+
+
+def recipe_tokens(vecs, columns):
+    """Return the tokens of recipe vectors as a sparse (recipes, tokens)
+    matrix, whose indices are the tokens of each recipe."""
+    amounts = sparse.csr_matrix(
+        vecs.reindex(columns=columns, fill_value=0).to_numpy(np.float64)
+    )
+    amounts.eliminate_zeros()
+    rows = np.repeat(np.arange(amounts.shape[0]), np.diff(amounts.indptr))
+    log_amount = np.log(np.abs(amounts.data)) / np.log(AMOUNT_RATIO)
+    ingredient = amounts.indices.astype(np.int64) * TOKENS_PER_INGREDIENT
+    tokens = [ingredient + TOKENS_PER_INGREDIENT - 1]
+    # A second bucketing, shifted by half a bucket, so that an amount close to
+    # the edge of a bucket keeps one of its two amount tokens when it changes
+    # a little
+    for i, shift in enumerate([0, 0.5]):
+        bucket = np.clip(np.floor(log_amount + shift), -MAX_BUCKET, MAX_BUCKET)
+        offset = i * (2 * MAX_BUCKET + 1) + MAX_BUCKET
+        tokens.append(ingredient + offset + bucket.astype(np.int64))
+    tokens = np.concatenate(tokens)
+    return sparse.csr_matrix(
+        (np.ones(len(tokens), dtype=np.int8), (np.tile(rows, 3), tokens)),
+        shape=(amounts.shape[0], len(columns) * TOKENS_PER_INGREDIENT),
+    )
+
+
+def hash_params(seed=0):
+    """Return the coefficients of the NUM_HASHES hash functions, and the
+    multipliers that hash each band of a signature to one key."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, PRIME, NUM_HASHES, dtype=np.uint64)
+    b = rng.integers(0, PRIME, NUM_HASHES, dtype=np.uint64)
+    band_multipliers = rng.integers(
+        1, np.iinfo(np.uint64).max, NUM_HASHES // BANDS, dtype=np.uint64
+    )
+    return a, b, band_multipliers | np.uint64(1)
+
+
+def signatures(tokens, a, b):
+    """Return the MinHash signatures (recipes, NUM_HASHES) of a token matrix
+    from recipe_tokens. Recipes without tokens get PRIME everywhere."""
+    n = tokens.shape[0]
+    sigs = np.full((n, len(a)), PRIME, dtype=np.uint32)
+    nonempty = np.diff(tokens.indptr) > 0
+    if not nonempty.any():
+        return sigs
+    values = tokens.indices.astype(np.uint64)
+    starts = tokens.indptr[:-1][nonempty]
+    for i in range(0, len(a), HASH_BLOCK):
+        block = slice(i, i + HASH_BLOCK)
+        hashes = (values[:, None] * a[None, block] + b[None, block]) % PRIME_64
+        sigs[nonempty, block] = np.minimum.reduceat(hashes, starts, axis=0)
+    return sigs
+
+
+def band_keys(sigs, band_multipliers):
+    """Return the key (recipes, BANDS) of each band of the signatures."""
+    bands = sigs.astype(np.uint64).reshape(len(sigs), BANDS, -1)
+    # Overflow wraps around, which is what a hash wants
+    with np.errstate(over="ignore"):
+        return (bands * band_multipliers).sum(axis=2, dtype=np.uint64)
+
+
+def sign_chunk(vec_path, start, columns, seed):
+    """Return the ids, signatures and band keys of the chunk of the vector
+    store starting at row start."""
+    with pd.HDFStore(vec_path, "r") as store:
+        vecs = store.select("vecs", start=start, stop=start + CHUNK_SIZE)
+    a, b, band_multipliers = hash_params(seed)
+    tokens = recipe_tokens(vecs, columns)
+    sigs = signatures(tokens, a, b)
+    keys = band_keys(sigs, band_multipliers)
+    return vecs.index.to_numpy(), sigs, keys, np.diff(tokens.indptr) > 0
+
+
+def candidate_edges(sigs, keys, nonempty, threshold=THRESHOLD):
+    """Return the (rows, rows) pairs of recipes with an identical band whose
+    estimated similarity is at least threshold. Each recipe of a bucket is
+    compared to the first recipe of the bucket only, so that big buckets
+    don't take quadratic time. Recipes without ingredients (nonempty False)
+    aren't duplicates of anything."""
+    src, dst = [], []
+    for band in range(keys.shape[1]):
+        order = np.argsort(keys[:, band], kind="stable")
+        sorted_keys = keys[order, band]
+        new_bucket = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        bucket_start = np.where(new_bucket, np.arange(len(order)), 0)
+        first = order[np.maximum.accumulate(bucket_start)]
+        pair = (order != first) & nonempty[order]
+        members, firsts = order[pair], first[pair]
+        similarity = (sigs[members] == sigs[firsts]).mean(axis=1)
+        close = similarity >= threshold
+        src.append(members[close])
+        dst.append(firsts[close])
+    return np.concatenate(src), np.concatenate(dst)
+
+
+def find_duplicates(
+    vec_path=VECTOR_FILE, vocab=None, threshold=THRESHOLD, seed=0, jobs=N_CPUS
+):
+    """Return the canonical id of each recipe in vec_path (see the module
+    docstring), as a Series indexed by recipe id."""
+    if vocab is None:
+        vocab = load_vocab(VOCAB_FILE)
+    columns = sorted(vocab.values())
+    parts = Parallel(n_jobs=jobs, return_as="generator")(
+        delayed(sign_chunk)(vec_path, start, columns, seed)
+        for start in range(0, n_vectors(vec_path), CHUNK_SIZE)
+    )
+    ids, sigs, keys, nonempty = [], [], [], []
+    for chunk, part in enumerate(parts):
+        with stage("signatures", chunk=chunk) as s:
+            for parts_list, values in zip((ids, sigs, keys, nonempty), part):
+                parts_list.append(values)
+            s.rows = len(part[0])
+    ids = np.concatenate(ids)
+    sigs = np.concatenate(sigs)
+    keys = np.concatenate(keys)
+    nonempty = np.concatenate(nonempty)
+    with stage("group") as s:
+        src, dst = candidate_edges(sigs, keys, nonempty, threshold)
+        graph = sparse.coo_matrix(
+            (np.ones(len(src), dtype=np.int8), (src, dst)),
+            shape=(len(ids), len(ids)),
+        )
+        _, labels = connected_components(graph, directed=False)
+        canonical = pd.Series(ids).groupby(labels).transform("min")
+        s.rows = len(ids)
+    return pd.Series(
+        canonical.to_numpy(), index=pd.Index(ids, name="id"), name="canonical_id"
+    )
+
+
+def save(canonical, path=DEDUP_FILE):
+    canonical.to_hdf(path, key="canonical", mode="w", format="table", complevel=9)
+
+
+def load_canonical(path=DEDUP_FILE):
+    """Return the canonical id of each recipe written by save."""
+    return pd.read_hdf(path, "canonical")
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to find groups of near-duplicate recipes and the "
+        "canonical recipe of each group."
+    )
+    parser.add_argument(
+        "-v",
+        "--vectors",
+        default=VECTOR_FILE,
+        help=f"The recipe vectors. Default is {VECTOR_FILE}.",
+    )
+    parser.add_argument(
+        "--vocab",
+        default=VOCAB_FILE,
+        help=f"The vocabulary the vectors were made with. Default is {VOCAB_FILE}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=DEDUP_FILE,
+        help=f"Where to write the canonical ids. Default is {DEDUP_FILE}.",
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="Minimum estimated Jaccard similarity of duplicates. "
+        f"Default is {THRESHOLD}.",
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, default=0, help="Random seed. Default is 0."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=N_CPUS,
+        help="Number of processors to use. Default is all of them.",
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    canonical = find_duplicates(
+        args.vectors, load_vocab(args.vocab), args.threshold, args.seed, args.jobs
+    )
+    save(canonical, args.output)
+    duplicates = canonical.index != canonical.to_numpy()
+    groups = canonical[duplicates].nunique()
+    print(
+        f"{duplicates.sum()} of {len(canonical)} recipes are duplicates of "
+        f"{groups} canonical recipes."
+    )
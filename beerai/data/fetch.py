@@ -0,0 +1,108 @@
+"""Shared asyncio machinery for downloading recipes from a website without
+hammering it: a per-host rate limiter, retries with exponential backoff, a
+keep-alive session and a bounded pool of workers."""
+
+import aiohttp
+import asyncio
+import random
+import sys
+import time
+
+from urllib.parse import urlsplit
+
+USERAGENT = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
+}
+# Number of requests in flight at once
+CONCURRENCY = 8
+# Maximum requests started per second, per host. 0 means no limit.
+RATE = 4.0
+RETRIES = 4
+# Seconds to wait before the first retry. Doubles on each retry.
+BACKOFF = 1.0
+TIMEOUT = 60
+# Statuses that are worth retrying. Anything else that isn't 200 is skipped.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Space out the requests to each host so that at most `rate` of them
+    start per second."""
+
+    def __init__(self, rate=RATE):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_start = {}
+
+    async def wait(self, url):
+        """Sleep until a request to url's host is allowed to start."""
+        host = urlsplit(url).netloc
+        now = time.monotonic()
+        # No await between reading and updating, so this is safe without a lock
+        start = max(now, self._next_start.get(host, now))
+        self._next_start[host] = start + self.interval
+        await asyncio.sleep(start - now)
+
+
+def make_session(concurrency=CONCURRENCY, timeout=TIMEOUT):
+    """Return a session that keeps connections alive between requests. Must be
+    called from inside a running event loop."""
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60)
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers=USERAGENT,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    )
+
+
+async def fetch(session, url, limiter, retries=RETRIES, backoff=BACKOFF):
+    """GET url and return the body as bytes. Connection errors, timeouts and
+    the statuses in RETRY_STATUSES are retried with exponential backoff. Return
+    None if the request fails for good."""
+    for attempt in range(retries + 1):
+        await limiter.wait(url)
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return await response.read()
+                if response.status not in RETRY_STATUSES:
+                    print(f"Got status {response.status} for {url}.", file=sys.stderr)
+                    return None
+                error = f"status {response.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = repr(e)
+        if attempt < retries:
+            # Jitter so that workers that failed together don't retry together
+            await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+    print(f"Giving up on {url} after {retries + 1} tries ({error}).", file=sys.stderr)
+    return None
+
+
+async def consume(queue, worker):
+    """Call the coroutine function worker on items from queue until a None
+    item is received."""
+    while True:
+        item = await queue.get()
+        try:
+            if item is None:
+                return
+            await worker(item)
+        finally:
+            queue.task_done()
+
+
+async def run_pool(items, worker, concurrency=CONCURRENCY):
+    """Call the coroutine function worker on every item of an iterable, with at
+    most `concurrency` calls in flight."""
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    consumers = [
+        asyncio.create_task(consume(queue, worker)) for _ in range(concurrency)
+    ]
+
+    async def produce():
+        for item in items:
+            await queue.put(item)
+        for _ in consumers:
+            await queue.put(None)
+
+    await asyncio.gather(produce(), *consumers)
@@ -0,0 +1,294 @@
+"""Timing and memory instrumentation for the data pipeline.
+
+Stages of the pipeline are wrapped in `stage`:
+
+    with stage("apply_map", chunk=i) as s:
+        df = apply_map(df, maps)
+        s.rows = len(df)
+
+When instrumentation is enabled, every stage writes a JSON line with its wall
+time, rows/sec, the peak RSS of the process so far and the bytes the process
+read and wrote during the stage (from /proc/self/io, so Linux only). A
+summary table of the totals per stage is printed to stderr at exit.
+
+Stages can also be profiled with cProfile (stats for each profiled stage are
+written to `<stage>.prof` at exit), and tracemalloc can record the peak of the
+Python allocations during each stage. tracemalloc has a single peak, so a
+stage's peak is reset by the stages nested in it.
+
+Instrumentation is enabled by `enable`, the `--instrument` flag of the
+pipeline's scripts (see add_arguments) or by setting BEERAI_INSTRUMENT to the
+file to write the JSON lines to ("-" for stderr). BEERAI_PROFILE (comma
+separated stage names) and BEERAI_TRACEMALLOC=1 do the same as --profile and
+--trace-memory. When it's disabled, `stage` returns a shared no-op context, so
+instrumented code costs one function call per stage.
+"""
+
+import atexit
+import cProfile
+import json
+import os
+import pandas as pd
+import sys
+import time
+import tracemalloc
+
+from itertools import count
+
+try:
+    import resource
+except ImportError:  # Not on Windows
+    resource = None
+
+ENV_VAR = "BEERAI_INSTRUMENT"
+PROFILE_ENV_VAR = "BEERAI_PROFILE"
+TRACEMALLOC_ENV_VAR = "BEERAI_TRACEMALLOC"
+IO_FILE = "/proc/self/io"
+MB = 1e6
+
+_recorder = None
+
+
+def peak_rss():
+    """Return the peak resident set size of the process in bytes, or None if
+    it can't be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def io_counters():
+    """Return (bytes read, bytes written) by the process so far, or (None,
+    None) if they can't be read. These count all reads and writes, including
+    those served by the page cache."""
+    try:
+        with open(IO_FILE) as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None, None
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+class _NullStage:
+    """What `stage` returns when instrumentation is disabled."""
+
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def discard(self):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+class Stage:
+    """A single run of a stage. Set `rows` to the number of rows the stage
+    processed to get its rows/sec."""
+
+    def __init__(self, recorder, name, fields):
+        self.recorder = recorder
+        self.name = name
+        self.fields = fields
+        self.rows = None
+        self.profiler = None
+        self._discarded = False
+
+    def discard(self):
+        """Don't record this run (e.g. it turned out there was nothing to
+        do)."""
+        self._discarded = True
+
+    def __enter__(self):
+        self.profiler = self.recorder.start_profile(self.name)
+        if self.recorder.trace_memory:
+            tracemalloc.reset_peak()
+        self.read, self.written = io_counters()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        read, written = io_counters()
+        if self.profiler is not None:
+            self.recorder.stop_profile(self.profiler)
+        if self._discarded:
+            return False
+        record = {"stage": self.name, **self.fields, "seconds": seconds}
+        record["rows"] = self.rows
+        record["rows_per_s"] = (
+            self.rows / seconds if self.rows is not None and seconds > 0 else None
+        )
+        record["peak_rss_bytes"] = peak_rss()
+        record["read_bytes"] = None if read is None else read - self.read
+        record["written_bytes"] = None if written is None else written - self.written
+        if self.recorder.trace_memory:
+            record["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        self.recorder.record(record)
+        return False
+
+
+class Recorder:
+    """Writes the records of every stage and keeps totals per stage."""
+
+    def __init__(self, path="-", profile=(), trace_memory=False):
+        if path == "-":
+            self.out = sys.stderr
+        else:
+            self.out = open(path, "a")
+        self.profile = set(profile)
+        self.profilers = {}
+        self._profiling = False
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # stage -> {total: value}
+        self.totals = {}
+
+    def record(self, record):
+        print(json.dumps(record), file=self.out, flush=True)
+        keys = ["seconds", "rows", "read_bytes", "written_bytes"]
+        totals = self.totals.setdefault(
+            record["stage"], {"calls": 0, **{key: 0 for key in keys}}
+        )
+        totals["calls"] += 1
+        for key in keys:
+            totals[key] += record[key] or 0
+        totals["peak_rss_bytes"] = record["peak_rss_bytes"]
+
+    def start_profile(self, name):
+        """Start the cProfile profiler of a stage, if it's profiled. Only one
+        profiler can be active, so stages nested in a profiled stage aren't
+        profiled separately."""
+        if name not in self.profile or self._profiling:
+            return None
+        profiler = self.profilers.setdefault(name, cProfile.Profile())
+        profiler.enable()
+        self._profiling = True
+        return profiler
+
+    def stop_profile(self, profiler):
+        profiler.disable()
+        self._profiling = False
+
+    def summary(self):
+        """Return a DataFrame of the totals per stage."""
+        df = pd.DataFrame.from_dict(self.totals, orient="index")
+        if df.empty:
+            return df
+        df["rows/s"] = (df["rows"] / df["seconds"]).where(df["rows"] > 0)
+        for col in ["peak_rss_bytes", "read_bytes", "written_bytes"]:
+            df[col.replace("_bytes", " (MB)")] = df.pop(col) / MB
+        df.index.name = "stage"
+        return df
+
+    def close(self):
+        for name, profiler in self.profilers.items():
+            profiler.dump_stats(f"{name}.prof")
+        if self.totals:
+            print(self.summary().round(3).to_string(), file=sys.stderr)
+        if self.out is not sys.stderr:
+            self.out.close()
+
+
+def enabled():
+    return _recorder is not None
+
+
+def enable(path="-", profile=(), trace_memory=False):
+    """Start recording stages to path ("-" for stderr). profile is a list of
+    stage names to run under cProfile, trace_memory turns on tracemalloc. The
+    summary is printed when the process exits (or `disable` is called)."""
+    global _recorder
+    disable()
+    _recorder = Recorder(path, profile, trace_memory)
+    atexit.register(disable)
+
+
+def disable():
+    """Stop recording and print the summary."""
+    global _recorder
+    if _recorder is not None:
+        recorder, _recorder = _recorder, None
+        recorder.close()
+        atexit.unregister(disable)
+
+
+def stage(name, **fields):
+    """Return a context manager recording a run of a stage. fields (e.g. the
+    chunk number) are added to its record."""
+    if _recorder is None:
+        return NULL_STAGE
+    return Stage(_recorder, name, fields)
+
+
+def iterate(name, iterable, rows=len):
+    """Iterate over iterable, recording the production of each item (e.g.
+    reading a chunk) as a run of a stage. rows gives the number of rows of an
+    item."""
+    if _recorder is None:
+        return iter(iterable)
+    return _iterate(name, iterable, rows)
+
+
+def _iterate(name, iterable, rows):
+    items = iter(iterable)
+    done = object()
+    for chunk in count():
+        with stage(name, chunk=chunk) as s:
+            item = next(items, done)
+            if item is done:
+                s.discard()
+                return
+            s.rows = rows(item)
+        yield item
+
+
+def add_arguments(parser):
+    """Add the instrumentation options to a script's argparser."""
+    parser.add_argument(
+        "--instrument",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="Record the time, rows/sec, memory and I/O of each stage as JSON "
+        "lines in FILE (stderr if not given), and print a summary at the end.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        default=[],
+        metavar="STAGE",
+        help="With --instrument, run a stage under cProfile and write its "
+        "stats to STAGE.prof. Can pass argument multiple times.",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="With --instrument, record the peak Python memory allocated in "
+        "each stage with tracemalloc (slow).",
+    )
+
+
+def enable_from_args(args):
+    """Enable instrumentation if the options from add_arguments ask for it."""
+    if args.instrument:
+        enable(args.instrument, args.profile, args.trace_memory)
+
+
+def enable_from_env():
+    """Enable instrumentation if BEERAI_INSTRUMENT is set."""
+    path = os.environ.get(ENV_VAR)
+    if path and not enabled():
+        profile = [s for s in os.environ.get(PROFILE_ENV_VAR, "").split(",") if s]
+        enable(path, profile, os.environ.get(TRACEMALLOC_ENV_VAR) == "1")
+
+
+enable_from_env()
@@ -0,0 +1,201 @@
+"""Inverted index from ingredient names to the recipes that use them.
+
+For every ingredient category, both the raw names (as stored in the
+`ingredients` table) and the standard names (as given by the ingredient maps)
+point to a sorted array of recipe ids. The arrays are delta encoded and zlib
+compressed, so the whole index is small enough to load in one go.
+
+    index = NameIndex.load(index_path("all_recipes.h5"))
+    # Recipes with cascade and (us-05 or wlp001)
+    ids = index.recipes(
+        all_of=[("hop", "cascade")],
+        any_of=[("yeast", "us-05"), ("yeast", "wlp001")],
+        canonical=True,
+    )
+"""
+
+import argparse
+import numpy as np
+import os
+import pickle
+import zlib
+
+from collections import defaultdict
+from functools import reduce
+
+from ..config import DATA_DIR, INGREDIENT_CATEGORIES
+from .store import PARQUET_EXTENSION, open_store, select_category
+from .vocabulary import load_maps
+
+RECIPE_FILE = os.path.join(DATA_DIR, "interim/all_recipes.h5")
+CHUNK_SIZE = 100000
+EMPTY = np.array([], dtype=np.int64)
+
+
+def index_path(path):
+    """Return the path of the index that goes with a recipe store. A Parquet
+    store keeps its index inside the store's directory."""
+    path = path.rstrip(os.sep)
+    if path.endswith(PARQUET_EXTENSION):
+        return os.path.join(path, "name_index.pickle")
+    return os.path.splitext(path)[0] + "_index.pickle"
+
+
+def compress_ids(ids):
+    """Delta encode a sorted array of unique ids with the smallest unsigned
+    integer type that fits, and compress it."""
+    deltas = np.diff(np.asarray(ids, dtype=np.int64), prepend=0)
+    dtype = np.min_scalar_type(deltas.max()) if len(deltas) else np.uint8
+    return np.dtype(dtype).str, zlib.compress(deltas.astype(dtype).tobytes())
+
+
+def decompress_ids(entry):
+    """Inverse of `compress_ids`."""
+    dtype, blob = entry
+    deltas = np.frombuffer(zlib.decompress(blob), dtype=dtype)
+    return np.cumsum(deltas, dtype=np.int64)
+
+
+class NameIndex:
+    """Map (category, name) -> sorted recipe ids, for raw and standard
+    ingredient names."""
+
+    def __init__(self, raw=None, canonical=None):
+        # {category: {name: compressed ids}}
+        self.raw = raw or {cat: {} for cat in INGREDIENT_CATEGORIES}
+        self.canonical = canonical or {cat: {} for cat in INGREDIENT_CATEGORIES}
+
+    @classmethod
+    def from_frames(cls, frames, maps=None):
+        """Build an index from an iterable of ingredient DataFrames (index is
+        the recipe id, with a `<category>_name` column per category). If maps
+        is given, the standard names are indexed too."""
+        postings = {cat: defaultdict(list) for cat in INGREDIENT_CATEGORIES}
+        for df in frames:
+            for category in INGREDIENT_CATEGORIES:
+                col = f"{category}_name"
+                if col not in df.columns:
+                    continue
+                names = df[col].dropna().astype(object)
+                groups = names.index.to_series().groupby(names.values)
+                for name, ids in groups:
+                    postings[category][name].append(ids.values)
+
+        raw = {}
+        for category, cat_postings in postings.items():
+            raw[category] = {
+                name: compress_ids(np.unique(np.concatenate(ids)))
+                for name, ids in cat_postings.items()
+            }
+        index = cls(raw=raw)
+        if maps is not None:
+            index.remap(maps)
+        return index
+
+    @classmethod
+    def from_store(cls, path, maps=None, chunksize=CHUNK_SIZE):
+        """Build an index with a chunked pass over the name column of each
+        ingredient category in a recipe store."""
+        with open_store(path) as store:
+            frames = (
+                df
+                for cat in INGREDIENT_CATEGORIES
+                for df in select_category(
+                    store, cat, columns=[f"{cat}_name"], chunksize=chunksize
+                )
+            )
+            return cls.from_frames(frames, maps)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(**pickle.load(f))
+
+    def save(self, path):
+        # Written next to path and moved over it, so that readers (e.g.
+        # recipe2vec.update_vectors) never see a partly written index
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"raw": self.raw, "canonical": self.canonical}, f)
+        os.replace(tmp, path)
+
+    def remap(self, maps):
+        """(Re)compute the standard name entries from the raw entries, given
+        the ingredient maps (category -> map). Raw names missing from a map
+        are not included."""
+        for category, ing_map in maps.items():
+            targets = defaultdict(list)
+            for name, target in ing_map.items():
+                entry = self.raw[category].get(name)
+                if entry is not None:
+                    targets[target].append(decompress_ids(entry))
+            self.canonical[category] = {
+                target: compress_ids(reduce(np.union1d, ids))
+                for target, ids in targets.items()
+            }
+
+    def lookup(self, category, name, canonical=False):
+        """Return the sorted ids of recipes using an ingredient."""
+        entries = self.canonical if canonical else self.raw
+        entry = entries[category].get(name)
+        if entry is None:
+            return EMPTY
+        return decompress_ids(entry)
+
+    def names(self, category, canonical=False):
+        """Return the indexed names for a category."""
+        entries = self.canonical if canonical else self.raw
+        return sorted(entries[category])
+
+    def count(self, category, name, canonical=False):
+        """Return the number of recipes using an ingredient."""
+        return len(self.lookup(category, name, canonical))
+
+    def recipes(self, all_of=(), any_of=(), canonical=False):
+        """Return the sorted ids of recipes that use every ingredient in
+        all_of and at least one of the ingredients in any_of. Ingredients are
+        given as (category, name) pairs. Either list may be empty, but not
+        both."""
+        if not all_of and not any_of:
+            raise ValueError("Need at least one ingredient to query.")
+        # Intersect the shortest lists first to keep intermediate results small
+        lists = sorted(
+            (self.lookup(cat, name, canonical) for cat, name in all_of), key=len
+        )
+        if any_of:
+            lists.append(
+                reduce(
+                    np.union1d,
+                    [self.lookup(cat, name, canonical) for cat, name in any_of],
+                )
+            )
+        return reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True), lists)
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to build the ingredient name -> recipe index for "
+        "an existing recipe store."
+    )
+    parser.add_argument(
+        "-f",
+        "--filename",
+        default=RECIPE_FILE,
+        help="Recipe store (HDF or Parquet directory) to index. Default is "
+        "`data/interim/all_recipes.h5`.",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+
+    try:
+        maps = load_maps()
+    except FileNotFoundError:
+        print("Ingredient maps not found. Only indexing raw names.")
+        maps = None
+    index = NameIndex.from_store(args.filename, maps)
+    index.save(index_path(args.filename))
+    print(f"Saved {index_path(args.filename)}.")
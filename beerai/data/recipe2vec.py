@@ -3,14 +3,20 @@ Given a recipe (or recipes), convert the recipe to a vector for use in training
 a model.
 """
 
+import argparse
 import os
 import pandas as pd
 import pickle
+import sys
 
 from tqdm import tqdm
 
 from ..config import DATA_DIR, INGREDIENT_CATEGORIES
 from ..utils import scale_ferm, scale_hop, scale_misc, scale_yeast
+from .instrument import add_arguments, enable_from_args, iterate, stage
+from .name_index import NameIndex, index_path
+from .store import open_store
+from .vocabulary import load_maps
 
 CORE_COLS = ["batch_size", "boil_size", "boil_time", "efficiency"]
 ING_COLS = [
@@ -29,25 +35,38 @@ ING_COLS = [
     "yeast_name",
 ]
 RECIPE_FILE = os.path.join(DATA_DIR, "interim/all_recipes.h5")
-CORE_TABLE = "/core"
-ING_TABLE = "/ingredients"
+CORE_TABLE = "core"
+ING_TABLE = "ingredients"
 VECTOR_FILE = os.path.join(DATA_DIR, "processed/recipe_vecs.h5")
 VOCAB_FILE = os.path.join(DATA_DIR, "processed/vocab.pickle")
 CHUNK_SIZE = 10000
 
-with open(VOCAB_FILE, "rb") as f:
-    ING2INT = pickle.load(f)
-    INT2ING = {v: k for k, v in ING2INT.items()}
 
+def load_vocab(fname=VOCAB_FILE):
+    """Load the vocabulary (ingredient -> int), or return an empty one if it
+    hasn't been created yet."""
+    try:
+        with open(fname, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return {}
 
-def recipes2vec(recipes):
-    """Given a list of recipes, convert them all to vectors."""
+
+ING2INT = load_vocab()
+INT2ING = {v: k for k, v in ING2INT.items()}
+
+
+def recipes2vec(recipes, ing2int=None):
+    """Given a list of recipes, convert them all to vectors. ing2int is the
+    vocabulary to use, the one on disk by default."""
+    if ing2int is None:
+        ing2int = ING2INT
 
     name_cols = ["recipe_id"] + [cat + "_name" for cat in INGREDIENT_CATEGORIES]
     amount_cols = ["recipe_id"] + [cat + "_amount" for cat in INGREDIENT_CATEGORIES]
 
     # Turn mapped ingredients to their integer labels
-    recipes[name_cols] = recipes[name_cols].replace(ING2INT)
+    recipes[name_cols] = recipes[name_cols].replace(ing2int)
 
     flat_names = (
         recipes[name_cols]
@@ -61,16 +80,16 @@ def recipes2vec(recipes):
         .drop("variable", axis=1)
         .rename({"value": "amount"}, axis=1)
     )
-    flat_recipes = flat_names.merge(
-        flat_amounts, on="recipe_id"
-    )
+    # Both are melted in the same order, so the k-th amount is the k-th name's.
+    # (Merging them on recipe_id paired every name with every amount.)
+    flat_recipes = flat_names.assign(amount=flat_amounts["amount"].to_numpy())
     # This avoids multiple additions of the same ingredient, which this
     # simple model can't handle
     flat_recipes = flat_recipes.groupby(["recipe_id", "name"]).sum().reset_index()
     recipes_vec = flat_recipes.pivot(index="recipe_id", columns="name", values="amount")
 
     # ensure we have all columns
-    cols = set(INT2ING.keys())
+    cols = set(ing2int.values())
     missing = list(cols.difference(recipes_vec.columns))
     recipes_vec = recipes_vec.reindex(
         columns=sorted(recipes_vec.columns.tolist() + missing)
@@ -96,15 +115,15 @@ def scale_quantities(df):
     return df
 
 
-def apply_map(df):
+def apply_map(df, maps=None):
     """Given a dataframe with the appropriate columns (specified in CORE_COLS
     and ING_COLS), use the ingredient maps to replace names with standard names
-    for use in recipe2vec.
+    for use in recipe2vec. If maps is None, the maps are loaded from disk.
     """
+    if maps is None:
+        maps = load_maps()
     for category in INGREDIENT_CATEGORIES:
-        map_file = os.path.join(DATA_DIR, f"interim/{category}map.pickle")
-        with open(map_file, "rb") as f:
-            ing_map = pickle.load(f)
+        ing_map = maps[category]
         not_null_ing = df[f"{category}_name"].dropna()
         drop_inds = not_null_ing[~not_null_ing.isin(ing_map)].index
         # Remove recipes that don't have full coverage
@@ -128,48 +147,255 @@ def finalize_names(df):
     return df
 
 
-def load_prepare_data(path):
-    """Given a path to the all_recipes HDF, load in the data, replace the
+def prepare(core, ings, maps=None, chunk=None):
+    """Join the core and ingredient rows of a chunk of recipes and get them
+    ready for `recipes2vec`. chunk is the chunk number for instrumentation."""
+    with stage("join", chunk=chunk) as s:
+        df = core.join(ings)
+        # Names are rewritten below, so they can't stay Categoricals
+        for category in INGREDIENT_CATEGORIES:
+            df[f"{category}_name"] = df[f"{category}_name"].astype(object)
+        s.rows = len(df)
+    with stage("apply_map", chunk=chunk) as s:
+        df = apply_map(df, maps)
+        s.rows = len(df)
+    with stage("scale_quantities", chunk=chunk) as s:
+        df = scale_quantities(df)
+        s.rows = len(df)
+    with stage("finalize_names", chunk=chunk) as s:
+        df = finalize_names(df)
+        s.rows = len(df)
+    df["recipe_id"] = df.index
+    return df
+
+
+def load_prepare_data(path, ids=None):
+    """Given a path to the all_recipes store (HDF or Parquet), load in the data, replace the
     ingredient names with standard names from the ingredient maps and then
-    scale quantities to boil/batch sizes as appropriate."""
-    with pd.HDFStore(path, "r") as store:
-        for core in store.select(CORE_TABLE, columns=CORE_COLS, chunksize=CHUNK_SIZE):
-            i_start = core.index[0]
-            i_end = core.index[-1]
-            ings = store.select(
-                ING_TABLE,
-                columns=ING_COLS,
-                where=f"index >= {i_start} and index <= {i_end}",
-            )
-            df = core.join(ings)
-            df = apply_map(df)
-            df = scale_quantities(df)
-            df = finalize_names(df)
-            df["recipe_id"] = df.index
-            yield df
+    scale quantities to boil/batch sizes as appropriate. If ids is given, only
+    those recipes are loaded. The vectors only use the names, amounts and boil
+    times, so cleaning the efficiencies and yields (beerai.cleaning) wouldn't
+    change them."""
+    maps = load_maps()
+    with open_store(path) as store:
+        if ids is not None:
+            ids = sorted(ids)
+            for chunk, i in enumerate(range(0, len(ids), CHUNK_SIZE)):
+                batch = ids[i : i + CHUNK_SIZE]
+                with stage("select", chunk=chunk) as s:
+                    core = store.select(CORE_TABLE, columns=CORE_COLS, ids=batch)
+                    ings = store.select(ING_TABLE, columns=ING_COLS, ids=batch)
+                    s.rows = len(ings)
+                yield prepare(core, ings, maps, chunk)
+            return
+        chunks = store.select(CORE_TABLE, columns=CORE_COLS, chunksize=CHUNK_SIZE)
+        for chunk, core in enumerate(iterate("select core", chunks)):
+            id_range = (core.index[0], core.index[-1] + 1)
+            with stage("select", chunk=chunk) as s:
+                ings = store.select(ING_TABLE, columns=ING_COLS, id_range=id_range)
+                s.rows = len(ings)
+            yield prepare(core, ings, maps, chunk)
 
 
 def get_number_lines(path, table):
-    """Return the number of lines in the HDF to process."""
-    with pd.HDFStore(path, "r") as store:
-        storer = store.get_storer(table)
-        nrows = storer.nrows
-    return nrows
+    """Return the number of lines in the store to process."""
+    with open_store(path) as store:
+        return store.nrows(table)
+
+
+def n_vectors(vec_path=VECTOR_FILE):
+    """Return the number of recipe vectors in the vector HDF."""
+    with pd.HDFStore(vec_path, "r") as store:
+        return int(store.get_storer("vecs").nrows)
+
+
+def iter_vectors(vec_path=VECTOR_FILE, order=None):
+    """Yield the recipe vectors in the vector HDF in chunks of CHUNK_SIZE rows,
+    which are in id order (see update_vectors). order gives the chunk numbers
+    to read, all of them in order by default."""
+    with pd.HDFStore(vec_path, "r") as store:
+        starts = range(0, store.get_storer("vecs").nrows, CHUNK_SIZE)
+        if order is not None:
+            starts = [starts[i] for i in order]
+        for start in starts:
+            yield store.select("vecs", start=start, stop=start + CHUNK_SIZE)
+
+
+def changed_names(old_map, new_map):
+    """Return the raw names whose standard name differs between two versions
+    of an ingredient map (including names added to or removed from the map)."""
+    names = set(old_map).union(new_map)
+    return sorted(k for k in names if old_map.get(k) != new_map.get(k))
+
+
+def recipes_using(path, category, names):
+    """Return the ids of the recipes in the all_recipes store that use any of
+    the raw ingredient names for a category. The name index is used if it
+    exists, otherwise the ingredients table is queried."""
+    if os.path.exists(index_path(path)):
+        index = NameIndex.load(index_path(path))
+        return set(index.recipes(any_of=[(category, name) for name in names]))
+
+    with open_store(path) as store:
+        table = category if category in store else ING_TABLE
+        return store.find(table, f"{category}_name", names)
+
+
+def missing_from_vocab(maps, ing2int=None):
+    """Return the vocabulary entries required by maps that are not in the
+    vocabulary (the one on disk by default)."""
+    if ing2int is None:
+        ing2int = ING2INT
+    missing = set()
+    for category, ing_map in maps.items():
+        names = {f"{category}_{name}" for name in set(ing_map.values())}
+        if category == "hop":
+            names.update({f"{name}_dry" for name in names})
+        missing.update(names.difference(ing2int))
+    return missing
+
+
+def update_vectors(old_maps, path=RECIPE_FILE, vec_path=VECTOR_FILE):
+    """Re-vectorise only the recipes affected by the differences between
+    old_maps (category -> ingredient map) and the maps currently on disk. The
+    old rows of those recipes are dropped, and their new vectors (if the
+    recipe is still fully covered by the maps) merged in by id, so that the
+    vector HDF stays in id order (see merge_vectors).
+
+    If the new maps introduce standard names that aren't in the vocabulary, the
+    vector columns change and a full run of `main` is required instead.
+    """
+    new_maps = load_maps()
+    missing = missing_from_vocab(new_maps)
+    if missing:
+        print(
+            f"{len(missing)} standard names are not in the vocabulary, e.g. "
+            f"{sorted(missing)[0]}. Rebuild the vocabulary and re-run in full.",
+            file=sys.stderr,
+        )
+        return
+
+    ids = set()
+    for category, old_map in old_maps.items():
+        names = changed_names(old_map, new_maps[category])
+        if names:
+            ids.update(recipes_using(path, category, names))
+    print(f"{len(ids)} recipes affected by map changes.")
+    if not ids:
+        return
+
+    old = (vecs[~vecs.index.isin(ids)] for vecs in iter_vectors(vec_path))
+    new = (
+        vectorise(df, chunk)
+        for chunk, df in enumerate(load_prepare_data(path, ids=ids))
+    )
+    # The readers of the vectors select the recipes of a chunk by their id
+    # range, so rather than appending the new rows at the end, the vectors are
+    # rewritten in id order, to a temporary file that replaces the old one
+    tmp = vec_path + ".tmp"
+    with pd.HDFStore(tmp, "w", complevel=5, complib="blosc") as store:
+        for chunk, vecs in enumerate(merge_vectors(old, new)):
+            with stage("append", chunk=chunk) as s:
+                store.append("/vecs", vecs, format="table")
+                s.rows = len(vecs)
+    os.replace(tmp, vec_path)
+
+
+def merge_vectors(old, new):
+    """Merge two iterables of chunks of recipe vectors, each in id order, into
+    chunks in id order. Only the new rows up to the end of the current old
+    chunk are held at a time."""
+    new = iter(new)
+    pending = None
+    exhausted = False
+    for vecs in old:
+        if not len(vecs):
+            continue
+        last = vecs.index[-1]
+        while not exhausted and (pending is None or pending.index[-1] <= last):
+            df = next(new, None)
+            if df is None:
+                exhausted = True
+            elif len(df):
+                pending = df if pending is None else pd.concat([pending, df])
+        if pending is not None:
+            before = pending.index <= last
+            rows = pending[before]
+            # Set into the old chunk rather than concatenated, which keeps its
+            # column blocks, so that it's written like the old file
+            vecs = vecs.reindex(vecs.index.append(rows.index).sort_values())
+            vecs.loc[rows.index] = rows
+            pending = pending[~before] if not before.all() else None
+        yield vecs
+    if pending is not None:
+        yield pending
+    for df in new:
+        if len(df):
+            yield df
+
+
+def vectorise(df, chunk=None):
+    """Return the vectors of a chunk from load_prepare_data."""
+    with stage("recipes2vec", chunk=chunk) as s:
+        recipes = pd.DataFrame(recipes2vec(df))
+        s.rows = len(recipes)
+    return recipes
+
+
+def append_vectors(store, df, chunk=None):
+    """Vectorise a chunk from load_prepare_data and append it to the vector
+    HDF."""
+    recipes = vectorise(df, chunk)
+    with stage("append", chunk=chunk) as s:
+        store.append("/vecs", recipes, format="table")
+        s.rows = len(recipes)
 
 
 def main():
 
     with pd.HDFStore(VECTOR_FILE, "w", complevel=5, complib="blosc") as store:
         nrows = get_number_lines(RECIPE_FILE, CORE_TABLE)
-        for df in tqdm(
-            load_prepare_data(RECIPE_FILE),
-            desc="Chunk",
-            total=nrows / CHUNK_SIZE,
-            disable=None,
+        for chunk, df in enumerate(
+            tqdm(
+                load_prepare_data(RECIPE_FILE),
+                desc="Chunk",
+                total=nrows / CHUNK_SIZE,
+                disable=None,
+            )
         ):
-            recipes = pd.DataFrame(recipes2vec(df))
-            store.append("/vecs", recipes, format="table")
+            append_vectors(store, df, chunk)
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to convert all recipes to vectors, or to update "
+        "only the recipes affected by ingredient map changes."
+    )
+    parser.add_argument(
+        "-d",
+        "--delta",
+        nargs=2,
+        action="append",
+        metavar=("CATEGORY", "OLD_MAP"),
+        help="Only re-vectorise recipes whose ingredients map differently in "
+        "the current CATEGORY map than in OLD_MAP (e.g. a backup "
+        "`fermmap.pickle.1`). Can pass argument multiple times to compare "
+        "multiple categories.",
+    )
+    add_arguments(parser)
+    return parser
 
 
 if __name__ == "__main__":
-    main()
+    parser = _setup_argparser()
+    args = parser.parse_args()
+
+    enable_from_args(args)
+    if args.delta:
+        old_maps = {}
+        for category, fname in args.delta:
+            with open(fname, "rb") as f:
+                old_maps[category] = pickle.load(f)
+        update_vectors(old_maps)
+    else:
+        main()
@@ -0,0 +1,132 @@
+"""The columns of the recipe tables, with their dtype, unit and whether they
+can be missing.
+
+Recipes are stored in a `core` table and one table per ingredient category
+(`ferm`, `hop`, `yeast` and `misc`, see CATEGORY_TABLES), with one row per
+ingredient. INGREDIENTS lists the columns of the legacy wide `ingredients`
+table, which holds the columns of all four categories.
+
+Every batch of converted recipes is cast to these dtypes by `xml2h5`, so the
+chunks of a table have the same dtypes no matter which values they happen to
+hold. Measurements are float32 (plenty for their precision), low cardinality
+strings are categoricals, and the only column that can't be missing is a
+bool.
+
+dtypes are given as strings:
+
+- "str": free text, stored as Python strings.
+- "category": low cardinality strings, dictionary encoded by the stores.
+- "bool": never missing; missing values become False.
+- anything else is a numpy dtype, e.g. "float32". Missing values are NaN, so
+  nullable columns must be floats (PyTables can't store nullable integers).
+"""
+
+import numpy as np
+import pandas as pd
+
+from collections import namedtuple
+
+from ..config import INGREDIENT_CATEGORIES
+
+Column = namedtuple("Column", ["dtype", "unit", "nullable"])
+
+STR = Column("str", None, True)
+CATEGORY = Column("category", None, True)
+
+CORE = {
+    "recipe_file": STR,
+    "origin": CATEGORY,
+    "name": STR,
+    "brewer": STR,
+    "batch_size": Column("float32", "L", True),
+    "boil_size": Column("float32", "L", True),
+    "efficiency": Column("float32", "fraction", True),
+    "boil_time": Column("float32", "min", True),
+    "src_ibu": Column("float32", "IBU", True),
+    "src_og": Column("float32", "SG", True),
+    "src_fg": Column("float32", "SG", True),
+    "src_abv": Column("float32", "%", True),
+    "src_color": Column("float32", "SRM", True),
+    "style_name": CATEGORY,
+    "style_guide": CATEGORY,
+    "style_category": CATEGORY,
+    "style_version": Column("float32", None, True),
+}
+INGREDIENTS = {
+    "ferm_name": CATEGORY,
+    "ferm_origin": CATEGORY,
+    # Amounts are normalised from the display amounts, see beerai.data.units
+    "ferm_amount": Column("float32", "kg", True),
+    "ferm_display_amount": STR,
+    "ferm_amount_unit": CATEGORY,
+    "ferm_unit_confidence": CATEGORY,
+    "ferm_yield": Column("float32", "fraction", True),
+    "ferm_color": Column("float32", "°L", True),
+    "ferm_potential": Column("float32", "SG", True),
+    # grain, sugar, extract, dry extract or adjunct
+    "ferm_type": CATEGORY,
+    "hop_name": CATEGORY,
+    "hop_origin": CATEGORY,
+    "hop_amount": Column("float32", "kg", True),
+    "hop_display_amount": STR,
+    "hop_amount_unit": CATEGORY,
+    "hop_unit_confidence": CATEGORY,
+    "hop_alpha": Column("float32", "fraction", True),
+    "hop_form": CATEGORY,
+    "hop_use": CATEGORY,
+    "hop_time": Column("float32", "min", True),
+    "yeast_name": CATEGORY,
+    "yeast_laboratory": CATEGORY,
+    "yeast_type": CATEGORY,
+    "yeast_form": CATEGORY,
+    # kg if the yeast is measured by weight, L otherwise, see yeast_amount_unit
+    "yeast_amount": Column("float32", "L or kg", True),
+    "yeast_display_amount": STR,
+    "yeast_amount_unit": CATEGORY,
+    "yeast_unit_confidence": CATEGORY,
+    # Packages, vials etc. if the display amount is a count
+    "yeast_count": Column("float32", "count", True),
+    "yeast_product_id": CATEGORY,
+    "yeast_attenuation": Column("float32", "%", True),
+    "yeast_flocculation": CATEGORY,
+    "yeast_amount_is_weight": Column("bool", None, False),
+    "misc_name": CATEGORY,
+    # kg if the misc is measured by weight, L otherwise, see misc_amount_unit
+    "misc_amount": Column("float32", "L or kg", True),
+    "misc_display_amount": STR,
+    "misc_amount_unit": CATEGORY,
+    "misc_unit_confidence": CATEGORY,
+    # Tablets etc. if the display amount is a count
+    "misc_count": Column("float32", "count", True),
+    "misc_use": CATEGORY,
+    "misc_time": Column("float32", "min", True),
+    "misc_amount_is_weight": Column("bool", None, False),
+}
+COLUMNS = {**CORE, **INGREDIENTS}
+# Columns of each ingredient category's table
+CATEGORY_TABLES = {
+    category: [name for name in INGREDIENTS if name.startswith(category + "_")]
+    for category in INGREDIENT_CATEGORIES
+}
+
+STR_COLUMNS = {
+    name for name, col in COLUMNS.items() if col.dtype in ("str", "category")
+}
+CATEGORICAL_COLUMNS = {
+    name for name, col in COLUMNS.items() if col.dtype == "category"
+}
+# Value that missing values are replaced with in columns that aren't nullable
+FILL_VALUES = {"bool": False}
+
+
+def cast(values, dtype):
+    """Cast a Series to one of the schema dtypes."""
+    if dtype in ("str", "category"):
+        # Values like product ids can be parsed as numbers
+        values = values.astype(object).map(
+            lambda v: v if isinstance(v, str) or pd.isna(v) else str(v)
+        )
+        values = values.astype(object).where(values.notna(), np.nan)
+        return values.astype("category") if dtype == "category" else values
+    return values.astype(dtype)
+
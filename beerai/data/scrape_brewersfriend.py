@@ -1,66 +1,160 @@
+"""Download the BeerXML of every recipe listed in the Brewer's Friend recipe
+CSV. Downloads run concurrently, rate limited per host, and the ids of the
+finished recipes are checkpointed so an interrupted run picks up where it left
+off."""
+
+import argparse
+import asyncio
 import os
 import pandas as pd
 import pickle
-import re
-import requests
-
-from pathlib import Path
 
 from ..config import DATA_DIR
+from .archive import ArchiveWriter, DirectoryWriter
+from .fetch import CONCURRENCY, RATE, RateLimiter, fetch, make_session, run_pool
 
 URL = "https://www.brewersfriend.com/homebrew/recipe/beerxml1.0/"
 CHECKPOINT_FILE = os.path.join(DATA_DIR, "raw/recipes/brewersfriend_checkpoint.pickle")
 RECIPEPATH = os.path.join(DATA_DIR, "raw/recipes/brewersfriend")
-USERAGENT = {
-    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
-}
-
-# Load the recipe CSV
-recipe_data_file = os.path.join(DATA_DIR, "raw/external/recipeData.csv")
-recipe_df = pd.read_csv(recipe_data_file, encoding="ISO-8859-1")[["BeerID", "URL"]]
-print("CSV loaded. Listing {} recipes.".format(len(recipe_df)))
-
-# Load the checkpoint variable
-try:
-    with open(CHECKPOINT_FILE, "rb") as bf:
-        pickle_start = pickle.load(bf)
-    start = pickle_start + 1
-    print("Checkpoint loaded. Starting recipe number: {}".format(start))
-except FileNotFoundError:
-    start = 0
-    print("No checkpoint found. Starting from scratch")
-
-for i in range(start, len(recipe_df)):
-
-    print("Current recipe number: {}".format(i))
-
-    # Extract the Brewers' Friend recipe ID from its entry in the recipe CSV
-    recipe_page_URL = recipe_df["URL"][i]
-    recipe_id = re.search(r"/view/(.*?)/", recipe_page_URL).group(1)
-    # print('Current Brewers Friend recipe ID: {}, page URL: {}'.format(str(recipe_id), recipe_page_URL))
-
-    # Form the BeerXML filename
-    recipe_XML_URL = URL + str(recipe_id)
-    # print('Current Brewers Friend BeerXML URL: {}'.format(recipe_XML_URL))
-
-    # Download the recipe
-    fname = RECIPEPATH + recipe_XML_URL.split("/")[-1] + ".xml"
-    # print('Filename: {}'.format(fname))
-    f = Path(fname)
-    # If we don't already have this file, download it. This skips a recipe
-    # if it has the same name as another recipe, but I'm not sure if that's
-    # an issue worth trying to get around.
-    if not f.is_file():
-        response = requests.get(recipe_XML_URL, headers=USERAGENT)
-        open(f, "wb").write(response.content)
-
-        print("File downloaded. Path: {}".format(fname))
+ARCHIVE_FILE = os.path.join(DATA_DIR, "raw/recipes/brewersfriend.xmllog")
+RECIPE_DATA_FILE = os.path.join(DATA_DIR, "raw/external/recipeData.csv")
+# Number of finished recipes between checkpoint saves
+CHECKPOINT_EVERY = 500
+
+
+def load_recipe_ids(fname=RECIPE_DATA_FILE):
+    """Return the Brewer's Friend recipe ids listed in the recipe CSV, in
+    order."""
+    recipe_df = pd.read_csv(fname, encoding="ISO-8859-1")[["BeerID", "URL"]]
+    print("CSV loaded. Listing {} recipes.".format(len(recipe_df)))
+    return recipe_df["URL"].str.extract(r"/view/(.*?)/", expand=False).tolist()
+
+
+def load_checkpoint(recipe_ids, fname=CHECKPOINT_FILE):
+    """Return the set of recipe ids that have already been downloaded. Old
+    checkpoints stored the position of the last finished recipe in the CSV,
+    these are converted to the set of ids up to that position."""
+    try:
+        with open(fname, "rb") as f:
+            done = pickle.load(f)
+    except FileNotFoundError:
+        print("No checkpoint found. Starting from scratch")
+        return set()
+    if isinstance(done, int):
+        done = set(recipe_ids[: done + 1])
+    print("Checkpoint loaded. {} recipes already done.".format(len(done)))
+    return done
+
+
+def save_checkpoint(done, fname=CHECKPOINT_FILE):
+    """Atomically save the set of finished recipe ids."""
+    tmp = fname + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(done, f)
+    os.replace(tmp, fname)
 
-    else:
-        print("File already downloaded. Skipping")
 
-    # Checkpoint the page we finished so if we restart later, we continue from
-    # the same page.
-    with open(CHECKPOINT_FILE, "wb") as bf:
-        pickle.dump(i, bf)
-        print("Checkpoint saved.")
+async def scrape(
+    recipe_ids,
+    done,
+    writer,
+    url=URL,
+    checkpoint_file=CHECKPOINT_FILE,
+    concurrency=CONCURRENCY,
+    rate=RATE,
+):
+    """Download every recipe in recipe_ids that isn't in done (which is updated
+    in place) and write it as <id>.xml with writer (a DirectoryWriter or
+    ArchiveWriter)."""
+    limiter = RateLimiter(rate)
+    todo = [i for i in recipe_ids if i not in done]
+    print("{} recipes to download.".format(len(todo)))
+    n_since_checkpoint = 0
+
+    async with make_session(concurrency) as session:
+
+        async def download(recipe_id):
+            nonlocal n_since_checkpoint
+            name = f"{recipe_id}.xml"
+            # If we don't already have this recipe, download it.
+            if name not in writer:
+                content = await fetch(session, url + str(recipe_id), limiter)
+                if content is None:
+                    # Not marked as done so it's retried on the next run
+                    return
+                writer.write(name, content)
+            done.add(recipe_id)
+            n_since_checkpoint += 1
+            if n_since_checkpoint >= CHECKPOINT_EVERY:
+                writer.flush()
+                save_checkpoint(done, checkpoint_file)
+                n_since_checkpoint = 0
+                print("Checkpoint saved. {} recipes done.".format(len(done)))
+
+        try:
+            await run_pool(todo, download, concurrency)
+        finally:
+            writer.flush()
+            save_checkpoint(done, checkpoint_file)
+            print("Checkpoint saved. {} recipes done.".format(len(done)))
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to download the BeerXML for the recipes in the "
+        "Brewer's Friend recipe CSV."
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=CONCURRENCY,
+        help=f"Number of downloads in flight at once. Default is {CONCURRENCY}.",
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        type=float,
+        default=RATE,
+        help="Maximum number of requests started per second. 0 means no "
+        f"limit. Default is {RATE}.",
+    )
+    parser.add_argument(
+        "-u",
+        "--url",
+        default=URL,
+        help="Base URL that the recipe id is appended to. Useful for pointing "
+        "at a local server.",
+    )
+    parser.add_argument(
+        "-a",
+        "--archive",
+        nargs="?",
+        const=ARCHIVE_FILE,
+        help="Append recipes to an archive instead of writing one file per "
+        "recipe. Default archive is `data/raw/recipes/brewersfriend.xmllog`.",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+
+    recipe_ids = load_recipe_ids()
+    done = load_checkpoint(recipe_ids)
+    if args.archive:
+        writer = ArchiveWriter(args.archive)
+    else:
+        writer = DirectoryWriter(RECIPEPATH)
+    with writer:
+        asyncio.run(
+            scrape(
+                recipe_ids,
+                done,
+                writer,
+                url=args.url,
+                concurrency=args.concurrency,
+                rate=args.rate,
+            )
+        )
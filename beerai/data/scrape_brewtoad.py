@@ -1,67 +1,233 @@
+"""Download the BeerXML of every recipe listed on Brewtoad.
+
+Listing pages are fetched and parsed by a producer that feeds the recipe XML
+links to a pool of download workers, so the next page is fetched while the
+current page's recipes download. A page is checkpointed once it and every page
+before it have all of their recipes downloaded."""
+
+import argparse
+import asyncio
 import bs4
+import os
 import pickle
 import re
-import requests
 import sys
-import wget
-
-from pathlib import Path
 
 from ..config import DATA_DIR
-# Brewtoad.com URLs: https://www.brewtoad.com/recipes?page=1&sort=created_at&sort_reverse=true
+from .archive import ArchiveWriter, DirectoryWriter
+from .fetch import CONCURRENCY, RATE, RateLimiter, consume, fetch, make_session
 
+# Brewtoad.com URLs: https://www.brewtoad.com/recipes?page=1&sort=created_at&sort_reverse=true
 WEBSITE = "https://www.brewtoad.com"
-URL = "https://www.brewtoad.com/recipes?page={}&sort=created_at&sort_reverse=true"
+URL = WEBSITE + "/recipes?page={}&sort=created_at&sort_reverse=true"
 CHECKPOINT_FILE = os.path.join(DATA_DIR, "raw/recipes/brewtoad_checkpoint.pickle")
+RECIPEPATH = os.path.join(DATA_DIR, "raw/recipes/brewtoad")
+ARCHIVE_FILE = os.path.join(DATA_DIR, "raw/recipes/brewtoad.xmllog")
 R = re.compile("[0-9]+")
 
-# Start by trying to load checkpoint file so we don't redo work.
-try:
-    with open(CHECKPOINT_FILE, "rb") as bf:
-        stats = pickle.load(bf)
-    start = stats["page"] + 1
-except FileNotFoundError:
-    start = 1
-
-print("Starting on page {}".format(start))
-
-# We do the first page outside of the loop to obtain the total number of pages
-# that we'll need to loop over. Otherwise we don't know how long to loop.
-request = requests.get(URL.format(start))
-html = bs4.BeautifulSoup(request.text, "lxml")
-
-pagination = html.find("div", attrs={"class": "pagination"})
-n = re.findall(R, pagination.text)
-if n:
-    n_pages = int(n[-1])
-else:
-    print("Can't find pagination values.")
-    sys.exit(1)
-
-# Need to loop to n_pages+1 since the current loop is actually working on the
-# nth-1 page.
-for i in range(start + 1, n_pages + 1):
-    recipes = html.find_all(name="li", attrs={"class": "recipe-container"})
-    for recipe in recipes:
+
+def parse_n_pages(html):
+    """Return the total number of listing pages from a parsed listing page, or
+    None if the pagination can't be found."""
+    pagination = html.find("div", attrs={"class": "pagination"})
+    if pagination is None:
+        return None
+    n = re.findall(R, pagination.text)
+    if n:
+        return int(n[-1])
+    return None
+
+
+def parse_recipe_links(html, website=WEBSITE):
+    """Return the XML links of the recipes on a parsed listing page."""
+    links = []
+    for recipe in html.find_all(name="li", attrs={"class": "recipe-container"}):
         sub = recipe.find("a", attrs={"class": "recipe-link"})
-        address = sub.get("href")
         # The xml files are nicely named after the page they're from
-        link = WEBSITE + address + ".xml"
-        fname = "raw/recipes/brewtoad/" + link.split("/")[-1]
-        fname = os.path.join(DATA_DIR, fname)
-        f = Path(fname)
-        # If we don't already have this file, download it. This skips a recipe
-        # if it has the same name as another recipe, but I'm not sure if that's
-        # an issue worth trying to get around.
-        if not f.is_file():
-            wget.download(link, out=fname)
-    print("Done page {}".format(i - 1))
-    # Checkpoint the page we finished so if we restart later, we continue from
-    # the same page.
-    with open(CHECKPOINT_FILE, "wb") as bf:
-        pickle.dump({"page": i - 1}, bf)
-    # Grab the new page
-    request = requests.get(URL.format(i))
-    html = bs4.BeautifulSoup(request.text, "lxml")
-
-print("Done")
+        links.append(website + sub.get("href") + ".xml")
+    return links
+
+
+def parse_page(text):
+    return bs4.BeautifulSoup(text, "lxml")
+
+
+def load_checkpoint(fname=CHECKPOINT_FILE):
+    """Return the last page whose recipes have all been downloaded (0 if
+    none)."""
+    try:
+        with open(fname, "rb") as f:
+            return pickle.load(f)["page"]
+    except FileNotFoundError:
+        return 0
+
+
+def save_checkpoint(page, fname=CHECKPOINT_FILE):
+    tmp = fname + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump({"page": page}, f)
+    os.replace(tmp, fname)
+
+
+async def scrape(
+    start,
+    writer,
+    n_pages=None,
+    url=URL,
+    website=WEBSITE,
+    checkpoint_file=CHECKPOINT_FILE,
+    concurrency=CONCURRENCY,
+    rate=RATE,
+):
+    """Download the recipes on listing pages start to n_pages (inclusive) and
+    write them with writer (a DirectoryWriter or ArchiveWriter). If n_pages is
+    None, it's read from the pagination of the first page. Return the last
+    checkpointed page."""
+    limiter = RateLimiter(rate)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    # page -> number of downloads left. A page is removed once it's complete.
+    remaining = {}
+    failed = set()
+    completed = set()
+    checkpoint = start - 1
+
+    def finish(page):
+        """Mark a page as complete and move the checkpoint past every complete
+        page that directly follows it."""
+        nonlocal checkpoint
+        completed.add(page)
+        if page == checkpoint + 1:
+            while checkpoint + 1 in completed:
+                checkpoint += 1
+                completed.remove(checkpoint)
+            writer.flush()
+            save_checkpoint(checkpoint, checkpoint_file)
+            print("Done page {}".format(checkpoint))
+
+    async with make_session(concurrency) as session:
+
+        async def download(item):
+            page, link = item
+            name = link.split("/")[-1]
+            # If we don't already have this recipe, download it. This skips a
+            # recipe if it has the same name as another recipe, but I'm not
+            # sure if that's an issue worth trying to get around.
+            if name not in writer:
+                content = await fetch(session, link, limiter)
+                if content is None:
+                    # The page won't be checkpointed, so it's redone next run
+                    failed.add(page)
+                else:
+                    writer.write(name, content)
+            remaining[page] -= 1
+            if remaining[page] == 0:
+                del remaining[page]
+                if page not in failed:
+                    finish(page)
+
+        async def produce():
+            nonlocal n_pages
+            page = start
+            while n_pages is None or page <= n_pages:
+                content = await fetch(session, url.format(page), limiter)
+                if content is None:
+                    print(f"Couldn't get page {page}. Stopping.", file=sys.stderr)
+                    break
+                # Parsing is slow, so keep it off the event loop
+                html = await loop.run_in_executor(None, parse_page, content)
+                if n_pages is None:
+                    n_pages = parse_n_pages(html)
+                    if n_pages is None:
+                        print("Can't find pagination values.", file=sys.stderr)
+                        break
+                    print("Starting on page {} of {}".format(start, n_pages))
+                links = parse_recipe_links(html, website)
+                if links:
+                    remaining[page] = len(links)
+                    for link in links:
+                        await queue.put((page, link))
+                else:
+                    finish(page)
+                page += 1
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        consumers = [consume(queue, download) for _ in range(concurrency)]
+        await asyncio.gather(produce(), *consumers)
+
+    if failed:
+        print(
+            "Some recipes failed to download on pages {}.".format(sorted(failed)),
+            file=sys.stderr,
+        )
+    return checkpoint
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to download the BeerXML for every recipe listed "
+        "on Brewtoad, continuing from the last checkpoint."
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=CONCURRENCY,
+        help=f"Number of downloads in flight at once. Default is {CONCURRENCY}.",
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        type=float,
+        default=RATE,
+        help="Maximum number of requests started per second. 0 means no "
+        f"limit. Default is {RATE}.",
+    )
+    parser.add_argument(
+        "-w",
+        "--website",
+        default=WEBSITE,
+        help="Website to scrape. Useful for pointing at a local server.",
+    )
+    parser.add_argument(
+        "-n",
+        "--n_pages",
+        type=int,
+        help="Last listing page to scrape. Default is the last page listed in "
+        "the pagination.",
+    )
+    parser.add_argument(
+        "-a",
+        "--archive",
+        nargs="?",
+        const=ARCHIVE_FILE,
+        help="Append recipes to an archive instead of writing one file per "
+        "recipe. Default archive is `data/raw/recipes/brewtoad.xmllog`.",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+
+    start = load_checkpoint() + 1
+    url = args.website + "/recipes?page={}&sort=created_at&sort_reverse=true"
+    if args.archive:
+        writer = ArchiveWriter(args.archive)
+    else:
+        writer = DirectoryWriter(RECIPEPATH)
+    with writer:
+        asyncio.run(
+            scrape(
+                start,
+                writer,
+                n_pages=args.n_pages,
+                url=url,
+                website=args.website,
+                concurrency=args.concurrency,
+                rate=args.rate,
+            )
+        )
+    print("Done")
@@ -0,0 +1,631 @@
+"""Reading and writing the recipe tables (`core` and `ingredients`).
+
+The tables can be stored in two layouts, each with a backend class that has
+the same interface, so the rest of the pipeline doesn't care which is used:
+
+- `HDFBackend`: a PyTables HDF, `all_recipes.h5` (the original layout).
+- `ParquetBackend`: a directory of Parquet files, `all_recipes.parquet`,
+  partitioned by origin and id range. Reads only touch the columns and
+  partitions they need, and filters on ids and styles are pushed down to the
+  files. Needs pyarrow.
+
+`open_store` picks the backend from the path:
+
+    with open_store("all_recipes.parquet") as store:
+        core = store.select("core", columns=["style_name"], id_range=(0, 1000))
+        ings = store.select("ingredients", styles=["American IPA"])
+
+In the HDF, low cardinality string columns (see CATEGORICAL_COLUMNS) are dictionary
+encoded: the tables hold integer codes, and the strings are stored in one
+dictionary table, DICT_TABLE, with the column they're from and their code as
+the row index (files written before hold a table per column, `/dict/<column>`).
+Only these columns (and the index) are data columns that can be filtered on.
+Reading through `select` turns the codes back into pandas Categoricals, so
+equality filters on them compare integers rather than strings.
+
+    with pd.HDFStore("all_recipes.h5", "r") as store:
+        core = select(store, "/core", columns=["style_name", "origin"])
+
+Parquet stores these columns with its own dictionary encoding, and they are
+read back as Categoricals too.
+"""
+
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import uuid
+import warnings
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from ..config import INGREDIENT_CATEGORIES
+from .instrument import iterate, stage
+from .schema import CATEGORICAL_COLUMNS, CATEGORY_TABLES, COLUMNS, FILL_VALUES
+
+CODE_DTYPE = np.int32
+# Maximum width of string columns (and dictionary entries) in the HDF tables.
+# Longer strings are truncated, with a warning (see truncate_strings). Free
+# text columns are sized from the first batch written (see _str_width).
+STR_SIZE = 255
+MIN_STR_SIZE = 16
+# The dictionaries of all the dictionary encoded columns: one row per string,
+# whose index is its code, with the column it's from
+DICT_TABLE = "/dictionary"
+DICT_COLUMN_SIZE = max(len(col) for col in CATEGORICAL_COLUMNS)
+HDF_OPTIONS = {"complevel": 9, "complib": "blosc", "format": "table"}
+
+PARQUET_EXTENSION = ".parquet"
+PARQUET_OPTIONS = {"compression": "zstd"}
+# Number of consecutive recipe ids in each id range partition
+BUCKET_SIZE = 100000
+CORE_TABLE = "core"
+ING_TABLE = "ingredients"
+
+
+def dict_key(col):
+    """Return the key of a column's dictionary table in files written before
+    the dictionaries were kept in DICT_TABLE."""
+    return f"/dict/{col}"
+
+
+def load_dictionaries(store, columns=None):
+    """Return {column: Index of strings} for the dictionary encoded columns in
+    store, where a string's position in the Index is its code. If columns is
+    given, only those columns' dictionaries are loaded."""
+    if columns is None:
+        columns = CATEGORICAL_COLUMNS
+    columns = CATEGORICAL_COLUMNS.intersection(columns)
+    values = {}
+    for col in columns:
+        if dict_key(col) in store:
+            values[col] = store.select(dict_key(col))["value"]
+    if DICT_TABLE in store and columns:
+        entries = store.select(DICT_TABLE)
+        for col, group in entries.groupby("column", sort=False):
+            if col in columns:
+                values[col] = pd.concat([values.get(col), group["value"]])
+    return {
+        col: pd.Index(v.sort_index().astype(object), dtype=object)
+        for col, v in values.items()
+    }
+
+
+def truncate_strings(df, columns, size=STR_SIZE):
+    """Return df with the strings in columns truncated to size characters,
+    with a warning saying which columns had longer strings."""
+    truncated = {}
+    for col in columns:
+        values = df[col].astype(object)
+        too_long = values.map(lambda v: isinstance(v, str) and len(v) > size)
+        too_long = too_long.to_numpy(bool)
+        if too_long.any():
+            truncated[col] = (too_long, values[too_long].str[:size].to_numpy())
+    if not truncated:
+        return df
+    df = df.copy()
+    for col, (too_long, values) in truncated.items():
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+        df.loc[too_long, col] = values
+    counts = [f"{col} ({too_long.sum()})" for col, (too_long, _) in truncated.items()]
+    warnings.warn(
+        f"Truncated strings longer than {size} characters in " + ", ".join(counts)
+    )
+    # Setting values splits the columns into their own blocks, which HDFStore
+    # can't append to a table whose columns share one
+    return df.copy()
+
+
+def _str_width(longest):
+    """Return the width of a new string column whose longest string has
+    longest characters: twice that rounded up to a power of two, so later
+    batches have room for longer strings, but at most STR_SIZE."""
+    return int(min(STR_SIZE, 2 ** np.ceil(np.log2(max(2 * longest, MIN_STR_SIZE)))))
+
+
+def decode(df, dictionaries):
+    """Replace the integer codes in df with Categoricals (in place). Columns
+    with no dictionary have no values, so all of their codes are -1. Files
+    written before encoding was added hold strings, which are left alone."""
+    for col in CATEGORICAL_COLUMNS.intersection(df.columns):
+        if pd.api.types.is_integer_dtype(df[col]):
+            dictionary = dictionaries.get(col, pd.Index([], dtype=object))
+            df[col] = pd.Categorical.from_codes(df[col].values, categories=dictionary)
+    return df
+
+
+def select(store, key, **kwargs):
+    """Same as `store.select`, but dictionary encoded columns are returned as
+    Categoricals. Also works when iterating with chunksize."""
+    dictionaries = load_dictionaries(store, kwargs.get("columns"))
+    result = store.select(key, **kwargs)
+    if isinstance(result, pd.DataFrame):
+        return decode(result, dictionaries)
+    return (decode(df, dictionaries) for df in result)
+
+
+def codes(store, col, values):
+    """Return the codes of values in a dictionary encoded column, e.g. for
+    where clauses. Values that aren't in the dictionary are left out."""
+    dictionary = load_dictionaries(store, [col]).get(col, pd.Index([]))
+    indexer = dictionary.get_indexer(values)
+    return indexer[indexer != -1].tolist()
+
+
+class DictionaryEncoder:
+    """Encode the categorical columns of DataFrames that are appended to a
+    store, keeping codes consistent from one append to the next by extending
+    the dictionaries as new values show up."""
+
+    def __init__(self, store):
+        self.store = store
+        self.dictionaries = load_dictionaries(store)
+
+    def encode(self, df):
+        """Replace the strings in df's categorical columns with codes (in
+        place), appending new strings to the dictionaries."""
+        for col in sorted(CATEGORICAL_COLUMNS.intersection(df.columns)):
+            dictionary = self.dictionaries.get(col, pd.Index([], dtype=object))
+            new = pd.Index(df[col].dropna().unique(), dtype=object)
+            new = new.difference(dictionary, sort=False)
+            if len(new):
+                new_codes = np.arange(len(dictionary), len(dictionary) + len(new))
+                self.store.append(
+                    DICT_TABLE,
+                    pd.DataFrame({"column": col, "value": new}, index=new_codes),
+                    data_columns=["column"],
+                    min_itemsize={"column": DICT_COLUMN_SIZE, "value": STR_SIZE},
+                    **HDF_OPTIONS,
+                )
+                dictionary = dictionary.append(new)
+                self.dictionaries[col] = dictionary
+            # Missing values aren't in the dictionary, so they get code -1
+            df[col] = dictionary.get_indexer(df[col]).astype(CODE_DTYPE)
+        return df
+
+
+def open_store(path, mode="r"):
+    """Open the recipe tables at path with the matching backend: a directory
+    or a path ending in `.parquet` is read with ParquetBackend, anything else
+    with HDFBackend. mode is "r", "a" or "w" (which deletes existing tables)."""
+    if path.rstrip(os.sep).endswith(PARQUET_EXTENSION) or os.path.isdir(path):
+        return ParquetBackend(path, mode)
+    return HDFBackend(path, mode)
+
+
+def widen(frames, columns):
+    """Lay out per-category ingredient DataFrames ({category: DataFrame}) like
+    the legacy wide ingredients table: the k-th row of a recipe holds its k-th
+    ingredient of each category, padded with missing values. Only the given
+    columns are kept."""
+    parts = []
+    for df in frames.values():
+        position = df.groupby(level=0).cumcount().values
+        parts.append(df.set_index(position, append=True))
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    wide = pd.concat(parts, axis=1).sort_index(level=[0, 1]).droplevel(1)
+    wide = wide.reindex(columns=[col for col in columns if col in wide.columns])
+    for col in wide.columns:
+        # Columns that aren't in the schema are left as they are
+        schema = COLUMNS.get(col)
+        if schema is not None and not schema.nullable:
+            wide[col] = wide[col].fillna(FILL_VALUES[schema.dtype])
+            wide[col] = wide[col].astype(schema.dtype)
+    return wide
+
+
+def select_wide(store, columns=None, chunksize=None, **filters):
+    """Read the legacy wide ingredients layout from a store that has a table
+    per ingredient category (see widen). Only the categories with a column in
+    columns are read, and rows are only padded to the longest of those
+    categories. Takes the same filters as select; with chunksize, chunks hold
+    the ingredients of chunksize recipes."""
+    if chunksize is not None:
+        return _iter_select_wide(store, columns, chunksize, filters)
+    if columns is None:
+        columns = [col for cat in INGREDIENT_CATEGORIES for col in CATEGORY_TABLES[cat]]
+    frames = {}
+    for category in INGREDIENT_CATEGORIES:
+        cols = [col for col in CATEGORY_TABLES[category] if col in columns]
+        if cols:
+            frames[category] = store.select(category, columns=cols, **filters)
+    return widen(frames, columns)
+
+
+def _wide_columns(store):
+    """Return the columns of the wide ingredients table put together from the
+    category tables of a store (see select_wide)."""
+    return [
+        col
+        for category in INGREDIENT_CATEGORIES
+        if category in store
+        for col in CATEGORY_TABLES[category]
+        if col in store.columns(category)
+    ]
+
+
+def _iter_select_wide(store, columns, chunksize, filters):
+    chunks = store.select(CORE_TABLE, columns=[], chunksize=chunksize, **filters)
+    for core in chunks:
+        if not len(core):
+            continue
+        if filters.get("ids") is None and filters.get("styles") is None:
+            # A range is cheaper to look up than a list of ids
+            yield select_wide(
+                store, columns, id_range=(core.index[0], core.index[-1] + 1)
+            )
+        else:
+            yield select_wide(store, columns, ids=core.index.values)
+
+
+def select_category(store, category, columns=None, **filters):
+    """Read the ingredients of one category, one row per ingredient. Stores
+    written before the category tables were added only have the wide
+    ingredients table, and the rows that pad it are dropped."""
+    if category in store:
+        return store.select(category, columns=columns, **filters)
+    if columns is None:
+        columns = CATEGORY_TABLES[category]
+    result = store.select(ING_TABLE, columns=columns, **filters)
+    if isinstance(result, pd.DataFrame):
+        return result.dropna(how="all")
+    return (df.dropna(how="all") for df in result)
+
+
+def copy_store(path, out_path, transform, chunksize=BUCKET_SIZE):
+    """Copy the recipe tables at path to a new store at out_path (in either
+    layout, see open_store), a chunk of chunksize recipes at a time, passing
+    each chunk of each table through transform(table, df), which returns the
+    DataFrame to write. The ingredients are copied as category tables, or as
+    the wide table for stores that only have that."""
+    with open_store(path) as store, open_store(out_path, "w") as out:
+        tables = [c for c in INGREDIENT_CATEGORIES if c in store] or [ING_TABLE]
+        chunks = store.select(CORE_TABLE, chunksize=chunksize)
+        for chunk, core in enumerate(iterate("select core", chunks)):
+            id_range = (core.index[0], core.index[-1] + 1)
+            with stage("transform", chunk=chunk) as s:
+                core = transform(CORE_TABLE, core)
+                ings = {
+                    table: transform(table, store.select(table, id_range=id_range))
+                    for table in tables
+                }
+                s.rows = len(core)
+            with stage("write", chunk=chunk) as s:
+                out.append(CORE_TABLE, core)
+                for table, df in ings.items():
+                    out.append(table, df, origins=core["origin"])
+                s.rows = len(core)
+
+
+def _filter_styles(df, styles, columns):
+    """Keep the rows of df whose style is in styles, then drop the style
+    column if it wasn't asked for."""
+    df = df[df["style_name"].isin(styles)]
+    if columns is not None and "style_name" not in columns:
+        df = df.drop(columns="style_name")
+    return df
+
+
+class HDFBackend:
+    """Recipe tables in a PyTables HDF, with the categorical columns
+    dictionary encoded. Filters on ids use the table index; style filters are
+    applied after reading."""
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.store = pd.HDFStore(path, mode)
+        self.encoder = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, table):
+        return "/" + table.strip("/") in self.store
+
+    def close(self):
+        self.store.close()
+
+    def append(self, table, df, origins=None):
+        """Append a batch of rows (index is the recipe id) to a table. Every
+        batch must have the same columns and dtypes. origins is only used by
+        ParquetBackend."""
+        if self.encoder is None:
+            self.encoder = DictionaryEncoder(self.store)
+        # Encoding is done in place, and callers may still need the strings
+        df = self.encoder.encode(df.copy())
+        # Strings read back from a store have the string dtype rather than
+        # object
+        str_cols = [
+            col
+            for col in df.columns
+            if df[col].dtype == object or isinstance(df[col].dtype, pd.StringDtype)
+        ]
+        width = self._str_width(table, df, str_cols)
+        df = truncate_strings(df, str_cols, width)
+        self.store.append(
+            table,
+            df,
+            # Only the dictionary encoded columns (integer codes) are filtered
+            # on, so only they (and the index) are indexed
+            data_columns=sorted(CATEGORICAL_COLUMNS.intersection(df.columns)),
+            min_itemsize={"values": width} if str_cols else None,
+            **HDF_OPTIONS,
+        )
+
+    def _str_width(self, table, df, str_cols):
+        """Return the width of the free text columns of a table: the width
+        they were created with, or one that fits the strings of df."""
+        if table in self:
+            for axis in self.store.get_storer(table).values_axes:
+                if axis.kind == "string":
+                    return axis.itemsize
+        longest = max(
+            (df[col].dropna().str.len().max() for col in str_cols), default=0
+        )
+        return _str_width(0 if pd.isna(longest) else longest)
+
+    def index(self, table):
+        """Return the recipe id of every row of a table."""
+        return self.store.select_column(table, "index").values
+
+    def columns(self, table):
+        """Return the names of the columns of a table."""
+        table = table.strip("/")
+        if table == ING_TABLE and table not in self:
+            return _wide_columns(self)
+        return list(self.store.get_storer(table).non_index_axes[0][1])
+
+    def nrows(self, table):
+        return self.store.get_storer(table).nrows
+
+    def select(
+        self, table, columns=None, id_range=None, ids=None, styles=None, chunksize=None
+    ):
+        """Read the rows of a table for the recipes with lo <= id < hi (if
+        id_range=(lo, hi) is given), ids in ids and style_name in styles. With
+        chunksize, return an iterator of DataFrames with chunksize rows each.
+        The wide ingredients table is put together from the category tables if
+        it isn't stored (see select_wide)."""
+        table = table.strip("/")
+        if table == ING_TABLE and table not in self:
+            return select_wide(
+                self, columns, chunksize, id_range=id_range, ids=ids, styles=styles
+            )
+        if styles is not None and table != CORE_TABLE:
+            style_ids = self.select(CORE_TABLE, columns=[], styles=styles).index
+            ids = style_ids if ids is None else np.intersect1d(ids, style_ids)
+        where = None
+        if ids is not None:
+            # Only the index column is scanned; the matching rows are then read
+            # by their coordinates.
+            index = pd.Index(self.index(table))
+            mask = index.isin(ids)
+            if id_range is not None:
+                mask &= (index >= id_range[0]) & (index < id_range[1])
+            where = np.flatnonzero(mask)
+            if not len(where):
+                # Empty coordinates would read every row. Ids are never negative.
+                where = "index < 0"
+        elif id_range is not None:
+            where = f"index >= {id_range[0]} & index < {id_range[1]}"
+
+        read_columns = columns
+        if styles is not None and table == CORE_TABLE and columns is not None:
+            read_columns = list(columns) + ["style_name"]
+        result = select(
+            self.store, table, where=where, columns=read_columns, chunksize=chunksize
+        )
+        if styles is None or table != CORE_TABLE:
+            return result
+        if isinstance(result, pd.DataFrame):
+            return _filter_styles(result, styles, columns)
+        return (_filter_styles(df, styles, columns) for df in result)
+
+    def find(self, table, col, values):
+        """Return the set of recipe ids with a row where col is in values."""
+        ids = set()
+        # The values are stored as codes
+        value_codes = codes(self.store, col, values)
+        # Keep each query under pandas' limit for an `in` condition, otherwise
+        # it falls back to reading the whole table.
+        for i in range(0, len(value_codes), 31):
+            batch = value_codes[i : i + 31]
+            found = self.store.select(table, where=f"{col} in batch", columns=[col])
+            ids.update(found.index)
+        return ids
+
+
+class ParquetBackend:
+    """Recipe tables in a directory of Parquet files, one subdirectory per
+    table, hive partitioned by origin and by id range:
+
+        all_recipes.parquet/core/origin=brewtoad/id_bucket=3/part-<uuid>-0.parquet
+
+    The ingredients table is partitioned by the origin of its recipe, so it
+    has an origin column too. Files are memory mapped when read, and only the
+    columns asked for are read. Filters on id ranges, ids and styles skip the
+    partitions and row groups that can't match."""
+
+    def __init__(self, path, mode="r"):
+        if pa is None:
+            raise ImportError("The Parquet backend needs pyarrow.")
+        self.path = path
+        if mode == "w" and os.path.exists(path):
+            shutil.rmtree(path)
+        if mode == "r" and not os.path.isdir(path):
+            raise FileNotFoundError(f"No recipe tables at {path}.")
+        os.makedirs(path, exist_ok=True)
+        self.filesystem = pafs.LocalFileSystem(use_mmap=True)
+        self.partitioning = ds.partitioning(
+            pa.schema([("origin", pa.string()), ("id_bucket", pa.int64())]),
+            flavor="hive",
+        )
+        self._datasets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, table):
+        return os.path.isdir(os.path.join(self.path, table.strip("/")))
+
+    def close(self):
+        self._datasets.clear()
+
+    def _dataset(self, table):
+        table = table.strip("/")
+        if table not in self._datasets:
+            if table not in self:
+                raise KeyError(f"No table named {table} in {self.path}.")
+            self._datasets[table] = ds.dataset(
+                os.path.join(self.path, table),
+                format="parquet",
+                partitioning=self.partitioning,
+                filesystem=self.filesystem,
+            )
+        return self._datasets[table]
+
+    @staticmethod
+    def _schema(df):
+        """Return the Arrow schema for a batch, so that every file of a table
+        has the same schema even if a batch has a column with no values."""
+        fields = []
+        for col, dtype in df.dtypes.items():
+            if col == "origin":
+                # A partition column, so it's written in the paths
+                fields.append((col, pa.string()))
+            elif col in CATEGORICAL_COLUMNS:
+                fields.append((col, pa.dictionary(pa.int32(), pa.string())))
+            elif pd.api.types.is_numeric_dtype(dtype):
+                fields.append((col, pa.from_numpy_dtype(dtype)))
+            else:
+                fields.append((col, pa.string()))
+        return pa.schema(fields)
+
+    def append(self, table, df, origins=None):
+        """Append a batch of rows (index is the recipe id) to a table. Every
+        batch must have the same columns and dtypes. Tables without an origin
+        column are partitioned by origins, which maps recipe id -> origin."""
+        table = table.strip("/")
+        df = df.copy()
+        if "origin" not in df.columns:
+            df["origin"] = df.index.map(origins) if origins is not None else None
+        df["id_bucket"] = df.index // BUCKET_SIZE
+        df = df.rename_axis("id").reset_index()
+        pq.write_to_dataset(
+            pa.Table.from_pandas(df, schema=self._schema(df), preserve_index=False),
+            os.path.join(self.path, table),
+            partitioning=self.partitioning,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            **PARQUET_OPTIONS,
+        )
+        self._datasets.pop(table, None)
+
+    def _expression(self, table, id_range=None, ids=None, styles=None):
+        """Return the filter expression for a select, or None for no filter.
+        Conditions on the id are repeated on id_bucket so that whole
+        partitions are skipped."""
+        field = ds.field
+        conditions = []
+        if styles is not None:
+            if table.strip("/") == CORE_TABLE:
+                conditions.append(field("style_name").isin(list(styles)))
+            else:
+                style_ids = self.index(CORE_TABLE, styles=styles)
+                ids = style_ids if ids is None else np.intersect1d(ids, style_ids)
+        if id_range is not None:
+            lo, hi = id_range
+            conditions.append(field("id_bucket") >= lo // BUCKET_SIZE)
+            conditions.append(field("id_bucket") <= (hi - 1) // BUCKET_SIZE)
+            conditions.append((field("id") >= lo) & (field("id") < hi))
+        if ids is not None:
+            ids = np.unique(np.asarray(ids, dtype=np.int64))
+            conditions.append(field("id_bucket").isin(np.unique(ids // BUCKET_SIZE)))
+            conditions.append(field("id").isin(ids))
+        if not conditions:
+            return None
+        expression = conditions[0]
+        for condition in conditions[1:]:
+            expression &= condition
+        return expression
+
+    def index(self, table, **filters):
+        """Return the sorted recipe id of every row of a table. Takes the same
+        filters as select."""
+        expression = self._expression(table, **filters)
+        ids = self._dataset(table).to_table(columns=["id"], filter=expression)
+        return np.sort(ids.column("id").to_numpy())
+
+    def columns(self, table):
+        """Return the names of the columns of a table."""
+        if table.strip("/") == ING_TABLE and table not in self:
+            return _wide_columns(self)
+        names = self._dataset(table).schema.names
+        return [col for col in names if col not in ("id", "id_bucket")]
+
+    def nrows(self, table):
+        return self._dataset(table).count_rows()
+
+    def select(
+        self, table, columns=None, id_range=None, ids=None, styles=None, chunksize=None
+    ):
+        """Read the rows of a table for the recipes with lo <= id < hi (if
+        id_range=(lo, hi) is given), ids in ids and style_name in styles. With
+        chunksize, return an iterator of DataFrames holding chunksize recipes
+        each (so a recipe's rows are never split between chunks). The wide
+        ingredients table is put together from the category tables if it isn't
+        stored (see select_wide)."""
+        filters = {"id_range": id_range, "ids": ids, "styles": styles}
+        if table.strip("/") == ING_TABLE and table not in self:
+            return select_wide(self, columns, chunksize, **filters)
+        if chunksize is not None:
+            return self._iter_select(table, columns, chunksize, filters)
+        dataset = self._dataset(table)
+        read_columns = None if columns is None else ["id"] + list(columns)
+        result = dataset.to_table(
+            columns=read_columns, filter=self._expression(table, **filters)
+        )
+        df = result.to_pandas()
+        # Files are read in no particular order. A recipe's rows are all in
+        # the same file, so a stable sort keeps them in their original order.
+        df = df.set_index("id").sort_index(kind="stable")
+        if columns is None:
+            df = df.drop(columns="id_bucket")
+        if "origin" in df.columns:
+            df["origin"] = df["origin"].astype("category")
+        return df
+
+    def _iter_select(self, table, columns, chunksize, filters):
+        ids = np.unique(self.index(table, **filters))
+        if filters["styles"] is not None and table.strip("/") != CORE_TABLE:
+            # Already applied through ids, so the core table isn't read again
+            # for every chunk
+            filters = dict(filters, ids=ids, styles=None)
+        for i in range(0, len(ids), chunksize):
+            chunk = ids[i : i + chunksize]
+            id_range = (chunk[0], chunk[-1] + 1)
+            if filters["id_range"] is not None:
+                lo, hi = filters["id_range"]
+                id_range = (max(lo, id_range[0]), min(hi, id_range[1]))
+            yield self.select(table, columns, **dict(filters, id_range=id_range))
+
+    def find(self, table, col, values):
+        """Return the set of recipe ids with a row where col is in values."""
+        found = self._dataset(table).to_table(
+            columns=["id"], filter=ds.field(col).isin(list(values))
+        )
+        return set(found.column("id").to_pylist())
@@ -0,0 +1,357 @@
+"""
+Aggregate the properties of the recipes (OG, FG, IBU, SRM and ABV, see
+beerai.utils.recipe_properties) per style, for the style dashboards.
+
+The aggregates are kept per style and origin (GROUP_COLS), and are all sums
+or extremes, so they can be rolled up (e.g. to per style) and merged with
+those of new recipes:
+
+- moments: the count, sum, sum of squares, min and max of each property.
+- hist: the counts of each property in BINS bins over RANGES, from which the
+  quantiles are interpolated.
+- hist2d: the counts of pairs of properties (PAIRS) in BINS_2D x BINS_2D bins.
+
+They're computed in one chunked pass over all_recipes and written to
+style_stats.h5, a few MB at most:
+
+    stats = StyleStats.load()
+    stats.summary()  # count, mean, std, min, quantiles and max per style
+    stats.summary(by=["style_name", "origin"])
+    counts, ibu_edges, abv_edges = stats.histogram2d("ibu", "abv", "american ipa")
+
+Running the module again only aggregates the recipes added to all_recipes since
+(those with higher ids), unless the recipes it had aggregated have changed.
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+from ..cleaning import clean_efficiency, clean_ferm_yield
+from ..config import DATA_DIR
+from ..utils import recipe_properties
+from .instrument import add_arguments, enable_from_args, iterate, stage
+from .recipe2vec import CHUNK_SIZE, CORE_COLS, RECIPE_FILE
+from .store import CORE_TABLE, ING_TABLE, open_store
+
+STATS_FILE = os.path.join(DATA_DIR, "processed/style_stats.h5")
+GROUP_COLS = ["style_name", "origin"]
+# Recipes without a style or origin are grouped under this
+MISSING = ""
+ING_COLS = [
+    "ferm_name",
+    "ferm_amount",
+    "ferm_yield",
+    "ferm_color",
+    "hop_amount",
+    "hop_alpha",
+    "hop_form",
+    "hop_use",
+    "hop_time",
+    "yeast_attenuation",
+]
+PROPERTIES = ["og", "fg", "ibu", "srm", "abv"]
+# Histogram ranges. Values outside them are counted in the first or last bin.
+RANGES = {
+    "og": (1.0, 1.15),
+    "fg": (0.99, 1.04),
+    "ibu": (0, 200),
+    "srm": (0, 80),
+    "abv": (0, 20),
+}
+BINS = 100
+PAIRS = [("ibu", "abv"), ("srm", "abv"), ("og", "fg")]
+BINS_2D = 20
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+# The IBU formula the dashboards use
+UTILIZATION_FACTOR = 3.75
+MOMENTS = {"count": "sum", "sum": "sum", "sumsq": "sum", "min": "min", "max": "max"}
+MAX_ID = np.iinfo(np.int64).max
+
+
+def to_bins(values, prop, bins):
+    """Return the bin of each value of a property, in bins bins over its
+    range."""
+    lo, hi = RANGES[prop]
+    b = np.floor((np.asarray(values, dtype=float) - lo) / (hi - lo) * bins)
+    return np.clip(b, 0, bins - 1).astype(np.int16)
+
+
+def bin_edges(prop, bins):
+    return np.linspace(*RANGES[prop], bins + 1)
+
+
+def chunk_properties(core, ings):
+    """Return the GROUP_COLS and PROPERTIES of a chunk of recipes, indexed by
+    recipe id, cleaning the efficiencies and yields like the dashboards do."""
+    core = core.copy()
+    core["efficiency"] = clean_efficiency(core["efficiency"])
+    df = core.join(ings)
+    if "ferm_type" not in df:
+        # Stores written before it was kept: every fermentable counts as a grain
+        df["ferm_type"] = np.nan
+    df["ferm_yield"] = clean_ferm_yield(df)
+    props = recipe_properties(df, utilization_factor=UTILIZATION_FACTOR)
+    groups = core[GROUP_COLS].astype(object).fillna(MISSING)
+    return groups.join(props[PROPERTIES])
+
+
+class StyleStats:
+    """The aggregates of the recipe properties per group (see the module
+    docstring), for the recipes up to last_id. n_recipes is the number of
+    recipes aggregated."""
+
+    def __init__(self, moments, hist, hist2d, last_id=-1, n_recipes=0):
+        self.moments = moments
+        self.hist = hist
+        self.hist2d = hist2d
+        self.last_id = last_id
+        self.n_recipes = n_recipes
+
+    @classmethod
+    def from_properties(cls, props):
+        """Aggregate a DataFrame of GROUP_COLS and PROPERTIES per recipe."""
+        grouped = props.groupby(GROUP_COLS)[PROPERTIES]
+        moments = pd.concat(
+            {
+                "count": grouped.count(),
+                "sum": grouped.sum(),
+                "sumsq": (props[PROPERTIES] ** 2)
+                .groupby([props[col] for col in GROUP_COLS])
+                .sum(),
+                "min": grouped.min(),
+                "max": grouped.max(),
+            },
+            axis=1,
+        )
+        moments.columns = [f"{prop}_{stat}" for stat, prop in moments.columns]
+
+        values = props.melt(GROUP_COLS, PROPERTIES, "property").dropna()
+        values["bin"] = np.zeros(len(values), dtype=np.int16)
+        for prop in PROPERTIES:
+            mask = values["property"] == prop
+            values.loc[mask, "bin"] = to_bins(values.loc[mask, "value"], prop, BINS)
+        hist = values.groupby(GROUP_COLS + ["property", "bin"]).size()
+
+        parts = []
+        for x, y in PAIRS:
+            pair = props[GROUP_COLS + [x, y]].dropna()
+            pair = pair[GROUP_COLS].assign(
+                pair=f"{x}_{y}",
+                x_bin=to_bins(pair[x], x, BINS_2D),
+                y_bin=to_bins(pair[y], y, BINS_2D),
+            )
+            parts.append(pair.groupby(GROUP_COLS + ["pair", "x_bin", "y_bin"]).size())
+        hist2d = pd.concat(parts)
+
+        last_id = props.index.max() if len(props) else -1
+        return cls(
+            moments, hist.rename("count"), hist2d.rename("count"), last_id, len(props)
+        )
+
+    def merge(self, other):
+        """Return the aggregates of the recipes of both."""
+        moments = pd.concat([self.moments, other.moments])
+        moments = moments.groupby(level=GROUP_COLS).agg(
+            {col: MOMENTS[col.rsplit("_", 1)[1]] for col in moments.columns}
+        )
+        hist = pd.concat([self.hist, other.hist])
+        hist2d = pd.concat([self.hist2d, other.hist2d])
+        return StyleStats(
+            moments,
+            hist.groupby(level=hist.index.names).sum(),
+            hist2d.groupby(level=hist2d.index.names).sum(),
+            max(self.last_id, other.last_id),
+            self.n_recipes + other.n_recipes,
+        )
+
+    def save(self, path=STATS_FILE):
+        with pd.HDFStore(path, "w", complevel=9, complib="blosc") as store:
+            store.put("moments", self.moments.reset_index(), format="table")
+            store.put("hist", self.hist.reset_index(), format="table")
+            store.put("hist2d", self.hist2d.reset_index(), format="table")
+            store.put(
+                "meta",
+                pd.Series({"last_id": self.last_id, "n_recipes": self.n_recipes}),
+            )
+
+    @classmethod
+    def load(cls, path=STATS_FILE):
+        with pd.HDFStore(path, "r") as store:
+            meta = store.get("meta")
+            return cls(
+                store.get("moments").set_index(GROUP_COLS),
+                store.get("hist").set_index(GROUP_COLS + ["property", "bin"])["count"],
+                store.get("hist2d").set_index(GROUP_COLS + ["pair", "x_bin", "y_bin"])[
+                    "count"
+                ],
+                int(meta["last_id"]),
+                int(meta["n_recipes"]),
+            )
+
+    def summary(self, by=("style_name",), quantiles=QUANTILES):
+        """Return the count, mean, standard deviation, min, quantiles and max
+        of each property per group of the columns in by (a subset of
+        GROUP_COLS). Columns are (property, statistic). The quantiles are
+        interpolated from the histograms, so they're accurate to a bin
+        width."""
+        by = list(by)
+        moments = self.moments.groupby(level=by).agg(
+            {col: MOMENTS[col.rsplit("_", 1)[1]] for col in self.moments.columns}
+        )
+        hist = self.hist.groupby(level=by + ["property", "bin"]).sum()
+        stats = {}
+        for prop in PROPERTIES:
+            count = moments[f"{prop}_count"]
+            mean = moments[f"{prop}_sum"] / count
+            var = moments[f"{prop}_sumsq"] / count - mean**2
+            stats[(prop, "count")] = count
+            stats[(prop, "mean")] = mean
+            # Unbiased, like DataFrame.std
+            stats[(prop, "std")] = np.sqrt(var.clip(lower=0) * count / (count - 1))
+            stats[(prop, "min")] = moments[f"{prop}_min"]
+            counts = (
+                hist.xs(prop, level="property")
+                .unstack("bin", fill_value=0)
+                .reindex(index=moments.index, columns=range(BINS), fill_value=0)
+            )
+            values = _quantiles(counts.to_numpy(), bin_edges(prop, BINS), quantiles)
+            for q, value in zip(quantiles, values):
+                stats[(prop, f"p{round(q * 100):02d}")] = pd.Series(
+                    value, index=moments.index
+                ).clip(moments[f"{prop}_min"], moments[f"{prop}_max"])
+            stats[(prop, "max")] = moments[f"{prop}_max"]
+        return pd.DataFrame(stats)
+
+    def histogram2d(self, x, y, style, origin=None):
+        """Return the counts of a pair of properties (in PAIRS) for the
+        recipes of a style (and origin, all origins by default), and the bin
+        edges of x and y, like np.histogram2d."""
+        hist = self.hist2d.xs(style, level="style_name").xs(
+            f"{x}_{y}", level="pair"
+        )
+        if origin is not None:
+            hist = hist.xs(origin, level="origin")
+        hist = hist.groupby(level=["x_bin", "y_bin"]).sum()
+        counts = np.zeros((BINS_2D, BINS_2D), dtype=np.int64)
+        counts[
+            hist.index.get_level_values("x_bin"), hist.index.get_level_values("y_bin")
+        ] = hist.values
+        return counts, bin_edges(x, BINS_2D), bin_edges(y, BINS_2D)
+
+
+def _quantiles(counts, edges, quantiles):
+    """Interpolate quantiles from histograms, an array (groups, bins) of
+    counts over bins with the given edges. Return a list with an array of
+    values per quantile, NaN for groups without counts."""
+    cumulative = counts.cumsum(axis=1)
+    total = cumulative[:, -1]
+    rows = np.arange(len(counts))
+    values = []
+    for q in quantiles:
+        target = q * total
+        # First bin the cumulative count reaches the target in
+        b = np.minimum((cumulative < target[:, None]).sum(axis=1), counts.shape[1] - 1)
+        before = np.where(b > 0, cumulative[rows, b - 1], 0)
+        in_bin = counts[rows, b]
+        fraction = np.divide(
+            target - before, in_bin, out=np.zeros(len(counts)), where=in_bin > 0
+        )
+        value = edges[b] + fraction * (edges[b + 1] - edges[b])
+        values.append(np.where(total > 0, value, np.nan))
+    return values
+
+
+def aggregate(path=RECIPE_FILE, start=0):
+    """Return the StyleStats of the recipes of the all_recipes store (HDF or
+    Parquet) with ids from start."""
+    stats = None
+    with open_store(path) as store:
+        chunks = store.select(
+            CORE_TABLE,
+            columns=CORE_COLS + GROUP_COLS,
+            id_range=(start, MAX_ID),
+            chunksize=CHUNK_SIZE,
+        )
+        for chunk, core in enumerate(iterate("select core", chunks)):
+            if not len(core):
+                continue
+            id_range = (core.index[0], core.index[-1] + 1)
+            with stage("select", chunk=chunk) as s:
+                ings = store.select(ING_TABLE, columns=ING_COLS, id_range=id_range)
+                s.rows = len(ings)
+            with stage("properties", chunk=chunk) as s:
+                props = chunk_properties(core, ings)
+                s.rows = len(props)
+            with stage("aggregate", chunk=chunk) as s:
+                new = StyleStats.from_properties(props)
+                stats = new if stats is None else stats.merge(new)
+                s.rows = len(props)
+    return stats
+
+
+def update(path=RECIPE_FILE, out=STATS_FILE, full=False):
+    """Aggregate the recipes added to the store since the aggregates in out
+    were computed and merge them in. The aggregates are recomputed from
+    scratch if full is True, out doesn't exist or the recipes that were
+    aggregated before aren't the same number any more (the store was
+    rewritten)."""
+    stats = None
+    if not full and os.path.exists(out):
+        stats = StyleStats.load(out)
+        with open_store(path) as store:
+            seen = store.select(CORE_TABLE, columns=[], id_range=(0, stats.last_id + 1))
+        if len(seen) != stats.n_recipes:
+            print("Recipes were changed since they were aggregated, starting over.")
+            stats = None
+    start = 0 if stats is None else stats.last_id + 1
+    new = aggregate(path, start)
+    if new is None:
+        print("No new recipes.")
+        if stats is not None:
+            return stats
+    elif stats is None:
+        stats = new
+    else:
+        stats = stats.merge(new)
+    if stats is None:
+        raise ValueError(f"There are no recipes in {path}.")
+    print(f"Aggregated {stats.n_recipes} recipes.")
+    stats.save(out)
+    return stats
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to aggregate the properties of the recipes per "
+        "style and origin, for the style dashboards. Only new recipes are "
+        "aggregated if the aggregates exist."
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=RECIPE_FILE,
+        help=f"The all_recipes store to aggregate. Default is {RECIPE_FILE}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=STATS_FILE,
+        help=f"Where to write the aggregates. Default is {STATS_FILE}.",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Aggregate all the recipes again.",
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    update(args.file, args.output, args.full)
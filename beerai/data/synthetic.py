@@ -0,0 +1,705 @@
+"""Synthetic recipes for benchmarks and load tests.
+
+Recipes are made up, but have the columns, dtypes and rough value ranges of
+converted recipes, so the pipeline can be run on any number of them without
+the real data:
+
+    core, ings = make_recipes(1000)        # ings is {category: DataFrame}
+    docs = dict(iter_beerxml(core, ings))  # recipe id -> BeerXML bytes
+    maps = make_maps()                     # raw name -> standard name
+
+Recipes are drawn from a CorpusModel. By default, raw ingredient names are
+built-in standard names with a variant number appended (e.g. "cascade #2"),
+and make_maps maps them back to the standard names. CorpusModel.fit draws
+names, spellings, ingredient counts and styles from the real maps, vocabulary,
+name index and recipe store instead.
+
+To write a whole corpus (in parallel, deterministically for a seed) as a recipe
+store, BeerXML files or archives:
+
+    python -m beerai.data.synthetic -n 1000000 --format archive --fit
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import pickle
+
+from contextlib import ExitStack
+from joblib import delayed, Parallel
+from xml.sax.saxutils import escape
+
+from ..config import DATA_DIR, INGREDIENT_CATEGORIES
+from .archive import EXTENSION, ArchiveWriter, DirectoryWriter
+from .name_index import NameIndex, index_path
+from .recipe2vec import RECIPE_FILE, load_vocab
+from .schema import CATEGORY_TABLES, CORE, COLUMNS, cast
+from .store import CORE_TABLE, PARQUET_EXTENSION, open_store, select_category
+from .units import UNITS, normalize_amounts
+from .vocabulary import MAP_NAME
+from .xml2h5 import N_CPUS, append_frames, write_index
+
+STANDARD_NAMES = {
+    "ferm": [
+        "2 row",
+        "pilsner",
+        "munich",
+        "vienna",
+        "wheat malt",
+        "crystal 40",
+        "crystal 120",
+        "chocolate malt",
+        "roasted barley",
+        "flaked oats",
+        "corn sugar",
+        "light dry extract",
+        "rice hulls",
+    ],
+    "hop": [
+        "cascade",
+        "centennial",
+        "citra",
+        "simcoe",
+        "mosaic",
+        "saaz",
+        "hallertau",
+        "east kent goldings",
+        "fuggle",
+        "magnum",
+    ],
+    "yeast": ["us-05", "wlp001", "wy1056", "s-04", "wlp300", "w-34/70"],
+    "misc": ["irish moss", "whirlfloc", "gypsum", "coriander", "orange peel"],
+}
+FERM_TYPES = {
+    "corn sugar": "sugar",
+    "light dry extract": "dry extract",
+    "rice hulls": "adjunct",
+    "flaked oats": "adjunct",
+}
+STYLES = [
+    ("american ipa", "21a"),
+    ("american pale ale", "18b"),
+    ("german pils", "5d"),
+    ("weissbier", "10a"),
+    ("irish stout", "15b"),
+    ("saison", "25b"),
+]
+STYLE_COLS = ["style_name", "style_category"]
+ORIGINS = ["brewtoad", "brewersfriend"]
+INGREDIENT_ORIGINS = ["us", "de", "uk", None]
+MODIFIERS = ["Crushed", "Ground", "Whole", "Dried"]
+N_VARIANTS = 4
+# Number of ingredients of each category in a recipe: uniform in [low, high)
+COUNTS = {"ferm": (1, 9), "hop": (1, 8), "yeast": (1, 3), "misc": (0, 4)}
+ORIGIN_RATE = 0.3
+MODIFIER_RATE = 0.1
+# Typo rate of fitted models when there's no store to measure it on
+TYPO_RATE = 0.02
+# Recipes fitted to when fitting to a store
+FIT_SAMPLE = 100000
+# Recipes generated per task when writing a corpus
+SHARD_SIZE = 10000
+STORE_FORMATS = ["hdf", "parquet"]
+
+
+def raw_names(category, n_variants=N_VARIANTS):
+    """Return the raw names of a category: each standard name, and
+    n_variants - 1 numbered variants of it."""
+    return [
+        name if i == 0 else f"{name} #{i}"
+        for name in STANDARD_NAMES[category]
+        for i in range(n_variants)
+    ]
+
+
+def make_maps(n_variants=N_VARIANTS):
+    """Return {category: ingredient map} covering every raw name."""
+    return {
+        category: {
+            raw: raw.split(" #")[0] for raw in raw_names(category, n_variants)
+        }
+        for category in INGREDIENT_CATEGORIES
+    }
+
+
+def make_vocab(maps):
+    """Return the vocabulary create_vocab would build from maps."""
+    vocab = {}
+    for category in INGREDIENT_CATEGORIES:
+        ings = sorted(set(maps[category].values()))
+        vocab.update({f"{category}_{ing}": i for i, ing in enumerate(ings, len(vocab))})
+        if category == "hop":
+            vocab.update(
+                {f"hop_{ing}_dry": i for i, ing in enumerate(ings, len(vocab))}
+            )
+    return vocab
+
+
+def typo(name, rng):
+    """Return name with a random character deleted, doubled or swapped with
+    the next one."""
+    if len(name) < 2:
+        return name + name
+    i = rng.integers(len(name) - 1)
+    op = rng.integers(3)
+    if op == 0:
+        return name[:i] + name[i + 1 :]
+    if op == 1:
+        return name[:i] + name[i] + name[i:]
+    return name[:i] + name[i + 1] + name[i] + name[i + 2 :]
+
+
+class CorpusModel:
+    """The distributions synthetic recipes are drawn from:
+
+    - names: {category: (raw names, probabilities)}
+    - standard: {category: {raw name: standard name}}
+    - counts: {category: probabilities of a recipe having 0, 1, 2, ...
+      ingredients of the category}
+    - styles: ([(style name, style category)], probabilities)
+    - origin_rate: fraction of fermentables and hops with an origin, which
+      is written in the BeerXML name, e.g. "Cascade (US)", like some sites do
+    - modifier_rate: fraction of misc names with a modifier, e.g.
+      "Coriander (Crushed)"
+    - typo_rate: fraction of names with a typo, which the maps don't cover
+    """
+
+    def __init__(
+        self,
+        names,
+        standard,
+        counts,
+        styles,
+        origin_rate=ORIGIN_RATE,
+        modifier_rate=MODIFIER_RATE,
+        typo_rate=0.0,
+    ):
+        self.names = names
+        self.standard = standard
+        self.counts = counts
+        self.styles = styles
+        self.origin_rate = origin_rate
+        self.modifier_rate = modifier_rate
+        self.typo_rate = typo_rate
+
+    @classmethod
+    def default(cls, n_variants=N_VARIANTS):
+        """The built-in names (see make_maps), with every raw name equally
+        likely and no typos."""
+        maps = make_maps(n_variants)
+        names = {}
+        counts = {}
+        for category in INGREDIENT_CATEGORIES:
+            raws = np.array(sorted(maps[category]), dtype=object)
+            names[category] = (raws, np.full(len(raws), 1 / len(raws)))
+            low, high = COUNTS[category]
+            p = np.zeros(high)
+            p[low:] = 1 / (high - low)
+            counts[category] = p
+        styles = (STYLES, np.full(len(STYLES), 1 / len(STYLES)))
+        return cls(names, maps, counts, styles)
+
+    @classmethod
+    def fit(cls, maps, vocab=None, index=None, store_path=None, sample=FIT_SAMPLE):
+        """Fit the distributions to the real data that's available:
+
+        - maps give the raw names and their standard names. If vocab is
+          given, only names whose standard name is in it are kept, so the
+          recipes can be vectorised.
+        - index (a NameIndex) gives how often each raw name is used. Without
+          it, every raw name in the maps is equally likely, so ingredients
+          with many spellings are the most common, as in the real data.
+        - The first `sample` recipes of the store at store_path give the
+          ingredient counts, styles, origin rate and typo rate (the fraction
+          of names the maps don't cover).
+
+        The built-in defaults are used for whatever can't be fitted. Modifiers
+        are stripped from the names when recipes are converted, so their rate
+        is always the default."""
+        model = cls.default()
+        for category in INGREDIENT_CATEGORIES:
+            ing_map = maps.get(category) or {}
+            if vocab:
+                ing_map = {
+                    raw: std
+                    for raw, std in ing_map.items()
+                    if f"{category}_{std}" in vocab
+                }
+            if not ing_map:
+                continue
+            raws = np.array(sorted(ing_map), dtype=object)
+            weights = np.ones(len(raws))
+            if index is not None:
+                used = np.array([index.count(category, raw) for raw in raws], float)
+                if used.sum() > 0:
+                    weights = used
+            keep = weights > 0
+            model.names[category] = (raws[keep], weights[keep] / weights[keep].sum())
+            model.standard[category] = ing_map
+        model.typo_rate = TYPO_RATE
+        if store_path is not None:
+            model._fit_store(store_path, maps, sample)
+        return model
+
+    def _fit_store(self, path, maps, sample):
+        with open_store(path) as store:
+            core = next(
+                iter(store.select(CORE_TABLE, columns=STYLE_COLS, chunksize=sample)),
+                None,
+            )
+            if core is None or core.empty:
+                return
+            id_range = (core.index[0], core.index[-1] + 1)
+            ings = {
+                category: select_category(store, category, id_range=id_range)
+                for category in INGREDIENT_CATEGORIES
+            }
+
+        styles = core.dropna().groupby(STYLE_COLS, observed=True).size()
+        if len(styles):
+            self.styles = (list(styles.index), (styles / styles.sum()).values)
+        for category, df in ings.items():
+            per_recipe = df.groupby(level=0).size().reindex(core.index, fill_value=0)
+            self.counts[category] = np.bincount(per_recipe) / len(per_recipe)
+        with_origin = [ings[cat][f"{cat}_origin"].notna() for cat in ["ferm", "hop"]]
+        n = sum(len(s) for s in with_origin)
+        if n:
+            self.origin_rate = sum(s.sum() for s in with_origin) / n
+        names = [
+            ings[cat][f"{cat}_name"].dropna().astype(object).isin(maps.get(cat, {}))
+            for cat in INGREDIENT_CATEGORIES
+        ]
+        n = sum(len(s) for s in names)
+        if n:
+            self.typo_rate = 1 - sum(s.sum() for s in names) / n
+
+    def mean_ingredients(self):
+        """Return the mean number of ingredients in a recipe."""
+        return sum(p @ np.arange(len(p)) for p in self.counts.values())
+
+
+def recipes_for_rows(n_rows, model=None):
+    """Return the number of recipes that have about n_rows ingredients."""
+    if model is None:
+        model = CorpusModel.default()
+    return max(int(round(n_rows / model.mean_ingredients())), 1)
+
+
+def _make_core(ids, rng, model):
+    n = len(ids)
+    style_names, style_p = model.styles
+    styles = rng.choice(len(style_names), size=n, p=style_p)
+    batch_size = rng.uniform(10, 40, n)
+    core = pd.DataFrame(
+        {
+            "recipe_file": [f"recipe_{i}.xml" for i in ids],
+            "origin": rng.choice(ORIGINS, n),
+            "name": [f"recipe {i}" for i in ids],
+            "brewer": [f"brewer {i % 997}" for i in ids],
+            "batch_size": batch_size,
+            "boil_size": batch_size * rng.uniform(1.1, 1.4, n),
+            # A few unrealistic efficiencies, like the real data has
+            "efficiency": np.where(
+                rng.random(n) < 0.05, rng.uniform(0, 2, n), rng.uniform(0.6, 0.85, n)
+            ),
+            "boil_time": rng.choice([60.0, 75.0, 90.0], n),
+            "src_ibu": rng.uniform(10, 100, n),
+            "src_og": rng.uniform(1.035, 1.09, n),
+            "src_fg": rng.uniform(1.005, 1.02, n),
+            "src_abv": rng.uniform(3, 10, n),
+            "src_color": rng.uniform(2, 40, n),
+            "style_name": [style_names[s][0] for s in styles],
+            "style_guide": "bjcp",
+            "style_category": [style_names[s][1] for s in styles],
+            "style_version": 2015.0,
+        },
+        index=pd.Index(ids, name="id"),
+    )
+    return core
+
+
+def _make_category(category, ids, rng, model):
+    """Return one row per ingredient of a category for recipes with ids."""
+    n = len(ids)
+    raws, p = model.names[category]
+    names = rng.choice(raws, size=n, p=p)
+    standard = pd.Series(names).map(model.standard[category])
+    if model.typo_rate:
+        typos = np.flatnonzero(rng.random(n) < model.typo_rate)
+        names[typos] = [typo(name, rng) for name in names[typos]]
+    if category == "ferm":
+        amount = rng.lognormal(0, 1, n)
+        data = {
+            "ferm_name": names,
+            "ferm_origin": rng.choice(INGREDIENT_ORIGINS, n),
+            "ferm_amount": amount,
+            "ferm_display_amount": [f"{a:.2f} kg" for a in amount],
+            # A few zero yields, which cleaning.clean_ferm_yield replaces
+            "ferm_yield": np.where(rng.random(n) < 0.02, 0, rng.uniform(0.5, 0.82, n)),
+            "ferm_color": rng.uniform(1.5, 500, n),
+            "ferm_potential": rng.uniform(1.03, 1.04, n),
+            "ferm_type": standard.map(FERM_TYPES).fillna("grain").values,
+        }
+    elif category == "hop":
+        amount = rng.uniform(0.005, 0.1, n)
+        data = {
+            "hop_name": names,
+            "hop_origin": rng.choice(INGREDIENT_ORIGINS, n),
+            "hop_amount": amount,
+            "hop_display_amount": [f"{a * 1000:.0f} g" for a in amount],
+            "hop_alpha": rng.uniform(0.03, 0.16, n),
+            "hop_form": rng.choice(["pellet", "leaf", "plug"], n, p=[0.8, 0.15, 0.05]),
+            "hop_use": rng.choice(
+                ["boil", "dry hop", "first wort", "whirlpool", "aroma"],
+                n,
+                p=[0.6, 0.2, 0.05, 0.1, 0.05],
+            ),
+            "hop_time": rng.choice([0.0, 5.0, 15.0, 30.0, 60.0, 90.0], n),
+        }
+    elif category == "yeast":
+        data = {
+            "yeast_name": names,
+            "yeast_laboratory": rng.choice(["fermentis", "white labs", "wyeast"], n),
+            "yeast_type": rng.choice(["ale", "lager", "wheat"], n),
+            "yeast_form": rng.choice(["dry", "liquid"], n),
+            "yeast_amount": rng.uniform(0.01, 0.1, n),
+            "yeast_product_id": [str(p) for p in rng.integers(1000, 1100, n)],
+            "yeast_attenuation": rng.uniform(65, 85, n),
+            "yeast_flocculation": rng.choice(["low", "medium", "high"], n),
+        }
+        # Dry yeast is weighed, liquid yeast measured in ml
+        data["yeast_amount_is_weight"] = data["yeast_form"] == "dry"
+        data["yeast_display_amount"] = [
+            f"{a * 1000:.0f} {'g' if weighed else 'ml'}"
+            for a, weighed in zip(data["yeast_amount"], data["yeast_amount_is_weight"])
+        ]
+    else:
+        data = {
+            "misc_name": names,
+            "misc_amount": rng.uniform(0.001, 0.05, n),
+            "misc_use": rng.choice(["boil", "mash", "secondary"], n),
+            "misc_time": rng.choice([5.0, 10.0, 15.0, 60.0], n),
+            "misc_amount_is_weight": rng.random(n) < 0.5,
+        }
+        data["misc_display_amount"] = [
+            f"{a * 1000:.1f} g" if weighed else f"{a / UNITS['tsp'][1]:.2f} tsp"
+            for a, weighed in zip(data["misc_amount"], data["misc_amount_is_weight"])
+        ]
+    df = pd.DataFrame(data, index=pd.Index(ids, name="id"))
+    df = normalize_amounts(df, category)
+    for col in CATEGORY_TABLES[category]:
+        df[col] = cast(df[col], COLUMNS[col].dtype)
+    return df
+
+
+def make_recipes(n_recipes, rng=None, start=0, n_variants=N_VARIANTS, model=None):
+    """Return a core DataFrame and {category: DataFrame} with one row per
+    ingredient, for n_recipes recipes with ids from start, drawn from model
+    (CorpusModel.default(n_variants) if not given). Columns and dtypes follow
+    the schema."""
+    if rng is None:
+        rng = np.random.default_rng(0)
+    if model is None:
+        model = CorpusModel.default(n_variants)
+    ids = np.arange(start, start + n_recipes)
+    core = _make_core(ids, rng, model)
+    for col in CORE:
+        core[col] = cast(core[col], CORE[col].dtype)
+    ings = {}
+    for category in INGREDIENT_CATEGORIES:
+        p = model.counts[category]
+        counts = rng.choice(len(p), size=n_recipes, p=p)
+        ings[category] = _make_category(category, np.repeat(ids, counts), rng, model)
+    return core, ings
+
+
+# (list tag, item tag, category, {xml tag: column}, {column: scale})
+XML_LAYOUTS = [
+    (
+        "FERMENTABLES",
+        "FERMENTABLE",
+        "ferm",
+        {
+            "NAME": "ferm_name",
+            "ORIGIN": "ferm_origin",
+            "TYPE": "ferm_type",
+            "AMOUNT": "ferm_amount",
+            "DISPLAY_AMOUNT": "ferm_display_amount",
+            "YIELD": "ferm_yield",
+            "COLOR": "ferm_color",
+            "POTENTIAL": "ferm_potential",
+        },
+        {"ferm_yield": 100},
+    ),
+    (
+        "HOPS",
+        "HOP",
+        "hop",
+        {
+            "NAME": "hop_name",
+            "ORIGIN": "hop_origin",
+            "AMOUNT": "hop_amount",
+            "DISPLAY_AMOUNT": "hop_display_amount",
+            "ALPHA": "hop_alpha",
+            "FORM": "hop_form",
+            "USE": "hop_use",
+            "TIME": "hop_time",
+        },
+        {"hop_alpha": 100},
+    ),
+    (
+        "YEASTS",
+        "YEAST",
+        "yeast",
+        {
+            "NAME": "yeast_name",
+            "LABORATORY": "yeast_laboratory",
+            "TYPE": "yeast_type",
+            "FORM": "yeast_form",
+            "AMOUNT": "yeast_amount",
+            "DISPLAY_AMOUNT": "yeast_display_amount",
+            "AMOUNT_IS_WEIGHT": "yeast_amount_is_weight",
+            "PRODUCT_ID": "yeast_product_id",
+            "ATTENUATION": "yeast_attenuation",
+            "FLOCCULATION": "yeast_flocculation",
+        },
+        {},
+    ),
+    (
+        "MISCS",
+        "MISC",
+        "misc",
+        {
+            "NAME": "misc_name",
+            "AMOUNT": "misc_amount",
+            "DISPLAY_AMOUNT": "misc_display_amount",
+            "USE": "misc_use",
+            "TIME": "misc_time",
+            "AMOUNT_IS_WEIGHT": "misc_amount_is_weight",
+        },
+        {},
+    ),
+]
+
+
+def _element(tag, value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    return f"<{tag}>{escape(str(value))}</{tag}>"
+
+
+def to_beerxml(recipe, ings):
+    """Return the BeerXML document (bytes) for a recipe: a core row (Series or
+    dict) and {category: list of ingredient rows (dicts)}. Percentages are
+    written the way BeerXML has them, so converting the document gives back
+    the recipe."""
+    parts = [
+        "<?xml version='1.0' encoding='UTF-8'?><RECIPES><RECIPE>",
+        _element("NAME", recipe["name"]),
+        _element("BREWER", recipe["brewer"]),
+        _element("BATCH_SIZE", recipe["batch_size"]),
+        _element("BOIL_SIZE", recipe["boil_size"]),
+        _element("BOIL_TIME", recipe["boil_time"]),
+        _element("EFFICIENCY", recipe["efficiency"] * 100),
+        _element("IBU", recipe["src_ibu"]),
+        _element("OG", recipe["src_og"]),
+        _element("FG", recipe["src_fg"]),
+        _element("EST_ABV", recipe["src_abv"]),
+        _element("EST_COLOR", recipe["src_color"]),
+        "<STYLE>",
+        _element("NAME", recipe["style_name"]),
+        _element("CATEGORY_NUMBER", recipe["style_category"][:-1]),
+        _element("STYLE_LETTER", recipe["style_category"][-1]),
+        _element("STYLE_GUIDE", recipe["style_guide"]),
+        _element("VERSION", recipe["style_version"]),
+        "</STYLE>",
+    ]
+    for list_tag, item_tag, category, tags, scales in XML_LAYOUTS:
+        parts.append(f"<{list_tag}>")
+        for row in ings[category]:
+            parts.append(f"<{item_tag}>")
+            for tag, col in tags.items():
+                value = row[col]
+                if col in scales and not pd.isna(value):
+                    value = value * scales[col]
+                parts.append(_element(tag, value))
+            parts.append(f"</{item_tag}>")
+        parts.append(f"</{list_tag}>")
+    parts.append("</RECIPE></RECIPES>")
+    return "".join(parts).encode("utf-8")
+
+
+def _xml_names(ings, rng, model):
+    """Return {category: ingredient DataFrame} with the names as they're
+    written in BeerXML: some origins moved into the name (and removed from the
+    ORIGIN tag) and some misc names with a modifier. Converting the documents
+    strips these again."""
+    ings = {cat: df.copy() for cat, df in ings.items()}
+    for category in ["ferm", "hop"]:
+        df = ings[category]
+        name, origin = f"{category}_name", f"{category}_origin"
+        df[name] = df[name].astype(object)
+        df[origin] = df[origin].astype(object)
+        move = (df[origin].notna() & (rng.random(len(df)) < model.origin_rate)).values
+        df.loc[move, name] = (
+            df.loc[move, name] + " (" + df.loc[move, origin].str.upper() + ")"
+        )
+        df.loc[move, origin] = None
+    df = ings["misc"]
+    df["misc_name"] = df["misc_name"].astype(object)
+    modify = df["misc_name"].notna() & (rng.random(len(df)) < model.modifier_rate)
+    modify = modify.values
+    modifiers = rng.choice(MODIFIERS, modify.sum()).astype(object)
+    df.loc[modify, "misc_name"] = df.loc[modify, "misc_name"] + " (" + modifiers + ")"
+    return ings
+
+
+def iter_beerxml(core, ings, rng=None, model=None):
+    """Yield (recipe id, BeerXML bytes) for every recipe in make_recipes'
+    output. rng and model decide which names get an origin or modifier (see
+    CorpusModel)."""
+    if rng is None:
+        rng = np.random.default_rng(0)
+    if model is None:
+        model = CorpusModel.default()
+    ings = _xml_names(ings, rng, model)
+    rows = {cat: df.to_dict("records") for cat, df in ings.items()}
+    positions = {cat: df.groupby(level=0).indices for cat, df in ings.items()}
+    for recipe_id, recipe in zip(core.index, core.to_dict("records")):
+        recipe_ings = {
+            cat: [rows[cat][i] for i in positions[cat].get(recipe_id, [])]
+            for cat in ings
+        }
+        yield recipe_id, to_beerxml(recipe, recipe_ings)
+
+
+def make_shard(shard, n_recipes, seed, model, fmt):
+    """Generate shard number `shard` of a corpus of n_recipes recipes (see
+    write_corpus). Each shard has its own random generator, so the corpus only
+    depends on the seed, not on how the shards are spread over processes.
+    Return (core, {category: DataFrame}) for the store formats, and a list of
+    (origin, file name, BeerXML bytes) for the others."""
+    rng = np.random.default_rng([seed, shard])
+    start = shard * SHARD_SIZE
+    core, ings = make_recipes(
+        min(SHARD_SIZE, n_recipes - start), rng, start, model=model
+    )
+    if fmt in STORE_FORMATS:
+        return core, {cat: df[CATEGORY_TABLES[cat]] for cat, df in ings.items()}
+    return [
+        (origin, fname, xml)
+        for origin, fname, (_, xml) in zip(
+            core["origin"], core["recipe_file"], iter_beerxml(core, ings, rng, model)
+        )
+    ]
+
+
+def write_corpus(n_recipes, path, fmt="hdf", seed=0, model=None, jobs=N_CPUS):
+    """Generate n_recipes recipes in parallel and write them to path as:
+
+    - "hdf" or "parquet": a recipe store like xml2h5 writes, with its name
+      index
+    - "xml": one BeerXML file per recipe in path/<origin>/
+    - "archive": path/<origin>.xmllog archives (see beerai.data.archive)
+    """
+    if model is None:
+        model = CorpusModel.default()
+    n_shards = -(-n_recipes // SHARD_SIZE)
+    shards = Parallel(n_jobs=jobs, return_as="generator")(
+        delayed(make_shard)(shard, n_recipes, seed, model, fmt)
+        for shard in range(n_shards)
+    )
+    if fmt in STORE_FORMATS:
+        with open_store(path, "w") as store:
+            for core, ings in shards:
+                append_frames(store, core, ings)
+        write_index(path)
+        return
+
+    os.makedirs(path, exist_ok=True)
+    with ExitStack() as stack:
+        writers = {}
+        for docs in shards:
+            for origin, fname, xml in docs:
+                if origin not in writers:
+                    if fmt == "archive":
+                        writer = ArchiveWriter(os.path.join(path, origin + EXTENSION))
+                    else:
+                        writer = DirectoryWriter(os.path.join(path, origin))
+                    writers[origin] = stack.enter_context(writer)
+                writers[origin].write(fname, xml)
+
+
+def default_path(fmt):
+    extension = {"hdf": ".h5", "parquet": PARQUET_EXTENSION}.get(fmt, "")
+    return os.path.join(DATA_DIR, "synthetic/recipes" + extension)
+
+
+def fit_model():
+    """Fit a CorpusModel to the maps, vocabulary, name index and recipe store
+    in the data directory, whichever of them exist."""
+    maps = {}
+    for category in INGREDIENT_CATEGORIES:
+        try:
+            with open(MAP_NAME.format(category), "rb") as f:
+                maps[category] = pickle.load(f)
+        except FileNotFoundError:
+            pass
+    index = None
+    if os.path.exists(index_path(RECIPE_FILE)):
+        index = NameIndex.load(index_path(RECIPE_FILE))
+    store_path = RECIPE_FILE if os.path.exists(RECIPE_FILE) else None
+    return CorpusModel.fit(maps, load_vocab(), index, store_path)
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to generate a synthetic recipe corpus, as BeerXML "
+        "files or archives, or as a recipe store, for load testing."
+    )
+    parser.add_argument(
+        "-n",
+        "--number",
+        type=int,
+        default=10000,
+        help="Number of recipes to generate. Default is 10000.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["hdf", "parquet", "xml", "archive"],
+        default="hdf",
+        help="hdf/parquet write a recipe store like xml2h5 does, xml one "
+        "BeerXML file per recipe in a directory per origin, archive one "
+        "archive per origin. Default is hdf.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Store file or directory to write to. Default is "
+        "`data/synthetic/recipes` (plus `.h5` or `.parquet` for stores).",
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, default=0, help="Random seed. Default is 0."
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=N_CPUS, help="Number of processors to use."
+    )
+    parser.add_argument(
+        "--fit",
+        action="store_true",
+        help="Draw names, ingredient counts, styles and typo/origin rates from "
+        "distributions fitted to the maps, vocabulary, name index and "
+        "all_recipes store in the data directory, instead of the built-in ones.",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+
+    model = fit_model() if args.fit else None
+    path = args.output or default_path(args.format)
+    print(f"Writing {args.number} recipes to {path}.")
+    write_corpus(args.number, path, args.format, args.seed, model, args.jobs)
@@ -0,0 +1,282 @@
+"""
+Normalise the amounts of the ingredients from their display amounts (e.g.
+"5.5 lbs", "2 tsp" or "1 pkg"), vectorized over a table of ingredients.
+
+BeerXML gives each ingredient an AMOUNT in kg (fermentables and hops) or in kg
+or L (yeasts and miscs, depending on AMOUNT_IS_WEIGHT), and most programs
+also write the DISPLAY_AMOUNT the brewer entered. The two don't always agree
+(e.g. amounts converted twice), and the display amount is the one the brewer
+saw, so `normalize_amounts` parses the display amounts with pandas string
+extraction and, for each ingredient:
+
+- keeps the XML amount if the display amount is the XML amount rounded, or
+  within REL_TOL of it (its unit confidence is "high"),
+- uses the display amount otherwise (confidence "medium"),
+- keeps the XML amount, in the unit BeerXML gives it in, if the display
+  amount is missing or can't be parsed, or is in a unit the category can't
+  be measured in (confidence "low").
+
+The display amount is only used if all of it parses, e.g. "1 1/2 lbs",
+"1,5 kg" or "2 whirlfloc tablets", but not "about 2 tsp". The unit of the
+amount ("kg" or "L", see UNITS) is written to `<category>_amount_unit` and
+the confidence to `<category>_unit_confidence`. Fermentables and hops are
+only measured by mass; miscs and yeasts by mass or volume (e.g. tsp, ml).
+They can also be given as a count (e.g. "1 pkg"), which can't be converted to
+kg or L: the count is written to `<category>_count` and the XML amount kept.
+
+xml2h5 normalises each batch of recipes as it converts them. Since the
+display amounts are stored, the amounts of an existing store can be
+normalised again after a unit rule changes, without parsing the XMLs again:
+
+    python -m beerai.data.units -f all_recipes.h5 -o all_recipes_units.h5
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+from ..config import DATA_DIR, INGREDIENT_CATEGORIES
+from .instrument import add_arguments, enable_from_args
+from .schema import COLUMNS, cast
+from .store import CORE_TABLE, copy_store
+
+RECIPE_FILE = os.path.join(DATA_DIR, "interim/all_recipes.h5")
+UNITS_FILE = os.path.join(DATA_DIR, "interim/all_recipes_units.h5")
+CHUNK_SIZE = 10000
+
+MASS = "kg"
+VOLUME = "L"
+COUNT = "count"
+# {unit: (kind, size in kg, L or count)}. Plurals are added below.
+UNITS = {
+    "kg": (MASS, 1),
+    "kilogram": (MASS, 1),
+    "g": (MASS, 0.001),
+    "gr": (MASS, 0.001),
+    "gram": (MASS, 0.001),
+    "mg": (MASS, 1e-6),
+    "milligram": (MASS, 1e-6),
+    "oz": (MASS, 0.0283495),
+    "ounce": (MASS, 0.0283495),
+    "lb": (MASS, 0.453592),
+    "pound": (MASS, 0.453592),
+    "l": (VOLUME, 1),
+    "liter": (VOLUME, 1),
+    "litre": (VOLUME, 1),
+    "ml": (VOLUME, 0.001),
+    "milliliter": (VOLUME, 0.001),
+    "millilitre": (VOLUME, 0.001),
+    "tsp": (VOLUME, 0.00492892),
+    "teaspoon": (VOLUME, 0.00492892),
+    "tbsp": (VOLUME, 0.0147868),
+    "tablespoon": (VOLUME, 0.0147868),
+    "cup": (VOLUME, 0.236588),
+    "fl oz": (VOLUME, 0.0295735),
+    "floz": (VOLUME, 0.0295735),
+    "pt": (VOLUME, 0.473176),
+    "pint": (VOLUME, 0.473176),
+    "qt": (VOLUME, 0.946353),
+    "quart": (VOLUME, 0.946353),
+    "gal": (VOLUME, 3.78541),
+    "gallon": (VOLUME, 3.78541),
+    "pkg": (COUNT, 1),
+    "package": (COUNT, 1),
+    "pack": (COUNT, 1),
+    "packet": (COUNT, 1),
+    "vial": (COUNT, 1),
+    "tablet": (COUNT, 1),
+    "tab": (COUNT, 1),
+    "capsule": (COUNT, 1),
+    "item": (COUNT, 1),
+    "unit": (COUNT, 1),
+    "each": (COUNT, 1),
+    "ea": (COUNT, 1),
+}
+UNITS.update({unit + "s": value for unit, value in list(UNITS.items())})
+# The units the amount of each category can be in. Counts (e.g. "1 pkg" of
+# yeast) can't be compared with kg or L, so they're kept in <category>_count
+# (for COUNTED categories) and the amount stays in BeerXML's kg or L.
+CATEGORY_KINDS = {
+    "ferm": [MASS],
+    "hop": [MASS],
+    "yeast": [MASS, VOLUME],
+    "misc": [MASS, VOLUME],
+}
+COUNTED = ["yeast", "misc"]
+# A whole display amount: a number (with a decimal point or comma, thousands
+# separators, or a fraction like 1/2 or 1 1/2), words with the unit as the
+# first or last of them ("2 tsp ground", "2 whirlfloc tablets"), and the
+# ounces of amounts like "1 lbs 4.0 oz" (as BeerSmith writes them)
+NUMBER = r"[1-9]\d{0,2}(?:,\d{3})+(?:\.\d+)?|\d+(?:[.,]\d*)?|[.,]\d+"
+AMOUNT_RE = (
+    r"^\s*(?:(?P<whole>\d+)\s+(?=\d+\s*/))?"
+    rf"(?P<number>{NUMBER})(?:\s*/\s*(?P<denominator>\d+))?"
+    r"\s*(?P<unit>[a-z][a-z.]*(?:\s+[a-z][a-z.]*)*)"
+    r"(?:\s+(?P<ounces>\d+(?:[.,]\d*)?)\s*oz\.?)?\s*$"
+)
+THOUSANDS_RE = r"[1-9]\d{0,2}(?:,\d{3})+(?:\.\d+)?"
+# Display amounts are rounded (to their last digit), and amounts within
+# REL_TOL of each other are the same too
+REL_TOL = 0.01
+# Slack for the amounts stored as float32
+EPS = 1e-7
+CONFIDENCE = ["high", "medium", "low"]
+
+
+def _to_float(numbers):
+    """Return numbers (strings, see NUMBER) as floats, and the number of
+    digits after their decimal point."""
+    numbers = numbers.where(
+        numbers.str.fullmatch(THOUSANDS_RE).fillna(False),
+        numbers.str.replace(",", ".", regex=False),
+    ).str.replace(",", "", regex=False)
+    decimals = numbers.str.extract(r"\.(\d*)", expand=False).str.len()
+    return numbers.astype(float), decimals.fillna(0).astype(float)
+
+
+def _unit_of(words):
+    """Return the unit among the words after the number: all of them ("fl
+    oz"), the first ("tsp ground") or the last ("whirlfloc tablets")."""
+    words = words.str.replace(".", "", regex=False).str.strip()
+    split = words.str.split(r"\s+", regex=True)
+    first, last = split.str[0], split.str[-1]
+    unit = words.where(words.isin(UNITS), last.where(last.isin(UNITS), first))
+    return unit.where(unit.isin(UNITS))
+
+
+def parse_display_amounts(display):
+    """Return the amount, kind of unit (MASS, VOLUME or COUNT), unit and
+    precision (half of the last digit, in the same unit as the amount) of each
+    display amount, as a DataFrame. They're NaN unless the whole display
+    amount is a number and a known unit (see AMOUNT_RE)."""
+    text = display.astype(object).where(display.notna()).astype("str").str.lower()
+    parts = text.str.extract(AMOUNT_RE).astype("string")
+    number, decimals = _to_float(parts["number"])
+    denominator = parts["denominator"].astype(float)
+    whole = parts["whole"].astype(float)
+    number = number.where(denominator.isna(), number / denominator)
+    number = number.where(whole.isna(), whole + number)
+    unit = _unit_of(parts["unit"])
+    known = unit.notna()
+    kinds = unit.map({u: kind for u, (kind, _) in UNITS.items()})
+    sizes = unit.map({u: size for u, (_, size) in UNITS.items()})
+    amount = number * sizes
+    ounces, ounce_decimals = _to_float(parts["ounces"])
+    with_ounces = ounces.notna()
+    # Only pounds have ounces after them
+    known &= ~with_ounces | (unit.isin(["lb", "lbs", "pound", "pounds"]))
+    amount = amount.where(~with_ounces, amount + ounces * UNITS["oz"][1])
+    # The last digit is the ounces' for amounts with ounces
+    decimals = decimals.where(~with_ounces, ounce_decimals)
+    precision = 0.5 * 10.0**-decimals
+    precision = precision.where(denominator.isna(), precision / denominator)
+    precision *= sizes.where(~with_ounces, UNITS["oz"][1])
+    return pd.DataFrame(
+        {
+            "amount": amount.where(known),
+            "kind": kinds.where(known),
+            "unit": unit.where(known),
+            "precision": precision.where(known),
+        },
+        index=display.index,
+    )
+
+
+def xml_kinds(df, category):
+    """Return the kind of unit of the BeerXML amount of each ingredient."""
+    if category in ("ferm", "hop"):
+        return pd.Series(MASS, index=df.index)
+    flag = f"{category}_amount_is_weight"
+    if flag not in df.columns:
+        # BeerXML's default
+        return pd.Series(VOLUME, index=df.index)
+    is_weight = df[flag].fillna(False).astype(bool)
+    return pd.Series(np.where(is_weight, MASS, VOLUME), index=df.index)
+
+
+def normalize_amounts(df, category):
+    """Return a copy of the ingredients of a category (or the wide table,
+    see beerai.data.store.widen) with `<category>_amount` normalised from
+    `<category>_display_amount`, and `<category>_amount_unit`,
+    `<category>_unit_confidence` and (for COUNTED categories)
+    `<category>_count` set (see the module docstring)."""
+    df = df.copy()
+    amount_col = f"{category}_amount"
+    display_col = f"{category}_display_amount"
+    xml_amount = df[amount_col].astype(np.float64)
+    xml_kind = xml_kinds(df, category)
+    if display_col in df.columns:
+        parsed = parse_display_amounts(df[display_col])
+    else:
+        parsed = parse_display_amounts(pd.Series(np.nan, index=df.index))
+    usable = parsed["amount"].notna() & parsed["kind"].isin(CATEGORY_KINDS[category])
+    agrees = (
+        usable
+        & (parsed["kind"] == xml_kind)
+        & (
+            (parsed["amount"] - xml_amount).abs()
+            <= np.maximum(REL_TOL * parsed["amount"].abs(), parsed["precision"]) + EPS
+        )
+    )
+    corrected = usable & ~agrees
+    kept = ~usable & xml_amount.notna()
+
+    unit = xml_kind.where(agrees | kept, parsed["kind"])
+    confidence = np.select([agrees, corrected, kept], CONFIDENCE, default=None)
+    values = {
+        amount_col: xml_amount.where(~corrected, parsed["amount"]),
+        f"{category}_amount_unit": unit.where(agrees | corrected | kept),
+        f"{category}_unit_confidence": pd.Series(confidence, index=df.index),
+    }
+    if category in COUNTED:
+        values[f"{category}_count"] = parsed["amount"].where(parsed["kind"] == COUNT)
+    for col, value in values.items():
+        df[col] = cast(value, COLUMNS[col].dtype)
+    return df
+
+
+def normalize_table(table, df):
+    """Normalise the amounts of a table of a recipe store (see copy_store):
+    a category table, or every category of the wide ingredients table."""
+    if table in INGREDIENT_CATEGORIES:
+        return normalize_amounts(df, table)
+    for category in INGREDIENT_CATEGORIES:
+        if f"{category}_amount" in df.columns:
+            df = normalize_amounts(df, category)
+    return df
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to write a copy of all_recipes with the ingredient "
+        "amounts normalised from their display amounts."
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=RECIPE_FILE,
+        help=f"The all_recipes store. Default is {RECIPE_FILE}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=UNITS_FILE,
+        help=f"Where to write the normalised store. Default is {UNITS_FILE}.",
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    copy_store(
+        args.file,
+        args.output,
+        lambda table, df: df if table == CORE_TABLE else normalize_table(table, df),
+        CHUNK_SIZE,
+    )
+    print(f"Wrote the normalised recipes to {args.output}.")
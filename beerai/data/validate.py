@@ -0,0 +1,230 @@
+"""
+Check the columns of the recipes against declarative rules, and record which
+rules each recipe breaks as a bitmask.
+
+A Rule is about one column of the core or ingredient tables: the range its
+values must be in, whether it can be missing and the values it can take.
+Rules on ingredient columns only look at the rows that have an ingredient of
+that category (the wide ingredients table pads the shorter categories with
+missing values), and a recipe breaks one if any of its ingredients does.
+
+`validate` checks every rule in one vectorized pass per chunk of all_recipes,
+giving each recipe an integer whose bit i is set if it breaks RULES[i]. The
+flags are written to FLAG_FILE, indexed by recipe id, along with the names of
+the rules, so the bits keep their meaning if RULES changes. Later stages can
+then skip bad recipes with a bitwise test:
+
+    flags = Flags()
+    good = flags.valid(["efficiency", "ferm_yield"], id_range=(0, 10000))
+    core = core[good.reindex(core.index, fill_value=False)]
+
+or
+
+    python -m beerai.data.validate
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+from collections import namedtuple
+
+from ..config import DATA_DIR, INGREDIENT_CATEGORIES
+from .instrument import add_arguments, enable_from_args, iterate, stage
+from .recipe2vec import CHUNK_SIZE, RECIPE_FILE
+from .schema import CORE
+from .store import CORE_TABLE, ING_TABLE, open_store
+
+FLAG_FILE = os.path.join(DATA_DIR, "interim/recipe_flags.h5")
+FLAG_DTYPE = np.uint32
+
+# A rule on a column: its values must be between low and high (inclusive is
+# "both", "neither", "left" or "right", like Series.between), it must not be
+# missing unless nullable, and it must be one of allowed if that's given.
+Rule = namedtuple(
+    "Rule",
+    ["name", "column", "low", "high", "inclusive", "nullable", "allowed"],
+    defaults=(None, None, "both", True, None),
+)
+
+# Hop uses from brewtoad (see xml2h5.fill_hop) and forms from BeerXML
+HOP_USES = ["boil", "dry hop", "first wort", "whirlpool", "mash", "aroma"]
+HOP_FORMS = ["pellet", "leaf", "plug"]
+# 1440 = minutes per day
+MAX_TIME = 1440
+
+RULES = [
+    # The range cleaning.clean_efficiency accepts
+    Rule("efficiency", "efficiency", 0.5, 1, nullable=False),
+    Rule("batch_size", "batch_size", 0, np.inf, "neither", nullable=False),
+    Rule("boil_size", "boil_size", 0, np.inf, "neither", nullable=False),
+    Rule("boil_time", "boil_time", 0, MAX_TIME, "neither", nullable=False),
+    Rule("ferm_amount", "ferm_amount", 0, np.inf, "neither", nullable=False),
+    # The range cleaning.clean_ferm_yield accepts
+    Rule("ferm_yield", "ferm_yield", 0.03, 1, nullable=False),
+    Rule("ferm_color", "ferm_color", 0, 1000),
+    Rule("hop_amount", "hop_amount", 0, np.inf, "neither", nullable=False),
+    Rule("hop_alpha", "hop_alpha", 0, 1, "right", nullable=False),
+    Rule("hop_time", "hop_time", 0, MAX_TIME),
+    Rule("hop_use", "hop_use", allowed=HOP_USES),
+    Rule("hop_form", "hop_form", allowed=HOP_FORMS),
+    Rule("yeast_attenuation", "yeast_attenuation", 0, 100),
+    Rule("misc_amount", "misc_amount", 0, np.inf),
+]
+
+_COMPARISONS = {
+    "both": (np.greater_equal, np.less_equal),
+    "neither": (np.greater, np.less),
+    "left": (np.greater_equal, np.less),
+    "right": (np.greater, np.less_equal),
+}
+
+
+def broken(rule, values):
+    """Return a bool array of which values break a rule."""
+    missing = values.isna().to_numpy()
+    bad = missing.copy() if not rule.nullable else np.zeros(len(values), bool)
+    if rule.low is not None or rule.high is not None:
+        above, below = _COMPARISONS[rule.inclusive]
+        x = values.to_numpy(np.float64, na_value=np.nan)
+        low = -np.inf if rule.low is None else rule.low
+        high = np.inf if rule.high is None else rule.high
+        with np.errstate(invalid="ignore"):
+            bad |= ~missing & ~(above(x, low) & below(x, high))
+    if rule.allowed is not None:
+        bad |= ~missing & ~values.isin(rule.allowed).to_numpy()
+    return bad
+
+
+def check(core, ings, rules=RULES):
+    """Return the flags of the recipes in core (a Series indexed like it),
+    whose ingredients are in ings (the wide layout)."""
+    if len(rules) > np.iinfo(FLAG_DTYPE).bits:
+        raise ValueError(f"Only {np.iinfo(FLAG_DTYPE).bits} rules fit in the flags")
+    flags = np.zeros(len(core), dtype=FLAG_DTYPE)
+    present = {
+        category: ings[f"{category}_name"].notna().to_numpy()
+        for category in INGREDIENT_CATEGORIES
+        if f"{category}_name" in ings.columns
+    }
+    for bit, rule in enumerate(rules):
+        if rule.column in CORE:
+            bad = broken(rule, core[rule.column])
+        else:
+            rows = present[rule.column.split("_")[0]]
+            bad_rows = rows & broken(rule, ings[rule.column])
+            bad = core.index.isin(ings.index[bad_rows])
+        flags[bad] |= FLAG_DTYPE(1 << bit)
+    return pd.Series(flags, index=core.index, name="flags")
+
+
+def _columns(rules):
+    """Return the core and ingredient columns to read to check rules."""
+    core = [rule.column for rule in rules if rule.column in CORE]
+    ings = [rule.column for rule in rules if rule.column not in CORE]
+    names = {f"{column.split('_')[0]}_name" for column in ings}
+    return list(dict.fromkeys(core)), list(dict.fromkeys(ings)) + sorted(names)
+
+
+def validate(path=RECIPE_FILE, out_path=FLAG_FILE, rules=RULES):
+    """Check the rules against every recipe of the store at path, a chunk at
+    a time, and write the flags to out_path. Return the number of recipes
+    breaking each rule."""
+    core_cols, ing_cols = _columns(rules)
+    counts = np.zeros(len(rules), dtype=np.int64)
+    bits = FLAG_DTYPE(1) << np.arange(len(rules), dtype=FLAG_DTYPE)
+    with open_store(path) as store, pd.HDFStore(
+        out_path, "w", complevel=9, complib="blosc"
+    ) as out:
+        chunks = store.select(CORE_TABLE, columns=core_cols, chunksize=CHUNK_SIZE)
+        for chunk, core in enumerate(iterate("select core", chunks)):
+            with stage("select", chunk=chunk) as s:
+                id_range = (core.index[0], core.index[-1] + 1)
+                ings = store.select(ING_TABLE, columns=ing_cols, id_range=id_range)
+                s.rows = len(ings)
+            with stage("check", chunk=chunk) as s:
+                flags = check(core, ings, rules)
+                counts += ((flags.to_numpy()[:, None] & bits) > 0).sum(axis=0)
+                s.rows = len(core)
+            with stage("write", chunk=chunk) as s:
+                out.append("flags", flags, format="table")
+                s.rows = len(flags)
+        out.put("rules", pd.Series([rule.name for rule in rules], name="rule"))
+    return pd.Series(counts, index=[rule.name for rule in rules], name="recipes")
+
+
+class Flags:
+    """The flags written by validate."""
+
+    def __init__(self, path=FLAG_FILE):
+        self.path = path
+        with pd.HDFStore(path, "r") as store:
+            self.rules = store.get("rules").tolist()
+
+    def mask(self, rules=None):
+        """Return the bits of the named rules (all of them by default)."""
+        if rules is None:
+            rules = self.rules
+        mask = 0
+        for name in rules:
+            if name not in self.rules:
+                raise KeyError(f"No rule {name!r} in {self.path}")
+            mask |= 1 << self.rules.index(name)
+        return FLAG_DTYPE(mask)
+
+    def flags(self, id_range=None):
+        """Return the flags of the recipes with lo <= id < hi (all of them by
+        default)."""
+        where = None
+        if id_range is not None:
+            where = f"index >= {id_range[0]} & index < {id_range[1]}"
+        with pd.HDFStore(self.path, "r") as store:
+            return store.select("flags", where=where)
+
+    def valid(self, rules=None, id_range=None):
+        """Return whether each recipe passes the named rules (all of them by
+        default), as a bool Series indexed by recipe id."""
+        flags = self.flags(id_range)
+        return (flags & self.mask(rules)) == 0
+
+    def broken(self, id_range=None):
+        """Return the names of the rules each recipe breaks, for the recipes
+        that break any."""
+        flags = self.flags(id_range)
+        flags = flags[flags != 0]
+        bits = FLAG_DTYPE(1) << np.arange(len(self.rules), dtype=FLAG_DTYPE)
+        hits = (flags.to_numpy()[:, None] & bits) > 0
+        names = np.array(self.rules, dtype=object)
+        return pd.Series([list(names[row]) for row in hits], index=flags.index)
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to check the recipes against the validation rules "
+        "and write which rules each recipe breaks."
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=RECIPE_FILE,
+        help=f"The all_recipes store. Default is {RECIPE_FILE}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=FLAG_FILE,
+        help=f"Where to write the flags. Default is {FLAG_FILE}.",
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    counts = validate(args.file, args.output)
+    print("Recipes breaking each rule:")
+    print(counts.to_string())
@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import os
 import pickle
 
@@ -7,6 +8,24 @@ from ..config import DATA_DIR, INGREDIENT_CATEGORIES
 MAP_NAME = os.path.join(DATA_DIR, "interim/{}map.pickle")
 
 
+def load_maps():
+    """Load the ingredient map for every category, keyed on category."""
+    maps = {}
+    for category in INGREDIENT_CATEGORIES:
+        with open(MAP_NAME.format(category), "rb") as f:
+            maps[category] = pickle.load(f)
+    return maps
+
+
+def vocab_version(vocab):
+    """Return a short hash of a vocabulary (ingredient -> int), which changes
+    whenever an ingredient or its index does."""
+    h = hashlib.sha256()
+    for name, i in sorted(vocab.items(), key=lambda item: item[1]):
+        h.update(f"{i}\t{name}\n".encode())
+    return h.hexdigest()[:16]
+
+
 def create_vocab(out_file=None):
     """Given a category, load in the corresponding columns from the HDF and
     create unique id's for each ingredient. Valid categories:
@@ -7,13 +7,30 @@ import pandas as pd
 import random
 import re
 import sys
+import tempfile
 
-from itertools import zip_longest
+from functools import partial
+from itertools import count, islice
 from joblib import delayed, Parallel
 from pybeerxml import Parser
 from xml.etree.ElementTree import ParseError
 
-from ..config import DATA_DIR
+from ..config import DATA_DIR, INGREDIENT_CATEGORIES
+from .archive import archive_origin, read_archive
+from .instrument import add_arguments, enable_from_args, stage
+from .name_index import NameIndex, index_path
+from .schema import (
+    CATEGORY_TABLES,
+    COLUMNS,
+    CORE,
+    FILL_VALUES,
+    INGREDIENTS,
+    STR_COLUMNS,
+    cast,
+)
+from .store import CORE_TABLE, PARQUET_EXTENSION, open_store, truncate_strings
+from .units import normalize_amounts
+from .vocabulary import load_maps
 
 # From https://coderwall.com/p/xww5mq/two-letter-country-code-regex
 ORIGIN_RE = re.compile(
@@ -21,17 +38,25 @@ ORIGIN_RE = re.compile(
 )
 MODIFIER_RE = re.compile("\([\w ]*\)")
 
-UNIT_RE = re.compile("(?P<amount>\d*\.?\d*) *(?P<unit>g|kg|oz|lb)")
-TO_KG = {"kg": 1, "g": 0.001, "oz": 0.0283495, "lb": 0.453592}
-EPS = 1e-7
-
 # Number of processors to use. -1 = all
 N_CPUS = -1
-
+# Number of recipes converted at a time when converting archives
+BATCH_SIZE = 10000
+
+# Columns written by the fill_* functions (other than "id"), see schema. Batches
+# appended to the recipe tables are conformed to these so each batch has the
+# same columns and dtypes. The ingredients of each category are written to
+# their own table (see schema.CATEGORY_TABLES); ING_COLUMNS are the columns of
+# the legacy wide ingredients table.
+CORE_COLUMNS = list(CORE)
+ING_COLUMNS = list(INGREDIENTS)
+
+# How each column is cleaned to make its dtype consistent from chunk to chunk
 CLEAN_STEPS = {
-    "style_category": {"type": str},
-    "misc_amount_is_weight": {"type": bool, "fill": False},
-    "yeast_product_id": {"type": str, "fill": np.nan},
+    name: {"type": col.dtype}
+    if col.nullable
+    else {"type": col.dtype, "fill": FILL_VALUES[col.dtype]}
+    for name, col in COLUMNS.items()
 }
 
 
@@ -78,12 +103,10 @@ def safe_float(arg):
         return np.nan
 
 
-def extract_amount_unit(text):
-    if text is not None:
-        m = re.search(UNIT_RE, text)
-        if m is not None:
-            return float(m.group("amount")), m.group("unit").lower()
-    return None, None
+def safe_bool(arg):
+    """BeerXML booleans are "TRUE" or "FALSE". Return None if missing."""
+    if arg is not None:
+        return clean_text(arg) == "true"
 
 
 def fill_ferm(d, ferm, core_vals):
@@ -97,17 +120,10 @@ def fill_ferm(d, ferm, core_vals):
             d["ferm_origin"] = clean_text(getattr(ferm, "origin", None))
         d["ferm_amount"] = safe_float(getattr(ferm, "amount", None))
         d["ferm_display_amount"] = clean_text(getattr(ferm, "display_amount", None))
-        amount, unit = extract_amount_unit(getattr(ferm, "display_amount", None))
-        if (
-            amount is not None
-            and unit is not None
-            and d["ferm_amount"] is not None
-            and abs(amount * TO_KG.get(unit, 1) - d["ferm_amount"]) > EPS
-        ):
-            d["ferm_amount"] = amount * TO_KG.get(unit, 1)
         d["ferm_yield"] = safe_float(getattr(ferm, "_yield", None)) * 0.01
         d["ferm_color"] = safe_float(getattr(ferm, "color", None))
         d["ferm_potential"] = safe_float(getattr(ferm, "potential", None))
+        d["ferm_type"] = clean_text(getattr(ferm, "type", None))
 
 
 def fill_hop(d, hop, core_vals):
@@ -121,14 +137,6 @@ def fill_hop(d, hop, core_vals):
             d["hop_origin"] = clean_text(getattr(hop, "origin", None))
         d["hop_amount"] = safe_float(getattr(hop, "amount", None))
         d["hop_display_amount"] = clean_text(getattr(hop, "display_amount", None))
-        amount, unit = extract_amount_unit(getattr(hop, "display_amount", None))
-        if (
-            amount is not None
-            and unit is not None
-            and d["hop_amount"] is not None
-            and abs(amount * TO_KG.get(unit, 1) - d["hop_amount"]) > EPS
-        ):
-            d["hop_amount"] = amount * TO_KG.get(unit, 1)
         d["hop_alpha"] = safe_float(getattr(hop, "alpha", None))
         if d["hop_alpha"] is not None:
             d["hop_alpha"] /= 100.0
@@ -150,9 +158,13 @@ def fill_yeast(d, yeast):
         d["yeast_type"] = clean_text(getattr(yeast, "type", None))
         d["yeast_form"] = clean_text(getattr(yeast, "form", None))
         d["yeast_amount"] = safe_float(getattr(yeast, "amount", None))
+        d["yeast_display_amount"] = clean_text(getattr(yeast, "display_amount", None))
         d["yeast_product_id"] = getattr(yeast, "product_id", None)
         d["yeast_attenuation"] = safe_float(getattr(yeast, "attenuation", None))
         d["yeast_flocculation"] = clean_text(getattr(yeast, "flocculation", None))
+        d["yeast_amount_is_weight"] = safe_bool(
+            getattr(yeast, "amount_is_weight", None)
+        )
 
 
 def fill_misc(d, misc):
@@ -161,10 +173,10 @@ def fill_misc(d, misc):
         misc_name = remove_ingredient_modifiers(getattr(misc, "name", None))
         d["misc_name"] = clean_text(misc_name)
         d["misc_amount"] = safe_float(getattr(misc, "amount", None))
+        d["misc_display_amount"] = clean_text(getattr(misc, "display_amount", None))
         d["misc_use"] = clean_text(getattr(misc, "use", None))
         d["misc_time"] = safe_float(getattr(misc, "time", None))
-        # Should be a boolean
-        d["misc_amount_is_weight"] = getattr(misc, "amount_is_weight", None) or False
+        d["misc_amount_is_weight"] = safe_bool(getattr(misc, "amount_is_weight", None))
 
 
 def fill_core(d, recipe):
@@ -202,8 +214,8 @@ def fill_core(d, recipe):
 
 
 def recipe_to_dicts(recipe, fname, recipe_id, origin):
-    """Given a pybeerxml.recipe.Recipe, convert to a dataframe and write in a
-    more efficient format.
+    """Given a pybeerxml.recipe.Recipe, convert to a dict of core values and a
+    dict of {category: list of dicts}, one dict per ingredient.
         recipe: pybeerxml Recipe object
         fname: file name that beer xml object came from (for recording)
         recipe_id: unique id to assign to recipe
@@ -211,30 +223,46 @@ def recipe_to_dicts(recipe, fname, recipe_id, origin):
     """
 
     core_vals = {}
-    ingredients = []
+    ingredients = {category: [] for category in INGREDIENT_CATEGORIES}
     core_vals["id"] = recipe_id
     core_vals["recipe_file"] = fname
     core_vals["origin"] = origin
     fill_core(core_vals, recipe)
 
-    for ferm, hop, yeast, misc in zip_longest(
-        recipe.fermentables, recipe.hops, recipe.yeasts, recipe.miscs
-    ):
-        tmp = {"id": recipe_id}
-        fill_ferm(tmp, ferm, core_vals)
-        fill_hop(tmp, hop, core_vals)
-        fill_yeast(tmp, yeast)
-        fill_misc(tmp, misc)
-        ingredients.append(tmp)
+    for category, items, fill in [
+        ("ferm", recipe.fermentables, partial(fill_ferm, core_vals=core_vals)),
+        ("hop", recipe.hops, partial(fill_hop, core_vals=core_vals)),
+        ("yeast", recipe.yeasts, fill_yeast),
+        ("misc", recipe.miscs, fill_misc),
+    ]:
+        for item in items:
+            tmp = {"id": recipe_id}
+            fill(tmp, item)
+            ingredients[category].append(tmp)
 
     return core_vals, ingredients
 
 
-def convert_runner(fname, origin, recipe_id):
-    """Meant to be run on a single recipe file."""
+def parse_xml(parser, xml):
+    """Parse the contents of a BeerXML file. Older versions of pybeerxml can
+    only parse from a path, so for those it goes through a temporary file."""
+    if hasattr(parser, "parse_from_string"):
+        return parser.parse_from_string(xml)
+    with tempfile.NamedTemporaryFile(suffix=".xml") as f:
+        f.write(xml)
+        f.flush()
+        return parser.parse(f.name)
+
+
+def convert_runner(fname, origin, recipe_id, xml=None):
+    """Meant to be run on a single recipe file. If xml is given, it's parsed
+    instead of reading fname (e.g. for recipes read from an archive)."""
     try:
         parser = Parser()
-        recipes = parser.parse(fname)
+        if xml is None:
+            recipes = parser.parse(fname)
+        else:
+            recipes = parse_xml(parser, xml)
     except ParseError as e:
         print(f"Failed to parse {fname}:", file=sys.stderr)
         print(e, file=sys.stderr)
@@ -245,17 +273,16 @@ def convert_runner(fname, origin, recipe_id):
         print(f"No recipe in {fname}", file=sys.stderr)
         return None
     try:
-        core_vals, ingredients = recipe_to_dicts(recipe, fname, recipe_id, origin)
+        return recipe_to_dicts(recipe, fname, recipe_id, origin)
     except Exception as e:
         print(f"Failed {fname}:", file=sys.stderr)
         print(e, file=sys.stderr)
-        core_vals, ingredients = {}, []
-    return (core_vals, ingredients)
+        return None
 
 
 def clean_cols(df):
-    """For any special case columns, clean the column to make sure NaNs and
-    dtypes are consistent from chunk to chunk.
+    """Clean the columns (in place) as given by CLEAN_STEPS, to make sure NaNs
+    and dtypes are consistent from chunk to chunk.
     """
     for col in df.columns:
         if col in CLEAN_STEPS.keys():
@@ -264,11 +291,139 @@ def clean_cols(df):
             if "fill" in step_keys:
                 df[col] = df[col].fillna(value=steps["fill"])
             if "type" in step_keys:
-                df[col] = df[col].astype(steps["type"])
+                df[col] = cast(df[col], steps["type"])
+
+
+def results_to_frames(results):
+    """Turn the results of convert_runner into a core DataFrame and a dict of
+    {category: ingredient DataFrame}, with the amounts normalised (see
+    beerai.data.units) and conformed to the schema. Return
+    (None, None) if nothing was parsed."""
+    core_vals = []
+    ingredients = {category: [] for category in INGREDIENT_CATEGORIES}
+    for result in results:
+        if result is not None:
+            core_vals.append(result[0])
+            for category, rows in result[1].items():
+                ingredients[category].extend(rows)
+
+    if len(core_vals) == 0:
+        return None, None
+    df_core = pd.DataFrame(core_vals)
+    df_core = df_core.set_index("id")
 
+    df_ings = {}
+    for category, rows in ingredients.items():
+        columns = CATEGORY_TABLES[category]
+        df = pd.DataFrame(rows, columns=["id"] + columns).set_index("id")
+        df = normalize_amounts(df, category)
+        df_ings[category] = conform(df, columns)
+    return conform(df_core, CORE_COLUMNS), df_ings
+
+
+def conform(df, columns):
+    """Give a batch of converted recipes exactly the given columns, with the
+    schema's dtypes, so that it can be appended to a table. Strings are
+    truncated to STR_SIZE, with a warning."""
+    df = df.reindex(columns=columns)
+    df = truncate_strings(df, sorted(STR_COLUMNS.intersection(columns)))
+    clean_cols(df)
+    return df
+
+
+def append_frames(store, df_core, df_ings):
+    """Append a batch of converted recipes (see results_to_frames) to the core
+    and ingredient category tables of a store (see beerai.data.store)."""
+    store.append(CORE_TABLE, df_core)
+    for category, df in df_ings.items():
+        if len(df):
+            store.append(category, df, origins=df_core["origin"])
+
+
+def output_file(samples, n, fmt="hdf"):
+    """Return the path to write converted recipes to, in the given format
+    ("hdf" or "parquet")."""
+    extension = PARQUET_EXTENSION if fmt == "parquet" else ".h5"
+    if n == -1:
+        fname = "interim/all_recipes" + extension
+    else:
+        # Calculate a filename as a hash of the recipes that were read in.
+        fname = "interim/" + str(abs(hash(tuple(samples)))) + extension
+    return os.path.join(DATA_DIR, fname)
 
-def convert_a_bunch(filenames, n, jobs=N_CPUS):
-    """Convert n randomly chosen recipes. Currently for inspecting the output."""
+
+def write_index(fname, df_ings=None):
+    """Index which recipes use each ingredient, by raw name and, if the maps
+    exist yet, by standard name. If df_ings isn't given, the ingredients are
+    read back from fname."""
+    try:
+        maps = load_maps()
+    except FileNotFoundError:
+        maps = None
+    if df_ings is None:
+        index = NameIndex.from_store(fname, maps)
+    else:
+        index = NameIndex.from_frames(df_ings.values(), maps)
+    index.save(index_path(fname))
+
+
+def iter_archives(archives, n):
+    """Yield (origin, name, xml) for the first n recipes in the archives (all
+    of them if n is -1)."""
+    recipes = (
+        (archive_origin(path), os.path.join(path, name), xml)
+        for path in archives
+        for name, xml in read_archive(path)
+    )
+    return islice(recipes, None if n == -1 else n)
+
+
+def convert_archives(archives, n, jobs=N_CPUS, batch_size=BATCH_SIZE, fmt="hdf"):
+    """Convert the first n recipes (all if n is -1) in a list of archives,
+    reading each archive sequentially and appending to the store in
+    batches."""
+    fname = output_file(archives, n, fmt)
+    print(f"Writing recipes from {len(archives)} archives to {fname}.")
+    recipes = iter_archives(archives, n)
+    n_recipes = 0
+    with Parallel(n_jobs=jobs) as parallel, open_store(fname, "w") as store:
+        for chunk in count():
+            with stage("read", chunk=chunk) as s:
+                batch = list(islice(recipes, batch_size))
+                s.rows = len(batch)
+            if not batch:
+                break
+            with stage("convert", chunk=chunk) as s:
+                results = parallel(
+                    delayed(convert_runner)(name, origin, i, xml)
+                    for i, (origin, name, xml) in enumerate(batch, n_recipes)
+                )
+                s.rows = len(batch)
+            n_recipes += len(batch)
+            with stage("frames", chunk=chunk) as s:
+                df_core, df_ings = results_to_frames(results)
+                s.rows = len(results)
+            if df_core is None:
+                continue
+            with stage("append", chunk=chunk) as s:
+                append_frames(store, df_core, df_ings)
+                s.rows = len(df_core)
+            print(f"Converted {n_recipes} recipes.")
+        if "core" not in store:
+            print("No recipes parsed. Exiting.")
+            return
+    with stage("index"):
+        write_index(fname)
+
+
+def convert_a_bunch(filenames, n, jobs=N_CPUS, archives=None, fmt="hdf"):
+    """Convert n randomly chosen recipes. Currently for inspecting the output.
+    If archives are given, convert the first n recipes in them instead (see
+    convert_archives). fmt is the output format, "hdf" or "parquet"."""
+
+    if archives:
+        convert_archives(archives, n, jobs, fmt=fmt)
+        return
 
     if filenames is not None:
         samples = [(f.split("/")[-2], f) for f in filenames]
@@ -288,44 +443,33 @@ def convert_a_bunch(filenames, n, jobs=N_CPUS):
         else:
             samples = recipe_files
 
-    results = Parallel(n_jobs=jobs)(
-        delayed(convert_runner)(fname, origin, i)
-        for i, (origin, fname) in enumerate(samples)
-    )
-
-    core_vals = []
-    ingredients = []
-    for result in results:
-        if result is not None:
-            core_vals.append(result[0])
-            ingredients.extend(result[1])
-
-    if len(core_vals) == 0:
+    with stage("convert") as s:
+        results = Parallel(n_jobs=jobs)(
+            delayed(convert_runner)(fname, origin, i)
+            for i, (origin, fname) in enumerate(samples)
+        )
+        s.rows = len(samples)
+
+    with stage("frames") as s:
+        df_core, df_ings = results_to_frames(results)
+        s.rows = len(results)
+    if df_core is None:
         print("No recipes parsed. Exiting.")
         return
-    df_core = pd.DataFrame(core_vals)
-    df_core = df_core.set_index("id")
 
-    df_ing = pd.DataFrame(ingredients)
-    df_ing = df_ing.set_index("id")
-    clean_cols(df_ing)
-
-    write_options = {"complevel": 9, "complib": "blosc", "format": "table"}
-    if n == -1:
-        fname = "interim/all_recipes.h5"
-    else:
-        # Calculate a filename as a hash of the xml files that were read in.
-        fname = "interim/" + str(abs(hash(tuple(samples)))) + ".h5"
-    fname = os.path.join(DATA_DIR, fname)
+    fname = output_file(samples, n, fmt)
     print(f"Writing {len(samples)} examples to {fname}.")
-    df_core.to_hdf(fname, "core", mode="w", data_columns=True, **write_options)
-    df_ing.to_hdf(fname, "ingredients", mode="a", data_columns=True, **write_options)
+    with open_store(fname, "w") as store, stage("append") as s:
+        append_frames(store, df_core, df_ings)
+        s.rows = len(df_core)
+    with stage("index"):
+        write_index(fname, df_ings)
 
 
 def _setup_argparser():
     parser = argparse.ArgumentParser(
         description="Program to convert a specific list or a random list of "
-        "recipes to an hdf for inspection."
+        "recipes to an hdf (or parquet) store for inspection."
     )
     parser.add_argument(
         "-f",
@@ -346,6 +490,23 @@ def _setup_argparser():
     parser.add_argument(
         "-j", "--jobs", type=int, default=N_CPUS, help="Number of processors to use."
     )
+    parser.add_argument(
+        "-a",
+        "--archive",
+        action="append",
+        help="Recipe archive (see beerai.data.archive) to convert instead of "
+        "individual recipe files. With -n, the first n recipes are converted. "
+        "Can pass argument multiple times to convert multiple archives.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["hdf", "parquet"],
+        default="hdf",
+        help="Output format. hdf writes a PyTables HDF, parquet a directory of "
+        "Parquet files partitioned by origin and id range (needs pyarrow). "
+        "Default is hdf.",
+    )
+    add_arguments(parser)
     return parser
 
 
@@ -353,4 +514,5 @@ if __name__ == "__main__":
     parser = _setup_argparser()
     args = parser.parse_args()
 
-    convert_a_bunch(args.filename, args.number, args.jobs)
+    enable_from_args(args)
+    convert_a_bunch(args.filename, args.number, args.jobs, args.archive, args.format)
@@ -0,0 +1,650 @@
+"""
+Generate recipes: typical recipes of a style (TODO.md #2), recipes between two
+styles (#3) and uncommon but plausible ones (#5), from statistics of the
+recipes of each style.
+
+`build` computes the statistics in one chunked pass over recipe_vecs.h5 and
+the core and ingredient tables of all_recipes:
+
+- per style: the number of recipes, how many of them use each ingredient, the
+  mean and standard deviation of the log of the amount of each ingredient,
+  the distribution of the number of ingredients of each category, and the
+  boil time, efficiency and ratio of the boil to the batch volume.
+- per ingredient: the mean yield and colour (fermentables), alpha acids and
+  boil time (hops) and attenuation (yeasts), to compute the properties of the
+  generated recipes.
+
+They're cached in STATS_FILE. Recipes are generated as vectors, all at once:
+the number of ingredients of each category is drawn from the style's
+distribution, the ingredients from their inclusion probabilities (without
+replacement, with the Gumbel top-k trick) and their amounts from a log-normal
+distribution. Recipes between two styles are drawn from a mix of their
+statistics, and a temperature above 1 flattens the inclusion probabilities
+towards the less common ingredients of the style. The vectors are then mapped
+back to named ingredients through the vocabulary, for a batch of BATCH_SIZE
+litres, and the properties of each recipe (see utils.recipe_properties) are
+checked against the ranges of the style in the style guide.
+
+    generator = RecipeGenerator.load()
+    recipes, props = generator.generate("american ipa", 1000)
+    recipes, props = generator.generate("american ipa", 10, mix="saison", t=0.3)
+    recipes, props = generator.typical("american ipa")
+
+    python -m beerai.generate "american ipa" -n 5
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+from collections import namedtuple
+from scipy import sparse
+
+from .config import DATA_DIR, INGREDIENT_CATEGORIES
+from .data.instrument import add_arguments, enable_from_args, stage
+from .data.recipe2vec import (
+    RECIPE_FILE,
+    VECTOR_FILE,
+    VOCAB_FILE,
+    iter_vectors,
+    load_vocab,
+)
+from .data.store import CORE_TABLE, ING_TABLE, open_store, widen
+from .data.vocabulary import load_maps, vocab_version
+from .utils import PROPERTIES, get_style_guide, recipe_properties, style_ranges
+
+STATS_FILE = os.path.join(DATA_DIR, "processed/generator_stats.npz")
+# Litres. The vectors are per litre of batch.
+BATCH_SIZE = 20.0
+# Recipes with more ingredients of a category are counted as having this many
+MAX_PER_CATEGORY = 20
+ING_COLS = [
+    "ferm_name",
+    "ferm_yield",
+    "ferm_color",
+    "hop_name",
+    "hop_alpha",
+    "hop_use",
+    "hop_time",
+    "yeast_name",
+    "yeast_attenuation",
+]
+# The ingredient properties to average, and the range of values to keep (like
+# beerai.cleaning does)
+INGREDIENT_PROPS = {
+    "ferm_yield": (0.03, 1),
+    "ferm_color": (0, np.inf),
+    "hop_alpha": (0, 1),
+    "hop_time": (0, np.inf),
+    "yeast_attenuation": (0, 100),
+}
+EFFICIENCY_RANGE = (0.5, 1)
+# Boil times are rounded to this many minutes
+BOIL_STEP = 5
+
+# The statistics of a style (or a mix of styles) that recipes are drawn from:
+# the probability of each ingredient, the mean and standard deviation of the
+# log of its amount, (categories, MAX_PER_CATEGORY + 1) probabilities of the
+# number of ingredients per category, the mean and standard deviation of the
+# boil time, the mean efficiency and boil/batch volume ratio, and the low and
+# high ends of the ranges of the PROPERTIES (NaN if unknown).
+StyleParams = namedtuple(
+    "StyleParams",
+    [
+        "p",
+        "mu",
+        "sd",
+        "counts",
+        "boil_mean",
+        "boil_sd",
+        "efficiency",
+        "boil_ratio",
+        "low",
+        "high",
+    ],
+)
+
+
+def vocab_names(ings, category, maps, vocab):
+    """Return the vocabulary index of the ingredients of a category (NaN for
+    those not in the maps or vocabulary), named like finalize_names does."""
+    names = ings[f"{category}_name"].astype(object).map(maps[category])
+    names = f"{category}_" + names
+    if category == "hop":
+        dry = (ings["hop_use"] == "dry hop") & names.notna()
+        names[dry] = names[dry] + "_dry"
+    return names.map(vocab)
+
+
+class RecipeStats:
+    """The statistics `build` computes (see the module docstring), as arrays
+    over the styles and the ingredient columns of the vectors."""
+
+    ARRAYS = [
+        "n",
+        "used",
+        "log_sum",
+        "log_sumsq",
+        "counts",
+        "boil_sum",
+        "boil_sumsq",
+        "efficiency_sum",
+        "efficiency_n",
+        "ratio_sum",
+        "ratio_n",
+        "prop_sum",
+        "prop_n",
+    ]
+
+    def __init__(self, styles, columns, version, **arrays):
+        self.styles = np.asarray(styles).astype(str)
+        self.columns = np.asarray(columns)
+        self.vocab_version = str(version)
+        for name in self.ARRAYS:
+            setattr(self, name, np.asarray(arrays[name]))
+
+    @classmethod
+    def build(
+        cls, vec_path=VECTOR_FILE, recipe_path=RECIPE_FILE, maps=None, vocab=None
+    ):
+        """Compute the statistics from one pass over the vectors in vec_path
+        and the recipes they were made from."""
+        if maps is None:
+            maps = load_maps()
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        columns = np.array(sorted(vocab.values()))
+        category = category_of(columns, vocab)
+        totals = {}
+        prop_sum = np.zeros((len(INGREDIENT_PROPS), len(columns)))
+        prop_n = np.zeros((len(INGREDIENT_PROPS), len(columns)))
+        with open_store(recipe_path) as store:
+            for chunk, vecs in enumerate(iter_vectors(vec_path)):
+                with stage("select", chunk=chunk) as s:
+                    # The vectors are written in id order, so a range covers
+                    # the chunk (and only the chunk's ingredients are kept
+                    # below, in case it holds ids of other chunks)
+                    id_range = (vecs.index.min(), vecs.index.max() + 1)
+                    core = store.select(
+                        CORE_TABLE,
+                        columns=["batch_size", "boil_size", "efficiency", "style_name"],
+                        id_range=id_range,
+                    ).reindex(vecs.index)
+                    ings = store.select(ING_TABLE, columns=ING_COLS, id_range=id_range)
+                    ings = ings[ings.index.isin(vecs.index)]
+                    s.rows = len(ings)
+                with stage("styles", chunk=chunk) as s:
+                    for style, part in _style_totals(vecs, core, columns, category):
+                        if style in totals:
+                            part = {k: totals[style][k] + v for k, v in part.items()}
+                        totals[style] = part
+                    s.rows = len(vecs)
+                with stage("ingredients", chunk=chunk) as s:
+                    for i, (col, (lo, hi)) in enumerate(INGREDIENT_PROPS.items()):
+                        index = vocab_names(ings, col.split("_")[0], maps, vocab)
+                        values = ings[col].astype(float)
+                        keep = index.notna() & values.between(lo, hi)
+                        position = np.searchsorted(columns, index[keep].astype(int))
+                        prop_sum[i] += np.bincount(
+                            position, values[keep], minlength=len(columns)
+                        )
+                        prop_n[i] += np.bincount(position, minlength=len(columns))
+                    s.rows = len(ings)
+        if not totals:
+            raise ValueError(f"There are no recipes with a style in {vec_path}.")
+        styles = sorted(totals)
+        arrays = {
+            name: np.stack([totals[style][name] for style in styles])
+            for name in totals[styles[0]]
+        }
+        return cls(
+            styles,
+            columns,
+            vocab_version(vocab),
+            prop_sum=prop_sum,
+            prop_n=prop_n,
+            **arrays,
+        )
+
+    def save(self, path=STATS_FILE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path,
+            styles=self.styles,
+            columns=self.columns,
+            vocab_version=np.array(self.vocab_version),
+            **{name: getattr(self, name) for name in self.ARRAYS},
+        )
+
+    @classmethod
+    def load(cls, path=STATS_FILE, vocab=None):
+        """Load the statistics saved by save, checking that they were computed
+        with vocab (the vocabulary on disk by default)."""
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        with np.load(path, allow_pickle=False) as arrays:
+            stats = cls(
+                arrays["styles"],
+                arrays["columns"],
+                arrays["vocab_version"].item(),
+                **{name: arrays[name] for name in cls.ARRAYS},
+            )
+        version = vocab_version(vocab)
+        if stats.vocab_version != version:
+            raise ValueError(
+                f"{path} was computed with vocabulary {stats.vocab_version}, but "
+                f"the vocabulary is {version}. Rebuild it with --build."
+            )
+        return stats
+
+
+def category_of(columns, vocab):
+    """Return the index in INGREDIENT_CATEGORIES of the category of each
+    column."""
+    names = {i: name for name, i in vocab.items()}
+    return np.array(
+        [INGREDIENT_CATEGORIES.index(names[c].split("_", 1)[0]) for c in columns]
+    )
+
+
+def _style_totals(vecs, core, columns, category):
+    """Yield (style, {statistic: array}) for the styles of a chunk."""
+    codes, styles = pd.factorize(core["style_name"].astype(object))
+    rows = np.flatnonzero(codes >= 0)
+    if not len(rows):
+        return
+    amounts = vecs.reindex(columns=columns, fill_value=0).to_numpy(np.float64)
+    used = amounts > 0
+    logs = np.log(amounts, where=used, out=np.zeros_like(amounts))
+    # (styles, recipes) indicator, to sum the rows of each style at once
+    by_style = sparse.csr_matrix(
+        (np.ones(len(rows)), (codes[rows], rows)), shape=(len(styles), len(vecs))
+    )
+    n_per_category = np.stack(
+        [used[:, category == c].sum(axis=1) for c in range(len(INGREDIENT_CATEGORIES))],
+        axis=1,
+    )
+    counts = np.zeros(
+        (len(styles), len(INGREDIENT_CATEGORIES), MAX_PER_CATEGORY + 1)
+    )
+    np.add.at(
+        counts,
+        (
+            codes[rows, None],
+            np.arange(len(INGREDIENT_CATEGORIES)),
+            np.minimum(n_per_category[rows], MAX_PER_CATEGORY),
+        ),
+        1,
+    )
+    boil = vecs["boil_time"].to_numpy(np.float64)
+    efficiency = core["efficiency"].to_numpy(np.float64)
+    efficiency_ok = (efficiency >= EFFICIENCY_RANGE[0]) & (
+        efficiency <= EFFICIENCY_RANGE[1]
+    )
+    ratio = (core["boil_size"] / core["batch_size"]).to_numpy(np.float64)
+    ratio_ok = np.isfinite(ratio) & (ratio > 0)
+    sums = {
+        "n": by_style @ np.ones(len(vecs)),
+        "used": by_style @ used.astype(np.float64),
+        "log_sum": by_style @ logs,
+        "log_sumsq": by_style @ logs**2,
+        "boil_sum": by_style @ np.nan_to_num(boil),
+        "boil_sumsq": by_style @ np.nan_to_num(boil) ** 2,
+        "efficiency_sum": by_style @ np.where(efficiency_ok, efficiency, 0),
+        "efficiency_n": by_style @ efficiency_ok.astype(np.float64),
+        "ratio_sum": by_style @ np.where(ratio_ok, ratio, 0),
+        "ratio_n": by_style @ ratio_ok.astype(np.float64),
+    }
+    for i, style in enumerate(styles):
+        part = {name: values[i] for name, values in sums.items()}
+        part["counts"] = counts[i]
+        yield style, part
+
+
+def _mean(total, n, default=np.nan):
+    return total / n if n > 0 else default
+
+
+class RecipeGenerator:
+    """Draws recipes from RecipeStats (see the module docstring)."""
+
+    def __init__(self, stats, vocab=None, style_guide=None):
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        if style_guide is None:
+            style_guide = get_style_guide()
+        self.stats = stats
+        self.columns = stats.columns
+        names = {i: name for name, i in vocab.items()}
+        self.names = np.array([names[c] for c in self.columns], dtype=object)
+        self.category = category_of(self.columns, vocab)
+        self.dry = np.char.endswith(self.names.astype(str), "_dry")
+        self.style_index = {style: i for i, style in enumerate(stats.styles)}
+        _, guide_names, low, high = style_ranges(style_guide)
+        self.ranges = {
+            name.lower(): (lo, hi) for name, lo, hi in zip(guide_names, low, high)
+        }
+
+        # Mean property of each ingredient, or of its category if unknown
+        props = np.divide(
+            stats.prop_sum,
+            stats.prop_n,
+            out=np.full(stats.prop_sum.shape, np.nan),
+            where=stats.prop_n > 0,
+        )
+        self.props = {}
+        for i, col in enumerate(INGREDIENT_PROPS):
+            values = props[i]
+            in_category = self.category == INGREDIENT_CATEGORIES.index(
+                col.split("_")[0]
+            )
+            known = in_category & ~np.isnan(values)
+            fill = values[known].mean() if known.any() else np.nan
+            self.props[col] = np.where(np.isnan(values), fill, values)
+
+    @classmethod
+    def load(cls, path=STATS_FILE, vocab=None, style_guide=None):
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        return cls(RecipeStats.load(path, vocab), vocab, style_guide)
+
+    def params(self, style):
+        """Return the StyleParams of a style."""
+        if style not in self.style_index:
+            raise KeyError(f"No recipes of style {style!r}")
+        s = self.stats
+        i = self.style_index[style]
+        n = s.n[i]
+        used = s.used[i]
+        mu = np.divide(s.log_sum[i], used, out=np.zeros(len(used)), where=used > 0)
+        var = np.divide(
+            s.log_sumsq[i], used, out=np.zeros(len(used)), where=used > 0
+        )
+        boil_mean = s.boil_sum[i] / n
+        low, high = self.ranges.get(
+            style, (np.full(len(PROPERTIES), np.nan), np.full(len(PROPERTIES), np.nan))
+        )
+        return StyleParams(
+            p=used / n,
+            mu=mu,
+            sd=np.sqrt(np.maximum(var - mu**2, 0)),
+            counts=s.counts[i] / n,
+            boil_mean=boil_mean,
+            boil_sd=np.sqrt(max(s.boil_sumsq[i] / n - boil_mean**2, 0)),
+            efficiency=_mean(s.efficiency_sum[i], s.efficiency_n[i], 0.75),
+            boil_ratio=_mean(s.ratio_sum[i], s.ratio_n[i], 1.2),
+            low=low,
+            high=high,
+        )
+
+    @staticmethod
+    def mix(a, b, t):
+        """Return the StyleParams a fraction t of the way from a to b. The
+        amounts of an ingredient are mixed in proportion to how often each
+        style uses it."""
+        wa = (1 - t) * a.p
+        wb = t * b.p
+        total = wa + wb
+        w = np.divide(wb, total, out=np.full(len(total), t), where=total > 0)
+        return StyleParams(
+            p=wa + wb,
+            mu=(1 - w) * a.mu + w * b.mu,
+            sd=(1 - w) * a.sd + w * b.sd,
+            **{
+                field: (1 - t) * getattr(a, field) + t * getattr(b, field)
+                for field in StyleParams._fields
+                if field not in ("p", "mu", "sd")
+            },
+        )
+
+    def sample(self, params, n, rng, temperature=1.0):
+        """Return the vectors (n, columns) and boil times of n recipes drawn
+        from params."""
+        vectors = np.zeros((n, len(self.columns)), dtype=np.float32)
+        for c in range(len(INGREDIENT_CATEGORIES)):
+            cols = np.flatnonzero((self.category == c) & (params.p > 0))
+            if not len(cols):
+                continue
+            k = rng.choice(MAX_PER_CATEGORY + 1, size=n, p=params.counts[c])
+            k = np.minimum(k, len(cols))
+            if not k.any():
+                continue
+            # Sorting log(p) / temperature plus Gumbel noise draws ingredients
+            # without replacement with probabilities proportional to
+            # p ** (1 / temperature)
+            keys = np.log(params.p[cols]) / temperature + rng.gumbel(
+                size=(n, len(cols))
+            )
+            chosen = np.argsort(-keys, axis=1)[:, : k.max()]
+            keep = np.arange(chosen.shape[1]) < k[:, None]
+            rows = np.nonzero(keep)[0]
+            picked = cols[chosen[keep]]
+            vectors[rows, picked] = np.exp(
+                rng.normal(params.mu[picked], params.sd[picked])
+            )
+        boil_time = np.round(
+            rng.normal(params.boil_mean, params.boil_sd, size=n) / BOIL_STEP
+        ) * BOIL_STEP
+        return vectors, np.maximum(boil_time, 0)
+
+    def most_likely(self, params):
+        """Return the vector and boil time of the typical recipe of params:
+        the median number of ingredients of each category, the most used
+        ones, in their median amounts."""
+        vector = np.zeros((1, len(self.columns)), dtype=np.float32)
+        for c in range(len(INGREDIENT_CATEGORIES)):
+            cols = np.flatnonzero((self.category == c) & (params.p > 0))
+            k = min(np.searchsorted(np.cumsum(params.counts[c]), 0.5), len(cols))
+            top = cols[np.argsort(-params.p[cols], kind="stable")[:k]]
+            vector[0, top] = np.exp(params.mu[top])
+        boil_time = round(params.boil_mean / BOIL_STEP) * BOIL_STEP
+        return vector, np.array([boil_time], dtype=float)
+
+    def to_recipes(self, vectors):
+        """Return the ingredients of recipe vectors for a batch of BATCH_SIZE
+        litres, one row per ingredient: the recipe (its row in vectors), the
+        category, name, amount in kg (NaN for yeasts), use and time of
+        hops."""
+        rows, cols = np.nonzero(vectors)
+        amount = vectors[rows, cols].astype(np.float64) * BATCH_SIZE
+        category = np.array(INGREDIENT_CATEGORIES)[self.category[cols]]
+        hop = category == "hop"
+        dry = self.dry[cols]
+        # Boil hops are in kg of alpha acids per litre
+        boil_hop = hop & ~dry
+        amount[boil_hop] /= self.props["hop_alpha"][cols[boil_hop]]
+        amount[category == "yeast"] = np.nan
+        names = pd.Series(self.names[cols]).str.split("_", n=1).str[1]
+        names[dry] = names[dry].str[: -len("_dry")]
+        return pd.DataFrame(
+            {
+                "recipe": rows,
+                "category": category,
+                "name": names.to_numpy(),
+                "amount": amount,
+                "use": np.where(hop, np.where(dry, "dry hop", "boil"), None),
+                "time": np.where(boil_hop, self.props["hop_time"][cols], np.nan),
+            }
+        )
+
+    def properties(self, recipes, boil_time, params):
+        """Return the PROPERTIES of recipes from to_recipes, and whether they
+        are all in the ranges of params ("in_range", missing if the ranges
+        are unknown)."""
+        n = len(boil_time)
+        core = pd.DataFrame(
+            {
+                "batch_size": BATCH_SIZE,
+                "boil_size": BATCH_SIZE * params.boil_ratio,
+                "efficiency": params.efficiency,
+                "boil_time": boil_time,
+            },
+            index=pd.RangeIndex(n),
+        )
+        cols = self.columns.searchsorted(self._column_of(recipes))
+        frames = {}
+        for category in ["ferm", "hop", "yeast"]:
+            mask = (recipes["category"] == category).to_numpy()
+            df = pd.DataFrame(
+                {f"{category}_amount": recipes["amount"].to_numpy()[mask]},
+                index=recipes["recipe"].to_numpy()[mask],
+            )
+            for col in INGREDIENT_PROPS:
+                if col.startswith(category):
+                    df[col] = self.props[col][cols[mask]]
+            frames[category] = df
+        hops = recipes[recipes["category"] == "hop"]
+        frames["hop"]["hop_use"] = hops["use"].to_numpy()
+        frames["hop"]["hop_time"] = hops["time"].to_numpy()
+        frames["hop"]["hop_form"] = "pellet"
+        columns = [col for df in frames.values() for col in df.columns]
+        df = core.join(widen(frames, columns))
+        # Like style_stats, every fermentable counts as a grain
+        df["ferm_type"] = np.nan
+        props = recipe_properties(df)[PROPERTIES].reindex(core.index)
+        values = props.to_numpy()
+        known = ~np.isnan(params.low).any()
+        in_range = ((values >= params.low) & (values <= params.high)).all(axis=1)
+        props["in_range"] = pd.array(
+            in_range if known else [pd.NA] * n, dtype="boolean"
+        )
+        return props
+
+    def _column_of(self, recipes):
+        """Return the vocabulary index of the ingredients of recipes from
+        to_recipes."""
+        names = recipes["category"] + "_" + recipes["name"]
+        names = names.where(recipes["use"] != "dry hop", names + "_dry")
+        index = {name: col for name, col in zip(self.names, self.columns)}
+        return names.map(index).to_numpy()
+
+    def generate(self, style, n, seed=None, temperature=1.0, mix=None, t=0.5):
+        """Draw n recipes of a style, or a fraction t of the way from style to
+        the style mix. Return the ingredients of the recipes (see
+        to_recipes) and their properties (see properties), indexed by
+        recipe."""
+        params = self.params(style)
+        if mix is not None:
+            params = self.mix(params, self.params(mix), t)
+        vectors, boil_time = self.sample(
+            params, n, np.random.default_rng(seed), temperature
+        )
+        recipes = self.to_recipes(vectors)
+        props = self.properties(recipes, boil_time, params)
+        props.insert(0, "boil_time", boil_time)
+        return recipes, props
+
+    def typical(self, style, mix=None, t=0.5):
+        """Return the typical recipe of a style (or of a mix of styles, see
+        generate) and its properties."""
+        params = self.params(style)
+        if mix is not None:
+            params = self.mix(params, self.params(mix), t)
+        vector, boil_time = self.most_likely(params)
+        recipes = self.to_recipes(vector)
+        props = self.properties(recipes, boil_time, params)
+        props.insert(0, "boil_time", boil_time)
+        return recipes, props
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to generate recipes of a style, from statistics "
+        "of the recipes of each style."
+    )
+    parser.add_argument("style", help="The style, e.g. 'american ipa'.")
+    parser.add_argument(
+        "-n",
+        "--number",
+        type=int,
+        default=1,
+        help="Number of recipes to generate. Default is 1.",
+    )
+    parser.add_argument(
+        "--typical",
+        action="store_true",
+        help="Print the typical recipe of the style instead.",
+    )
+    parser.add_argument(
+        "-m", "--mix", help="Generate recipes between the style and this one."
+    )
+    parser.add_argument(
+        "-t",
+        type=float,
+        default=0.5,
+        help="How far towards --mix the recipes are, from 0 to 1. Default is 0.5.",
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=1.0,
+        help="Above 1, uncommon ingredients of the style are more likely. "
+        "Default is 1.",
+    )
+    parser.add_argument(
+        "--in-range",
+        action="store_true",
+        help="Only print the recipes whose properties are in the style's ranges.",
+    )
+    parser.add_argument("-s", "--seed", type=int, help="Random seed.")
+    parser.add_argument(
+        "--stats",
+        default=STATS_FILE,
+        help=f"The cached statistics. Default is {STATS_FILE}.",
+    )
+    parser.add_argument(
+        "--build",
+        action="store_true",
+        help="Compute the statistics again, even if they are cached.",
+    )
+    parser.add_argument(
+        "-v",
+        "--vectors",
+        default=VECTOR_FILE,
+        help=f"The recipe vectors. Default is {VECTOR_FILE}.",
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=RECIPE_FILE,
+        help=f"The all_recipes store. Default is {RECIPE_FILE}.",
+    )
+    parser.add_argument(
+        "--vocab",
+        default=VOCAB_FILE,
+        help=f"The vocabulary the vectors were made with. Default is {VOCAB_FILE}.",
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    vocab = load_vocab(args.vocab)
+    if args.build or not os.path.exists(args.stats):
+        stats = RecipeStats.build(args.vectors, args.file, vocab=vocab)
+        stats.save(args.stats)
+    else:
+        stats = RecipeStats.load(args.stats, vocab)
+    generator = RecipeGenerator(stats, vocab)
+    if args.typical:
+        recipes, props = generator.typical(args.style, args.mix, args.t)
+    else:
+        recipes, props = generator.generate(
+            args.style, args.number, args.seed, args.temperature, args.mix, args.t
+        )
+    if args.in_range:
+        props = props[props["in_range"].fillna(False)]
+    for i, row in props.iterrows():
+        summary = ", ".join(f"{prop} {row[prop]:.3g}" for prop in PROPERTIES)
+        summary += f", boil {row['boil_time']:.0f} min"
+        if not pd.isna(row["in_range"]):
+            summary += f", in range: {row['in_range']}"
+        print(summary)
+        ingredients = recipes[recipes["recipe"] == i].drop(columns="recipe")
+        print(ingredients.to_string(index=False))
+        print()
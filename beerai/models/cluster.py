@@ -0,0 +1,371 @@
+"""
+Cluster the recipes from their vectors, without densifying or loading all of
+recipe_vecs.h5.
+
+1. The vectors are scaled to unit variance without being centered (like
+   StandardScaler(with_mean=False)), so they stay sparse, and reduced to
+   n_components dimensions with a truncated SVD. The SVD comes from the
+   eigendecomposition of the Gram matrix of the vectors (columns x columns,
+   accumulated over the chunks in one pass), which is exact and takes well
+   under a second for the ~800 columns of the vocabulary. The scaling is
+   folded into the projection, so projecting a chunk is one sparse x dense
+   product.
+   The basis is saved to BASIS_FILE and reused by later runs with the same
+   vocabulary, unless --refit is given.
+2. MiniBatchKMeans.partial_fit is run on the projected chunks, for a few
+   epochs with the chunks in a random order. The centers are saved to
+   CENTERS_FILE.
+3. The cluster of each recipe is written to CLUSTER_FILE, indexed by recipe
+   id so it can be joined to the core table:
+
+    clusters = pd.read_hdf(CLUSTER_FILE, "clusters")
+    core.join(clusters)
+
+With --update, only the recipes that aren't in CLUSTER_FILE yet (e.g. those
+just vectorised) are projected on the saved basis and assigned to the nearest
+of the saved centers.
+
+    python -m beerai.models.cluster -c 100 -k 20
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+from scipy import sparse
+from sklearn.cluster import MiniBatchKMeans
+
+from ..config import DATA_DIR
+from ..data.instrument import add_arguments, enable_from_args, stage
+from ..data.recipe2vec import (
+    CHUNK_SIZE,
+    VECTOR_FILE,
+    VOCAB_FILE,
+    iter_vectors,
+    load_vocab,
+    n_vectors,
+)
+from ..data.vocabulary import vocab_version
+from .train_style import prefetch
+
+BASIS_FILE = os.path.join(DATA_DIR, "models/recipe_svd.npz")
+CENTERS_FILE = os.path.join(DATA_DIR, "models/recipe_kmeans.npz")
+CLUSTER_FILE = os.path.join(DATA_DIR, "processed/recipe_clusters.h5")
+N_COMPONENTS = 100
+N_CLUSTERS = 20
+EPOCHS = 3
+# The numbers of components clustering_exploration.ipynb compared
+TRY_COMPONENTS = [13, 21, 34, 55, 89, 144, 233, 377]
+
+
+def to_sparse(vecs):
+    return sparse.csr_matrix(vecs.to_numpy(np.float32))
+
+
+class Basis:
+    """A truncated SVD of the scaled recipe vectors.
+
+    projection is (columns, components): the right singular vectors divided
+    by the scale of each column, so that vectors @ projection are the scaled
+    vectors projected on the components. explained_variance_ratio is the
+    fraction of the variance of the scaled vectors along each component."""
+
+    def __init__(
+        self, projection, singular_values, explained_variance_ratio, columns, version
+    ):
+        self.projection = np.ascontiguousarray(projection, dtype=np.float32)
+        self.singular_values = np.asarray(singular_values)
+        self.explained_variance_ratio = np.asarray(explained_variance_ratio)
+        self.columns = np.asarray(columns).astype(str)
+        self.vocab_version = str(version)
+
+    @property
+    def n_components(self):
+        return self.projection.shape[1]
+
+    @classmethod
+    def fit(cls, vec_path=VECTOR_FILE, n_components=N_COMPONENTS, vocab=None):
+        """Compute the basis from one pass over the vectors in vec_path, made
+        with vocab (the vocabulary on disk by default)."""
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        gram, sums, n, columns = None, None, 0, None
+        for chunk, vecs in enumerate(prefetch(iter_vectors(vec_path))):
+            with stage("gram", chunk=chunk) as s:
+                X = to_sparse(vecs)
+                if gram is None:
+                    gram = np.zeros((X.shape[1], X.shape[1]))
+                    sums = np.zeros(X.shape[1])
+                    columns = vecs.columns
+                gram += (X.T @ X).toarray()
+                sums += np.asarray(X.sum(axis=0)).ravel()
+                n += X.shape[0]
+                s.rows = X.shape[0]
+        if n == 0:
+            raise ValueError(f"There are no vectors in {vec_path}.")
+
+        with stage("svd") as s:
+            mean = sums / n
+            scale = np.sqrt(np.maximum(np.diag(gram) / n - mean**2, 0))
+            # Like StandardScaler, columns without spread aren't scaled
+            scale[scale == 0] = 1
+            scaled_gram = gram / np.outer(scale, scale)
+            n_components = min(n_components, len(scale))
+            # The eigenvectors of the Gram matrix are the right singular
+            # vectors of the scaled vectors, and its eigenvalues their squared
+            # singular values.
+            eigenvalues, eigenvectors = np.linalg.eigh(scaled_gram)
+            # eigh sorts them in increasing order
+            top = np.arange(len(eigenvalues))[::-1][:n_components]
+            eigenvalues = np.maximum(eigenvalues[top], 0)
+            components = eigenvectors[:, top].T
+            # The variance along a component is the mean of the squared
+            # projections minus the squared mean projection.
+            variance = eigenvalues / n - (components @ (mean / scale)) ** 2
+            total = np.sum(np.diag(scaled_gram) / n - (mean / scale) ** 2)
+            s.rows = n
+        return cls(
+            components.T / scale[:, None],
+            np.sqrt(eigenvalues),
+            variance / total,
+            columns,
+            vocab_version(vocab),
+        )
+
+    def save(self, path=BASIS_FILE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path,
+            projection=self.projection,
+            singular_values=self.singular_values,
+            explained_variance_ratio=self.explained_variance_ratio,
+            columns=self.columns,
+            vocab_version=np.array(self.vocab_version),
+        )
+
+    @classmethod
+    def load(cls, path=BASIS_FILE, vocab=None):
+        """Load a basis saved by save, checking that it was computed from
+        vectors made with vocab (the vocabulary on disk by default)."""
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        with np.load(path, allow_pickle=False) as arrays:
+            basis = cls(
+                arrays["projection"],
+                arrays["singular_values"],
+                arrays["explained_variance_ratio"],
+                arrays["columns"],
+                arrays["vocab_version"].item(),
+            )
+        version = vocab_version(vocab)
+        if basis.vocab_version != version:
+            raise ValueError(
+                f"{path} was computed with vocabulary {basis.vocab_version}, "
+                f"but the vocabulary is {version}. Rerun with --refit."
+            )
+        return basis
+
+    def truncate(self, n_components):
+        """Return the basis of the first n_components components."""
+        return Basis(
+            self.projection[:, :n_components],
+            self.singular_values[:n_components],
+            self.explained_variance_ratio[:n_components],
+            self.columns,
+            self.vocab_version,
+        )
+
+    def transform(self, vecs):
+        """Project recipe vectors (a DataFrame like recipes2vec returns) on
+        the components."""
+        vecs = vecs.set_axis(vecs.columns.astype(str), axis=1)
+        X = to_sparse(vecs.reindex(columns=self.columns, fill_value=0))
+        return X @ self.projection
+
+
+def load_or_fit_basis(
+    path=BASIS_FILE,
+    vec_path=VECTOR_FILE,
+    n_components=N_COMPONENTS,
+    vocab=None,
+    refit=False,
+):
+    """Return the basis saved in path if it has at least n_components
+    components for the same vocabulary, or fit and save a new one."""
+    if not refit and os.path.exists(path):
+        try:
+            basis = Basis.load(path, vocab)
+        except ValueError as e:
+            print(f"{e} Refitting.")
+        else:
+            if basis.n_components >= n_components:
+                return basis.truncate(n_components)
+    basis = Basis.fit(vec_path, n_components, vocab)
+    basis.save(path)
+    return basis
+
+
+def fit_kmeans(
+    basis, vec_path=VECTOR_FILE, n_clusters=N_CLUSTERS, epochs=EPOCHS, seed=0
+):
+    """Fit MiniBatchKMeans on the projected vectors, a chunk at a time, and
+    return its centers."""
+    rng = np.random.default_rng(seed)
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, n_init=3)
+    n_chunks = len(range(0, n_vectors(vec_path), CHUNK_SIZE))
+    for epoch in range(epochs):
+        order = rng.permutation(n_chunks)
+        chunks = prefetch(iter_vectors(vec_path, order))
+        for chunk, vecs in enumerate(chunks):
+            with stage("partial_fit", epoch=epoch, chunk=chunk) as s:
+                kmeans.partial_fit(basis.transform(vecs))
+                s.rows = len(vecs)
+        print(f"Epoch {epoch + 1}: inertia of the last chunk {kmeans.inertia_:.4g}.")
+    return kmeans.cluster_centers_.astype(np.float32)
+
+
+def nearest(points, centers):
+    """Return the index of the nearest center to each point."""
+    distances = (centers**2).sum(axis=1) - 2 * points @ centers.T
+    return np.argmin(distances, axis=1).astype(np.int32)
+
+
+def assign(basis, centers, vec_path=VECTOR_FILE, out=CLUSTER_FILE, update=False):
+    """Write the cluster of each recipe in vec_path to out. With update, only
+    the recipes that aren't in out already are assigned and appended.
+    Return the number of recipes assigned."""
+    mode = "a" if update and os.path.exists(out) else "w"
+    n_assigned = 0
+    with pd.HDFStore(out, mode, complevel=5, complib="blosc") as store:
+        done = store.select_column("clusters", "index") if "clusters" in store else []
+        done = pd.Index(done)
+        for chunk, vecs in enumerate(prefetch(iter_vectors(vec_path))):
+            with stage("assign", chunk=chunk) as s:
+                vecs = vecs[~vecs.index.isin(done)]
+                if len(vecs):
+                    clusters = pd.DataFrame(
+                        {"cluster": nearest(basis.transform(vecs), centers)},
+                        index=vecs.index,
+                    )
+                    store.append("clusters", clusters, format="table")
+                s.rows = len(vecs)
+            n_assigned += len(vecs)
+    return n_assigned
+
+
+def save_centers(centers, basis, path=CENTERS_FILE):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.savez(path, centers=centers, vocab_version=np.array(basis.vocab_version))
+
+
+def load_centers(basis, path=CENTERS_FILE):
+    """Load the centers saved by save_centers, checking that they were fit on
+    projections on (the first components of) basis."""
+    with np.load(path, allow_pickle=False) as arrays:
+        centers = arrays["centers"]
+        version = arrays["vocab_version"].item()
+    if version != basis.vocab_version or centers.shape[1] > basis.n_components:
+        raise ValueError(
+            f"{path} wasn't fit on the basis in use. Rerun without --update."
+        )
+    return centers
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to cluster the recipes from their vectors, a chunk "
+        "at a time."
+    )
+    parser.add_argument(
+        "-v",
+        "--vectors",
+        default=VECTOR_FILE,
+        help=f"The recipe vectors. Default is {VECTOR_FILE}.",
+    )
+    parser.add_argument(
+        "--vocab",
+        default=VOCAB_FILE,
+        help=f"The vocabulary the vectors were made with. Default is {VOCAB_FILE}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=CLUSTER_FILE,
+        help=f"Where to write the clusters. Default is {CLUSTER_FILE}.",
+    )
+    parser.add_argument(
+        "-c",
+        "--components",
+        type=int,
+        default=N_COMPONENTS,
+        help=f"Number of SVD components. Default is {N_COMPONENTS}.",
+    )
+    parser.add_argument(
+        "-k",
+        "--clusters",
+        type=int,
+        default=N_CLUSTERS,
+        help=f"Number of clusters. Default is {N_CLUSTERS}.",
+    )
+    parser.add_argument(
+        "-e",
+        "--epochs",
+        type=int,
+        default=EPOCHS,
+        help=f"Passes over the vectors to fit the clusters. Default is {EPOCHS}.",
+    )
+    parser.add_argument(
+        "--basis",
+        default=BASIS_FILE,
+        help=f"Where to cache the SVD basis. Default is {BASIS_FILE}.",
+    )
+    parser.add_argument(
+        "--centers",
+        default=CENTERS_FILE,
+        help=f"Where to save the cluster centers. Default is {CENTERS_FILE}.",
+    )
+    parser.add_argument(
+        "--refit",
+        action="store_true",
+        help="Compute the SVD basis again, even if it is cached.",
+    )
+    parser.add_argument(
+        "-u",
+        "--update",
+        action="store_true",
+        help="Only assign the recipes that aren't in the output yet, with the "
+        "saved basis and centers.",
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, default=0, help="Random seed. Default is 0."
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+    vocab = load_vocab(args.vocab)
+
+    if args.update:
+        basis = Basis.load(args.basis, vocab)
+        centers = load_centers(basis, args.centers)
+        basis = basis.truncate(centers.shape[1])
+    else:
+        basis = load_or_fit_basis(
+            args.basis, args.vectors, args.components, vocab, args.refit
+        )
+        explained = np.cumsum(basis.explained_variance_ratio)
+        tried = [n for n in TRY_COMPONENTS if n < basis.n_components]
+        for n in tried + [basis.n_components]:
+            print(
+                f"Number of components: {n}, explained variance ratio: "
+                f"{explained[n - 1]:.3f}"
+            )
+        centers = fit_kmeans(basis, args.vectors, args.clusters, args.epochs, args.seed)
+        save_centers(centers, basis, args.centers)
+    n_assigned = assign(basis, centers, args.vectors, args.output, args.update)
+    print(f"Assigned {n_assigned} recipes to clusters.")
@@ -0,0 +1,241 @@
+"""
+Dense, low dimensional embeddings of the recipes, learned from which
+ingredients are used together.
+
+1. One pass over recipe_vecs.h5 counts how often each pair of ingredients
+   appears in the same recipe. The positive pointwise mutual information
+   (PPMI) of the pairs, factorised with an SVD, gives an embedding of each
+   ingredient (like word embeddings from word co-occurrences), so that
+   ingredients used in the same kinds of recipes are close. This is saved to
+   MODEL_FILE with the version of the vocabulary.
+2. A recipe's embedding is the sum of the embeddings of its ingredients,
+   scaled to unit length. A second pass writes the embedding of every recipe
+   to EMBEDDING_DIR: vectors.npy, a (recipes, dim) float32 matrix to be
+   memory-mapped, and ids.npy, the recipe id of each row.
+
+    embedder = RecipeEmbedder.load()
+    embedder.embed(recipes2vec(df))  # (recipes, dim)
+
+    store = EmbeddingStore()
+    store.lookup([12, 345])  # the embeddings of recipes 12 and 345
+
+    python -m beerai.models.embed -d 128
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+from scipy import sparse
+
+from ..config import DATA_DIR
+from ..data.instrument import add_arguments, enable_from_args, stage
+from ..data.recipe2vec import (
+    VECTOR_FILE,
+    VOCAB_FILE,
+    iter_vectors,
+    load_vocab,
+    n_vectors,
+)
+from ..data.vocabulary import vocab_version
+from .train_style import prefetch
+
+MODEL_FILE = os.path.join(DATA_DIR, "models/ingredient_embeddings.npz")
+EMBEDDING_DIR = os.path.join(DATA_DIR, "processed/recipe_embeddings")
+DIM = 128
+# Raising the ingredient frequencies to this power before computing the PMI
+# keeps rare ingredients from getting the highest PMIs (Levy et al., 2015)
+CONTEXT_SMOOTHING = 0.75
+
+
+def presence(vecs, columns):
+    """Return which of the ingredients in columns each recipe uses, as a
+    sparse 0/1 matrix."""
+    vecs = vecs.set_axis(vecs.columns.astype(str), axis=1)
+    X = vecs.reindex(columns=columns, fill_value=0).to_numpy(np.float32)
+    return sparse.csr_matrix((X > 0).astype(np.float32))
+
+
+def ppmi(counts, smoothing=CONTEXT_SMOOTHING):
+    """Return the positive pointwise mutual information of the pairs of
+    ingredients, from the number of recipes using each pair."""
+    counts = counts.astype(np.float64)
+    np.fill_diagonal(counts, 0)
+    total = counts.sum()
+    if total == 0:
+        return counts
+    rows = counts.sum(axis=1) / total
+    contexts = counts.sum(axis=0) ** smoothing
+    contexts /= contexts.sum()
+    with np.errstate(divide="ignore"):
+        pmi = np.log(counts / total) - np.log(np.outer(rows, contexts))
+    pmi[~np.isfinite(pmi)] = 0
+    return np.maximum(pmi, 0)
+
+
+class RecipeEmbedder:
+    """Embeds recipe vectors with the embeddings of their ingredients.
+
+    ingredients is a (columns, dim) matrix, the embedding of the ingredient of
+    each column of the vectors."""
+
+    def __init__(self, ingredients, columns, version):
+        self.ingredients = np.ascontiguousarray(ingredients, dtype=np.float32)
+        self.columns = np.asarray(columns).astype(str)
+        self.vocab_version = str(version)
+
+    @property
+    def dim(self):
+        return self.ingredients.shape[1]
+
+    @classmethod
+    def fit(cls, vec_path=VECTOR_FILE, dim=DIM, vocab=None):
+        """Learn the ingredient embeddings from one pass over the vectors in
+        vec_path, made with vocab (the vocabulary on disk by default)."""
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        columns = np.array([str(i) for i in sorted(vocab.values())])
+        counts = np.zeros((len(columns), len(columns)))
+        for chunk, vecs in enumerate(prefetch(iter_vectors(vec_path))):
+            with stage("cooccurrence", chunk=chunk) as s:
+                X = presence(vecs, columns)
+                counts += (X.T @ X).toarray()
+                s.rows = len(vecs)
+        with stage("svd") as s:
+            u, singular_values, _ = np.linalg.svd(ppmi(counts))
+            dim = min(dim, len(columns))
+            ingredients = u[:, :dim] * np.sqrt(singular_values[:dim])
+            s.rows = len(columns)
+        return cls(ingredients, columns, vocab_version(vocab))
+
+    def save(self, path=MODEL_FILE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path,
+            ingredients=self.ingredients,
+            columns=self.columns,
+            vocab_version=np.array(self.vocab_version),
+        )
+
+    @classmethod
+    def load(cls, path=MODEL_FILE, vocab=None):
+        """Load the embeddings saved by save, checking that they were learned
+        from vectors made with vocab (the vocabulary on disk by default)."""
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        with np.load(path, allow_pickle=False) as arrays:
+            embedder = cls(
+                arrays["ingredients"],
+                arrays["columns"],
+                arrays["vocab_version"].item(),
+            )
+        version = vocab_version(vocab)
+        if embedder.vocab_version != version:
+            raise ValueError(
+                f"{path} was learned with vocabulary {embedder.vocab_version}, "
+                f"but the vocabulary is {version}. Rerun python -m "
+                "beerai.models.embed."
+            )
+        return embedder
+
+    def embed(self, vecs):
+        """Return the unit length embeddings of recipe vectors (a DataFrame
+        like recipes2vec returns), as a (recipes, dim) array. Recipes without
+        any known ingredient get zeros."""
+        embeddings = presence(vecs, self.columns) @ self.ingredients
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return embeddings / norms
+
+
+class EmbeddingStore:
+    """The embeddings of the recipes written by write_embeddings. vectors is
+    memory-mapped, so only the rows used are read."""
+
+    def __init__(self, path=EMBEDDING_DIR):
+        self.ids = np.load(os.path.join(path, "ids.npy"))
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.index = pd.Index(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, ids):
+        """Return the embeddings of the recipes with the given ids."""
+        rows = self.index.get_indexer(ids)
+        if (rows < 0).any():
+            missing = np.asarray(ids)[rows < 0]
+            raise KeyError(f"No embeddings for recipes {missing[:10].tolist()}")
+        return self.vectors[rows]
+
+
+def write_embeddings(embedder, vec_path=VECTOR_FILE, path=EMBEDDING_DIR):
+    """Embed every recipe in vec_path and write the embeddings and ids to
+    path, a chunk at a time."""
+    os.makedirs(path, exist_ok=True)
+    n = n_vectors(vec_path)
+    vectors = np.lib.format.open_memmap(
+        os.path.join(path, "vectors.npy"), "w+", np.float32, (n, embedder.dim)
+    )
+    ids = np.empty(n, dtype=np.int64)
+    start = 0
+    for chunk, vecs in enumerate(prefetch(iter_vectors(vec_path))):
+        with stage("embed", chunk=chunk) as s:
+            vectors[start : start + len(vecs)] = embedder.embed(vecs)
+            ids[start : start + len(vecs)] = vecs.index
+            start += len(vecs)
+            s.rows = len(vecs)
+    vectors.flush()
+    del vectors
+    np.save(os.path.join(path, "ids.npy"), ids)
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to learn dense embeddings of the ingredients and "
+        "write the embedding of every recipe."
+    )
+    parser.add_argument(
+        "-v",
+        "--vectors",
+        default=VECTOR_FILE,
+        help=f"The recipe vectors. Default is {VECTOR_FILE}.",
+    )
+    parser.add_argument(
+        "--vocab",
+        default=VOCAB_FILE,
+        help=f"The vocabulary the vectors were made with. Default is {VOCAB_FILE}.",
+    )
+    parser.add_argument(
+        "-d",
+        "--dim",
+        type=int,
+        default=DIM,
+        help=f"Number of dimensions of the embeddings. Default is {DIM}.",
+    )
+    parser.add_argument(
+        "-m",
+        "--model",
+        default=MODEL_FILE,
+        help=f"Where to save the ingredient embeddings. Default is {MODEL_FILE}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=EMBEDDING_DIR,
+        help=f"Where to write the recipe embeddings. Default is {EMBEDDING_DIR}.",
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    embedder = RecipeEmbedder.fit(args.vectors, args.dim, load_vocab(args.vocab))
+    embedder.save(args.model)
+    write_embeddings(embedder, args.vectors, args.output)
+    print(f"Wrote {n_vectors(args.vectors)} {embedder.dim}-dim embeddings.")
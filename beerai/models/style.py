@@ -0,0 +1,219 @@
+"""
+Predict the style of recipes from their vectors with a linear model trained by
+beerai.models.train_style.
+
+The model is saved as plain float32 NumPy arrays (np.savez, no pickles), with
+the scaling of the inputs folded into the coefficients so that sparse vectors
+stay sparse: scoring a batch is one sparse x dense product. The version of the
+vocabulary the vectors were built with (see vocabulary.vocab_version) is
+saved along with it, and loading the model against any other vocabulary fails,
+since the columns of the vectors would no longer mean the same ingredients.
+
+    predictor = StylePredictor.load()
+    styles, probabilities = predictor.predict(recipes2vec(df), k=3)
+
+or, for all the vectors of recipe_vecs.h5,
+
+    python -m beerai.models.style -k 3 -o styles.csv
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import sys
+import time
+
+from scipy import sparse, special
+
+from ..config import DATA_DIR
+from ..data.instrument import add_arguments, enable_from_args, stage
+from ..data.recipe2vec import CHUNK_SIZE, VECTOR_FILE, VOCAB_FILE, load_vocab
+from ..data.vocabulary import vocab_version
+
+MODEL_FILE = os.path.join(DATA_DIR, "models/style_classifier.npz")
+DEFAULT_K = 3
+
+
+class StylePredictor:
+    """A linear one-vs-rest style classifier over recipe vectors.
+
+    coef is (columns, classes) and intercept (classes,), applied to the
+    unscaled vectors. The probabilities are the sigmoid of each class's score,
+    normalized to sum to 1 over the classes, like sklearn's SGDClassifier
+    with log_loss gives them."""
+
+    def __init__(self, coef, intercept, classes, columns, vocab_version):
+        self.coef = np.ascontiguousarray(coef, dtype=np.float32)
+        self.intercept = np.asarray(intercept, dtype=np.float32)
+        self.classes = np.asarray(classes).astype(str)
+        self.columns = np.asarray(columns).astype(str)
+        self.vocab_version = str(vocab_version)
+        if self.coef.shape != (len(self.columns), len(self.classes)):
+            raise ValueError(
+                f"Coefficients of shape {self.coef.shape} don't match "
+                f"{len(self.columns)} columns and {len(self.classes)} classes."
+            )
+
+    @classmethod
+    def from_classifier(cls, clf, columns, center, scale, vocab):
+        """Make a predictor from a fitted linear classifier (e.g. an
+        SGDClassifier) taking the vectors scaled as (vectors - center) /
+        scale, with the columns of vectors made with vocab."""
+        expected = {str(i) for i in vocab.values()} | {"boil_time"}
+        if set(np.asarray(columns).astype(str)) != expected:
+            raise ValueError("The columns of the vectors don't match the vocabulary.")
+        coef = clf.coef_ / np.asarray(scale)
+        intercept = clf.intercept_ - coef @ np.asarray(center)
+        if len(clf.classes_) == 2:
+            # A binary classifier only scores the second class. Scoring the
+            # first with the opposite sign gives the same probabilities.
+            coef = np.vstack([-coef, coef])
+            intercept = np.concatenate([-intercept, intercept])
+        return cls(coef.T, intercept, clf.classes_, columns, vocab_version(vocab))
+
+    def save(self, path=MODEL_FILE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path,
+            coef=self.coef,
+            intercept=self.intercept,
+            classes=self.classes,
+            columns=self.columns,
+            vocab_version=np.array(self.vocab_version),
+        )
+
+    @classmethod
+    def load(cls, path=MODEL_FILE, vocab=None):
+        """Load a model saved by save, checking that it was trained on vectors
+        made with vocab (the vocabulary on disk by default)."""
+        if vocab is None:
+            vocab = load_vocab(VOCAB_FILE)
+        with np.load(path, allow_pickle=False) as arrays:
+            predictor = cls(
+                arrays["coef"],
+                arrays["intercept"],
+                arrays["classes"],
+                arrays["columns"],
+                arrays["vocab_version"].item(),
+            )
+        version = vocab_version(vocab)
+        if predictor.vocab_version != version:
+            raise ValueError(
+                f"{path} was trained with vocabulary {predictor.vocab_version}, "
+                f"but the vocabulary is {version}. Retrain the model with "
+                "python -m beerai.models.train_style."
+            )
+        return predictor
+
+    def to_matrix(self, vecs):
+        """Return recipe vectors (a DataFrame like recipes2vec returns) as a
+        sparse matrix over the columns of the model. Sparse matrices are
+        taken as they are."""
+        if sparse.issparse(vecs):
+            if vecs.shape[1] != len(self.columns):
+                raise ValueError(
+                    f"Expected {len(self.columns)} columns, got {vecs.shape[1]}."
+                )
+            return sparse.csr_matrix(vecs, dtype=np.float32)
+        vecs = vecs.set_axis(vecs.columns.astype(str), axis=1)
+        return sparse.csr_matrix(
+            vecs.reindex(columns=self.columns, fill_value=0).to_numpy(np.float32)
+        )
+
+    def predict_proba(self, vecs):
+        """Return the probability of each class for each recipe, as a
+        (recipes, classes) array."""
+        scores = self.to_matrix(vecs) @ self.coef
+        scores += self.intercept
+        special.expit(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def predict(self, vecs, k=DEFAULT_K):
+        """Return the k most likely styles of each recipe and their
+        probabilities, most likely first, as two (recipes, k) arrays."""
+        probabilities = self.predict_proba(vecs)
+        k = min(k, len(self.classes))
+        top = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+        top_probabilities = np.take_along_axis(probabilities, top, axis=1)
+        order = np.argsort(-top_probabilities, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        return self.classes[top], np.take_along_axis(top_probabilities, order, axis=1)
+
+
+def predict_file(predictor, vec_path=VECTOR_FILE, k=DEFAULT_K):
+    """Yield a DataFrame of the k most likely styles and their probabilities
+    for each chunk of the vectors in vec_path, indexed by recipe id."""
+    with pd.HDFStore(vec_path, "r") as store:
+        for chunk, vecs in enumerate(store.select("/vecs", chunksize=CHUNK_SIZE)):
+            with stage("predict", chunk=chunk) as s:
+                styles, probabilities = predictor.predict(vecs, k)
+                df = pd.DataFrame(index=vecs.index)
+                for i in range(styles.shape[1]):
+                    df[f"style_{i + 1}"] = styles[:, i]
+                    df[f"probability_{i + 1}"] = probabilities[:, i]
+                s.rows = len(df)
+            yield df
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to predict the most likely styles of the recipes "
+        "in the vector file."
+    )
+    parser.add_argument(
+        "-m",
+        "--model",
+        default=MODEL_FILE,
+        help=f"The model from beerai.models.train_style. Default is {MODEL_FILE}.",
+    )
+    parser.add_argument(
+        "-v",
+        "--vectors",
+        default=VECTOR_FILE,
+        help=f"The recipe vectors. Default is {VECTOR_FILE}.",
+    )
+    parser.add_argument(
+        "--vocab",
+        default=VOCAB_FILE,
+        help=f"The vocabulary the vectors were made with. Default is {VOCAB_FILE}.",
+    )
+    parser.add_argument(
+        "-k",
+        type=int,
+        default=DEFAULT_K,
+        help=f"Number of styles per recipe. Default is {DEFAULT_K}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="CSV file to write the styles to. Default is stdout.",
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    start = time.perf_counter()
+    predictor = StylePredictor.load(args.model, load_vocab(args.vocab))
+    print(
+        f"Loaded {args.model} in {1000 * (time.perf_counter() - start):.1f}ms.",
+        file=sys.stderr,
+    )
+    out = args.output or sys.stdout
+    start = time.perf_counter()
+    n_recipes = 0
+    for i, df in enumerate(predict_file(predictor, args.vectors, args.k)):
+        df.to_csv(out, mode="w" if i == 0 else "a", header=i == 0)
+        n_recipes += len(df)
+    seconds = time.perf_counter() - start
+    print(
+        f"Predicted {n_recipes} recipes in {seconds:.1f}s "
+        f"({n_recipes / max(seconds, 1e-9):.0f} recipes/s).",
+        file=sys.stderr,
+    )
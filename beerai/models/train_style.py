@@ -0,0 +1,328 @@
+"""
+Train a linear style classifier on the recipe vectors, without loading them
+all into memory.
+
+The vectors (recipe_vecs.h5) are streamed in chunks, along with the
+`style_name` of each recipe from all_recipes:
+
+1. A first pass counts the recipes of each style and keeps a fixed size
+   random sample (a reservoir) of the vectors. The styles with at least
+   MIN_RECIPES recipes are the classes. The sample gives the median and
+   interquartile range of each column, to scale the vectors like
+   sklearn's RobustScaler.
+2. SGDClassifier.partial_fit is then run on each chunk, for a few epochs
+   with the chunks in a random order. Rather than undersampling the common
+   styles, each recipe is weighted by the inverse of its style's frequency,
+   like class_weight="balanced".
+3. The recipes held out for testing (those whose id is a multiple of
+   TEST_EVERY) are scored at the end.
+
+Memory use only depends on the chunk size, the sample size and the number of
+columns. The classes are fit in parallel (one-vs-rest, in threads) and the
+next chunk is read while the current one is fit, so training uses as many
+cores as there are jobs.
+
+    python -m beerai.models.train_style --epochs 5
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import queue
+import threading
+import time
+
+from sklearn.linear_model import SGDClassifier
+
+from ..data.instrument import add_arguments, enable_from_args, stage
+from ..data.recipe2vec import (
+    CHUNK_SIZE,
+    RECIPE_FILE,
+    VECTOR_FILE,
+    VOCAB_FILE,
+    iter_vectors,
+    load_vocab,
+    n_vectors,
+)
+from ..data.store import CORE_TABLE, open_store
+from .style import MODEL_FILE, StylePredictor
+
+RESERVOIR_SIZE = 10000
+MIN_RECIPES = 100
+EPOCHS = 5
+ALPHA = 1e-4
+TEST_EVERY = 10
+N_JOBS = os.cpu_count() or 1
+
+
+def iter_chunks(vec_path=VECTOR_FILE, recipe_path=RECIPE_FILE, order=None):
+    """Yield (vectors, styles) for each chunk of the vector store (see
+    iter_vectors): a DataFrame of recipe vectors and a Series of the style of
+    each recipe (NaN if it has none)."""
+    with open_store(recipe_path) as recipes:
+        for df in iter_vectors(vec_path, order):
+            # The vectors are written in id order, so a range covers the chunk
+            core = recipes.select(
+                CORE_TABLE,
+                columns=["style_name"],
+                id_range=(df.index.min(), df.index.max() + 1),
+            )
+            yield df, core["style_name"].astype(object).reindex(df.index)
+
+
+def prefetch(iterable, size=2):
+    """Iterate over iterable in a thread, keeping up to size items ready."""
+    items = queue.Queue(size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def is_test(ids):
+    return np.asarray(ids) % TEST_EVERY == 0
+
+
+class Reservoir:
+    """A uniform random sample of up to size rows of the arrays added to it
+    (reservoir sampling)."""
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.rows = None
+        self.seen = 0
+
+    def add(self, X):
+        if self.rows is None:
+            self.rows = np.empty((self.size, X.shape[1]), dtype=X.dtype)
+        n_fill = min(max(self.size - self.seen, 0), len(X))
+        self.rows[self.seen : self.seen + n_fill] = X[:n_fill]
+        # Each later row replaces a random row with probability size / seen.
+        # Assigning in order keeps the last of rows drawing the same slot,
+        # as if they were added one by one.
+        positions = self.seen + np.arange(n_fill, len(X))
+        slots = (self.rng.random(len(positions)) * (positions + 1)).astype(np.int64)
+        keep = slots < self.size
+        self.rows[slots[keep]] = X[n_fill:][keep]
+        self.seen += len(X)
+
+    def sample(self):
+        return self.rows[: min(self.seen, self.size)]
+
+
+def scan(vec_path=VECTOR_FILE, recipe_path=RECIPE_FILE, seed=0):
+    """Return the number of training recipes of each style, the columns of
+    the vectors and their (median, interquartile range), from a pass over the
+    training recipes."""
+    reservoir = Reservoir(RESERVOIR_SIZE, np.random.default_rng(seed))
+    counts = pd.Series(dtype=np.int64)
+    columns = None
+    for chunk, (df, styles) in enumerate(prefetch(iter_chunks(vec_path, recipe_path))):
+        with stage("scan", chunk=chunk) as s:
+            train = ~is_test(df.index)
+            columns = df.columns if columns is None else columns
+            reservoir.add(df.to_numpy(np.float32)[train])
+            counts = counts.add(styles[train].value_counts(), fill_value=0)
+            s.rows = len(df)
+    if columns is None:
+        raise ValueError(f"There are no vectors in {vec_path}.")
+    sample = reservoir.sample()
+    q25, median, q75 = np.percentile(sample, [25, 50, 75], axis=0)
+    scale = q75 - q25
+    # Like RobustScaler, columns without spread aren't scaled
+    scale[scale == 0] = 1
+    return counts.astype(np.int64), columns, (median, scale)
+
+
+def class_weights(counts):
+    """Return the weight of each class so they all weigh the same in total,
+    like class_weight="balanced"."""
+    return counts.sum() / (len(counts) * counts)
+
+
+def train(
+    vec_path=VECTOR_FILE,
+    recipe_path=RECIPE_FILE,
+    epochs=EPOCHS,
+    alpha=ALPHA,
+    min_recipes=MIN_RECIPES,
+    jobs=N_JOBS,
+    seed=0,
+):
+    """Fit a style classifier on the vectors of the training recipes. Return
+    the classifier, the columns of the vectors it takes and the (center,
+    scale) to scale them with."""
+    counts, columns, (center, scale) = scan(vec_path, recipe_path, seed)
+    counts = counts[counts >= min_recipes]
+    if len(counts) < 2:
+        raise ValueError(f"Fewer than 2 styles have {min_recipes} recipes or more.")
+    classes = np.array(sorted(counts.index), dtype=object)
+    weights = class_weights(counts)
+    print(f"Training on {counts.sum()} recipes of {len(classes)} styles.")
+
+    rng = np.random.default_rng(seed)
+    clf = SGDClassifier(loss="log_loss", alpha=alpha, n_jobs=jobs, random_state=seed)
+    n_chunks = -(-n_vectors(vec_path) // CHUNK_SIZE)
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        rows = 0
+        order = rng.permutation(n_chunks)
+        chunks = prefetch(iter_chunks(vec_path, recipe_path, order))
+        for chunk, (df, styles) in enumerate(chunks):
+            with stage("partial_fit", epoch=epoch, chunk=chunk) as s:
+                mask = ~is_test(df.index) & styles.isin(classes).to_numpy()
+                shuffle = rng.permutation(np.count_nonzero(mask))
+                X = (df.to_numpy(np.float32)[mask] - center) / scale
+                y = styles[mask].to_numpy()
+                clf.partial_fit(
+                    X[shuffle],
+                    y[shuffle],
+                    classes=classes,
+                    sample_weight=weights.loc[y].to_numpy()[shuffle],
+                )
+                s.rows = len(y)
+            rows += len(y)
+        seconds = time.perf_counter() - start
+        print(f"Epoch {epoch + 1}: {rows} recipes in {seconds:.1f}s.")
+    return clf, columns, (center, scale)
+
+
+def evaluate(clf, center, scale, vec_path=VECTOR_FILE, recipe_path=RECIPE_FILE):
+    """Return the accuracy, balanced accuracy (mean recall per style) and
+    macro F1 of the classifier on the test recipes of its classes."""
+    classes = clf.classes_
+    confusion = np.zeros((len(classes), len(classes)), dtype=np.int64)
+    for chunk, (df, styles) in enumerate(prefetch(iter_chunks(vec_path, recipe_path))):
+        with stage("evaluate", chunk=chunk) as s:
+            mask = is_test(df.index) & styles.isin(classes).to_numpy()
+            if not mask.any():
+                continue
+            X = (df.to_numpy(np.float32)[mask] - center) / scale
+            truth = np.searchsorted(classes, styles[mask].to_numpy())
+            predicted = np.searchsorted(classes, clf.predict(X))
+            np.add.at(confusion, (truth, predicted), 1)
+            s.rows = int(np.count_nonzero(mask))
+    true_positives = np.diag(confusion)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    present = support > 0
+    recall = true_positives[present] / support[present]
+    precision = np.divide(
+        true_positives, predicted, out=np.zeros(len(classes)), where=predicted > 0
+    )[present]
+    f1 = np.divide(
+        2 * precision * recall,
+        precision + recall,
+        out=np.zeros(len(recall)),
+        where=precision + recall > 0,
+    )
+    return {
+        "recipes": int(support.sum()),
+        "accuracy": true_positives.sum() / max(support.sum(), 1),
+        "balanced_accuracy": recall.mean() if len(recall) else np.nan,
+        "macro_f1": f1.mean() if len(f1) else np.nan,
+    }
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to train a style classifier on the recipe vectors, "
+        "streaming them in chunks."
+    )
+    parser.add_argument(
+        "-v",
+        "--vectors",
+        default=VECTOR_FILE,
+        help=f"The recipe vectors. Default is {VECTOR_FILE}.",
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=RECIPE_FILE,
+        help=f"The all_recipes store with the styles. Default is {RECIPE_FILE}.",
+    )
+    parser.add_argument(
+        "--vocab",
+        default=VOCAB_FILE,
+        help=f"The vocabulary the vectors were made with. Default is {VOCAB_FILE}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=MODEL_FILE,
+        help=f"Where to write the model. Default is {MODEL_FILE}.",
+    )
+    parser.add_argument(
+        "-e",
+        "--epochs",
+        type=int,
+        default=EPOCHS,
+        help=f"Passes over the training recipes. Default is {EPOCHS}.",
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=ALPHA,
+        help=f"Regularization strength. Default is {ALPHA}.",
+    )
+    parser.add_argument(
+        "-m",
+        "--min-recipes",
+        type=int,
+        default=MIN_RECIPES,
+        help="Minimum number of recipes for a style to be a class. Default is "
+        f"{MIN_RECIPES}.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=N_JOBS,
+        help=f"Number of threads fitting the classes. Default is {N_JOBS}.",
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, default=0, help="Random seed. Default is 0."
+    )
+    add_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    clf, columns, (center, scale) = train(
+        args.vectors,
+        args.file,
+        args.epochs,
+        args.alpha,
+        args.min_recipes,
+        args.jobs,
+        args.seed,
+    )
+    scores = evaluate(clf, center, scale, args.vectors, args.file)
+    print(
+        f"Scored {scores.pop('recipes')} test recipes: "
+        + ", ".join(f"{k} {v:.3f}" for k, v in scores.items())
+    )
+    predictor = StylePredictor.from_classifier(
+        clf, columns, center, scale, load_vocab(args.vocab)
+    )
+    predictor.save(args.output)
@@ -0,0 +1,409 @@
+"""Run the data pipeline, rebuilding only what's out of date.
+
+Each stage declares the files it reads and writes:
+
+    convert     data/raw/recipes                  -> all_recipes.h5
+    index       all_recipes.h5, *map.pickle       -> all_recipes_index.pickle
+    vocab       *map.pickle                       -> vocab.pickle
+    vectors     all_recipes.h5, *map.pickle,
+                vocab.pickle                      -> recipe_vecs.h5
+    styleguide  external/styleguide-2015.json     -> processed/styleguide.json
+    style_stats all_recipes.h5                    -> style_stats.h5
+
+A stage depends on the stages that write its inputs, and independent stages
+run concurrently, each in a fresh process. The content hash of every input
+and output is recorded after a stage runs (in data/.pipeline/state.json), and
+a stage is skipped if its inputs still have the same hashes and its outputs
+haven't been changed since. Directories are hashed by the names, sizes and
+modification times of their files, so a directory of recipes isn't read in
+full every time.
+
+Some stages can be updated instead of rebuilt. When only the maps changed
+since `vectors` last ran, only the recipes affected by the changes are
+re-vectorised (see recipe2vec.update_vectors), against a copy of the maps
+from the last run.
+
+Scraping and mapping ingredient names are interactive or slow, so they're not
+stages: the raw recipes and the maps are inputs. If a stage's inputs are
+missing but its outputs exist (e.g. all_recipes.h5 was downloaded rather
+than converted), the outputs are used as they are.
+
+    python -m beerai.pipeline              # bring everything up to date
+    python -m beerai.pipeline vectors -n   # show what building vectors runs
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import pickle
+import runpy
+import shutil
+import sys
+import time
+import pandas as pd
+
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .config import BASE, DATA_DIR, INGREDIENT_CATEGORIES
+from .data.name_index import index_path
+
+RAW_DIR = os.path.join(DATA_DIR, "raw/recipes")
+RECIPE_FILE = os.path.join(DATA_DIR, "interim/all_recipes.h5")
+INDEX_FILE = index_path(RECIPE_FILE)
+MAP_FILES = [
+    os.path.join(DATA_DIR, f"interim/{category}map.pickle")
+    for category in INGREDIENT_CATEGORIES
+]
+VOCAB_FILE = os.path.join(DATA_DIR, "processed/vocab.pickle")
+VECTOR_FILE = os.path.join(DATA_DIR, "processed/recipe_vecs.h5")
+STYLEGUIDE_SOURCE = os.path.join(DATA_DIR, "external/styleguide-2015.json")
+# The only output that is committed. Rebuilding it gives the same file.
+STYLEGUIDE_FILE = os.path.join(DATA_DIR, "processed/styleguide.json")
+STYLEGUIDE_SCRIPT = os.path.join(BASE, "scripts/convert_beerstyles.py")
+STYLE_STATS_FILE = os.path.join(DATA_DIR, "processed/style_stats.h5")
+
+STATE_DIR = os.path.join(DATA_DIR, ".pipeline")
+HASH_BLOCK = 1 << 20
+N_JOBS = os.cpu_count() or 1
+# Statuses that stop the stages depending on a stage
+FAILED = {"failed", "missing", "blocked"}
+WOULD_RUN = {"would run", "would update"}
+
+# run is called with no arguments to build the outputs. If update is given, it
+# is called instead, with the directory holding copies of the
+# `incremental` inputs from the last run, when those are the only inputs that
+# changed.
+Stage = namedtuple(
+    "Stage", ["name", "inputs", "outputs", "run", "incremental", "update"]
+)
+
+
+def run_convert():
+    from .data import xml2h5
+
+    archives = sorted(glob.glob(os.path.join(RAW_DIR, "*.xmllog")))
+    if archives:
+        xml2h5.convert_archives(archives, -1)
+    else:
+        xml2h5.convert_a_bunch(None, -1)
+
+
+def run_index():
+    from .data.name_index import NameIndex
+    from .data.vocabulary import load_maps
+
+    maps = load_maps()
+    if os.path.exists(INDEX_FILE):
+        # The raw names only change with the recipes, which rewrites the index
+        index = NameIndex.load(INDEX_FILE)
+        index.remap(maps)
+    else:
+        index = NameIndex.from_store(RECIPE_FILE, maps)
+    index.save(INDEX_FILE)
+
+
+def run_vocab():
+    from .data.vocabulary import create_vocab
+
+    create_vocab(VOCAB_FILE)
+
+
+def run_vectors():
+    from .data import recipe2vec
+
+    recipe2vec.main()
+
+
+def update_vectors(snapshot_dir):
+    from .data import recipe2vec
+    from .data.vocabulary import load_maps
+
+    if recipe2vec.missing_from_vocab(load_maps()):
+        # The vector columns change, see recipe2vec.update_vectors
+        recipe2vec.main()
+        return
+
+    old_maps = {}
+    for category, path in zip(INGREDIENT_CATEGORIES, MAP_FILES):
+        with open(os.path.join(snapshot_dir, os.path.basename(path)), "rb") as f:
+            old_maps[category] = pickle.load(f)
+    recipe2vec.update_vectors(old_maps, RECIPE_FILE, VECTOR_FILE)
+
+
+def run_styleguide():
+    runpy.run_path(STYLEGUIDE_SCRIPT, run_name="__main__")
+
+
+def run_style_stats():
+    from .data import style_stats
+
+    # all_recipes is rewritten by convert, so the recipes can't be assumed to
+    # have only been added to
+    style_stats.update(RECIPE_FILE, STYLE_STATS_FILE, full=True)
+
+
+STAGES = [
+    Stage("convert", [RAW_DIR], [RECIPE_FILE], run_convert, [], None),
+    Stage("index", [RECIPE_FILE] + MAP_FILES, [INDEX_FILE], run_index, [], None),
+    Stage("vocab", MAP_FILES, [VOCAB_FILE], run_vocab, [], None),
+    Stage(
+        "vectors",
+        # update_vectors reads the name index, so it runs after index. A map
+        # edit changes the index too, which can still be updated from.
+        [RECIPE_FILE, VOCAB_FILE, INDEX_FILE] + MAP_FILES,
+        [VECTOR_FILE],
+        run_vectors,
+        MAP_FILES + [INDEX_FILE],
+        update_vectors,
+    ),
+    Stage(
+        "styleguide", [STYLEGUIDE_SOURCE], [STYLEGUIDE_FILE], run_styleguide, [], None
+    ),
+    Stage(
+        "style_stats", [RECIPE_FILE], [STYLE_STATS_FILE], run_style_stats, [], None
+    ),
+]
+
+
+def file_hash(path, cache):
+    """Return the sha256 of a file, or of the names, sizes and modification
+    times of the files in a directory. None if path doesn't exist. cache maps
+    path -> [size, mtime, hash], so unchanged files aren't read again."""
+    if os.path.isdir(path):
+        h = hashlib.sha256()
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                st = os.stat(os.path.join(dirpath, fname))
+                rel = os.path.relpath(os.path.join(dirpath, fname), path)
+                h.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+        return h.hexdigest()
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    cached = cache.get(path)
+    if cached is not None and cached[:2] == [st.st_size, st.st_mtime_ns]:
+        return cached[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    cache[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+    return h.hexdigest()
+
+
+def dependencies(stages):
+    """Return {stage name: names of the stages that write its inputs}."""
+    writers = {out: stage.name for stage in stages for out in stage.outputs}
+    return {
+        stage.name: {writers[i] for i in stage.inputs if i in writers} - {stage.name}
+        for stage in stages
+    }
+
+
+def upstream(stages, targets):
+    """Return the stages needed to build targets (stage names), in order."""
+    deps = dependencies(stages)
+    needed = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(deps[name])
+    return [stage for stage in stages if stage.name in needed]
+
+
+def load_state(state_dir=STATE_DIR):
+    try:
+        with open(os.path.join(state_dir, "state.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"stages": {}, "hashes": {}}
+
+
+def save_state(state, state_dir=STATE_DIR):
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, "state.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def plan(stage, state, force=False):
+    """Return (action, reason, input hashes) for a stage, given the current
+    state of its inputs and outputs. action is "skip", "run", "update" or
+    "missing" (it can't run)."""
+    cache = state["hashes"]
+    inputs = {path: file_hash(path, cache) for path in stage.inputs}
+    outputs = {path: file_hash(path, cache) for path in stage.outputs}
+    missing = [path for path, h in inputs.items() if h is None]
+    if missing:
+        if all(h is not None for h in outputs.values()):
+            name = os.path.basename(missing[0])
+            return "skip", f"{name} is missing, using outputs", inputs
+        return "missing", f"{missing[0]} is missing", inputs
+    if force:
+        return "run", "forced", inputs
+    last = state["stages"].get(stage.name)
+    if last is None:
+        return "run", "never run", inputs
+    if outputs != last["outputs"]:
+        return "run", "outputs changed", inputs
+    changed = [path for path in inputs if inputs[path] != last["inputs"].get(path)]
+    if not changed:
+        return "skip", "up to date", inputs
+    names = ", ".join(os.path.basename(path) for path in changed)
+    if stage.update is not None and set(changed) <= set(stage.incremental):
+        return "update", f"{names} changed", inputs
+    return "run", f"{names} changed", inputs
+
+
+def execute(func, *args):
+    """Run a stage's function and return how long it took."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def snapshot(stage, state_dir=STATE_DIR):
+    """Copy the inputs a stage can be updated from, for its next run."""
+    dest = os.path.join(state_dir, stage.name)
+    os.makedirs(dest, exist_ok=True)
+    for path in stage.incremental:
+        shutil.copy2(path, os.path.join(dest, os.path.basename(path)))
+
+
+def run(
+    stages=STAGES, targets=None, jobs=N_JOBS, force=(), dry_run=False,
+    state_dir=STATE_DIR,
+):
+    """Bring the outputs of targets (stage names, all stages if None) up to
+    date, running the stages that are out of date (and those in force).
+    Return a DataFrame of what each stage did and how long it took."""
+    if targets:
+        stages = upstream(stages, targets)
+    deps = dependencies(stages)
+    state = load_state(state_dir)
+    results = {}
+    pending = list(stages)
+    # name -> (stage, action, reason, input hashes, future)
+    running = {}
+    with ProcessPoolExecutor(max_workers=jobs, max_tasks_per_child=1) as pool:
+        while pending or running:
+            for stage in list(pending):
+                if not deps[stage.name].issubset(results):
+                    continue
+                pending.remove(stage)
+                upstream_status = {results[d]["status"] for d in deps[stage.name]}
+                if upstream_status & FAILED:
+                    results[stage.name] = {"status": "blocked", "reason": "upstream"}
+                    continue
+                action, reason, inputs = plan(stage, state, stage.name in force)
+                if dry_run and action == "skip" and upstream_status & WOULD_RUN:
+                    action, reason = "run", "upstream would run"
+                if action in ("skip", "missing"):
+                    results[stage.name] = {"status": action, "reason": reason}
+                elif dry_run:
+                    status = f"would {action}"
+                    results[stage.name] = {"status": status, "reason": reason}
+                else:
+                    print(f"Running {stage.name} ({reason}).")
+                    if action == "update":
+                        args = (stage.update, os.path.join(state_dir, stage.name))
+                    else:
+                        args = (stage.run,)
+                    future = pool.submit(execute, *args)
+                    running[stage.name] = (stage, action, reason, inputs, future)
+            if not running:
+                continue
+            futures = [r[-1] for r in running.values()]
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for name, (stage, action, reason, inputs, future) in list(running.items()):
+                if future not in done:
+                    continue
+                del running[name]
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    print(f"{name} failed: {e!r}", file=sys.stderr)
+                    results[name] = {"status": "failed", "reason": repr(e)}
+                    continue
+                # The inputs as they were when the stage started, so changes
+                # made while it ran are picked up next time
+                state["stages"][name] = {
+                    "inputs": inputs,
+                    "outputs": {
+                        path: file_hash(path, state["hashes"]) for path in stage.outputs
+                    },
+                    "mode": action,
+                    "seconds": seconds,
+                    "finished": time.time(),
+                }
+                if stage.incremental:
+                    snapshot(stage, state_dir)
+                save_state(state, state_dir)
+                status = "updated" if action == "update" else "ran"
+                results[name] = {"status": status, "reason": reason, "seconds": seconds}
+                print(f"Finished {name} in {seconds:.1f}s.")
+    df = pd.DataFrame.from_dict(results, orient="index").reindex(
+        [stage.name for stage in stages]
+    )
+    df.index.name = "stage"
+    return df
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to bring the outputs of the data pipeline up to "
+        "date, only running the stages whose inputs changed."
+    )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="Stages to bring up to date, along with what they depend on. "
+        "Default is all of them.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=N_JOBS,
+        help=f"Number of stages to run at once. Default is {N_JOBS}.",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="append",
+        default=[],
+        metavar="STAGE",
+        help="Run a stage even if it's up to date. Can pass argument multiple "
+        "times.",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Only print what would run.",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+    names = [stage.name for stage in STAGES]
+    for name in args.targets + args.force:
+        if name not in names:
+            parser.error(f"Unknown stage {name}, choose from {', '.join(names)}")
+
+    summary = run(
+        targets=args.targets, jobs=args.jobs, force=args.force, dry_run=args.dry_run
+    )
+    print(summary.fillna("").to_string())
+    if summary["status"].isin(FAILED).any():
+        sys.exit(1)
@@ -0,0 +1,554 @@
+"""An HTTP service answering questions about recipes from data held in memory.
+
+The maps, vocabulary, style guide and recipe vectors are loaded once at
+startup. The endpoints take a JSON body {"recipes": [recipe, ...]}, where a
+recipe looks like
+
+    {
+        "batch_size": 20.0,
+        "boil_size": 25.0,
+        "boil_time": 60,
+        "efficiency": 0.75,
+        "ferm": [
+            {"name": "pale malt", "amount": 4.5, "yield": 0.8, "color": 3,
+             "type": "grain"}
+        ],
+        "hop": [
+            {"name": "cascade", "amount": 0.03, "alpha": 0.07, "form": "pellet",
+             "use": "boil", "time": 60}
+        ],
+        "yeast": [{"name": "us-05", "attenuation": 75}],
+        "misc": []
+    }
+
+in the units of all_recipes.h5 (see beerai/data/schema.py), and answer
+{"results": [result, ...]}, with a result per recipe:
+
+    POST /properties    {"og", "fg", "ibu", "srm", "abv"}, see beerai.utils
+    POST /styles        {"styles": [...]}, the k styles (default 3) of the
+                        style guide whose ranges are closest to the
+                        recipe's properties
+    POST /similar       {"similar": [...], "unknown": [...]}, the ids of the
+                        k recipes (default 10) whose vectors are closest to
+                        the recipe's, and the ingredients that aren't in the
+                        maps or vocabulary
+
+GET /metrics returns latency histograms per endpoint and batch sizes per
+operation.
+
+Recipes of requests that arrive at about the same time are handled in one
+batch (see Batcher), so the pandas code runs once per batch rather than once
+per request.
+
+    python -m beerai.service --port 8080
+
+scripts/load_test_service.py load tests the service.
+"""
+
+import argparse
+import asyncio
+import bisect
+import math
+import numpy as np
+import pandas as pd
+import time
+
+from aiohttp import web
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+
+from .config import INGREDIENT_CATEGORIES
+from .data.recipe2vec import (
+    CORE_COLS,
+    VECTOR_FILE,
+    finalize_names,
+    load_vocab,
+    recipes2vec,
+    scale_quantities,
+)
+from .data.store import widen
+from .data.vocabulary import load_maps
+from .utils import PROPERTIES, get_style_guide, recipe_properties, style_ranges
+
+# The fields of the ingredients of a request, without the category prefix
+ING_FIELDS = {
+    "ferm": ["name", "amount", "yield", "color", "type"],
+    "hop": ["name", "amount", "alpha", "form", "use", "time"],
+    "yeast": ["name", "attenuation"],
+    "misc": ["name", "amount", "use"],
+}
+STRING_FIELDS = {"name", "type", "form", "use"}
+OPERATIONS = ["properties", "styles", "similar"]
+DEFAULT_K = {"styles": 3, "similar": 10}
+MAX_K = 100
+MAX_RECIPES = 1000
+# Recipes per batch, and how long the first request of a batch waits for more
+MAX_BATCH = 256
+MAX_WAIT = 0.005
+# Upper bounds of the latency buckets in seconds, 1ms to 16s
+LATENCY_BUCKETS = [0.001 * 2 ** (i / 2) for i in range(29)]
+BATCH_BUCKETS = [2**i for i in range(11)]
+VECTOR_CHUNK = 10000
+# Maximum size of the (queries, recipes) similarity array computed at once
+SCORE_ELEMENTS = 1 << 24
+
+
+def _value(value, field):
+    if value is None:
+        return None
+    if field in STRING_FIELDS:
+        if not isinstance(value, str):
+            raise ValueError(f"{field} must be a string.")
+        return value.strip().lower()
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{field} must be a number.")
+    return float(value)
+
+
+def parse_recipe(recipe):
+    """Check a recipe of a request and return it as (core fields,
+    {category: [ingredient]}), with the fields of the ingredients prefixed by
+    their category like the columns of all_recipes.h5. Raise ValueError if
+    it's malformed."""
+    if not isinstance(recipe, dict):
+        raise ValueError("A recipe must be a JSON object.")
+    unknown = set(recipe).difference(CORE_COLS + INGREDIENT_CATEGORIES)
+    if unknown:
+        raise ValueError(f"Unknown recipe fields {sorted(unknown)}.")
+    core = {col: _value(recipe.get(col), col) for col in CORE_COLS}
+    ings = {}
+    for category in INGREDIENT_CATEGORIES:
+        items = recipe.get(category, [])
+        if not isinstance(items, list):
+            raise ValueError(f"{category} must be a list of ingredients.")
+        fields = ING_FIELDS[category]
+        rows = []
+        for item in items:
+            if not isinstance(item, dict):
+                raise ValueError("An ingredient must be a JSON object.")
+            unknown = set(item).difference(fields)
+            if unknown:
+                raise ValueError(f"Unknown {category} fields {sorted(unknown)}.")
+            rows.append({f"{category}_{f}": _value(item.get(f), f) for f in fields})
+        ings[category] = rows
+    return core, ings
+
+
+def parse_recipes(body):
+    """Return the parsed recipes of a request body (see parse_recipe)."""
+    if not isinstance(body, dict) or not isinstance(body.get("recipes"), list):
+        raise ValueError('Expected a JSON object with a "recipes" list.')
+    recipes = body["recipes"]
+    if not 0 < len(recipes) <= MAX_RECIPES:
+        raise ValueError(f"Expected 1 to {MAX_RECIPES} recipes.")
+    return [parse_recipe(recipe) for recipe in recipes]
+
+
+def to_frame(recipes):
+    """Lay out parsed recipes like `prepare` joins them: the core fields joined
+    with the ingredients in the wide layout (see store.widen), indexed by the
+    position of the recipe in the list."""
+    core = pd.DataFrame([c for c, _ in recipes], columns=CORE_COLS, dtype=float)
+    frames = {}
+    for category in INGREDIENT_CATEGORIES:
+        columns = [f"{category}_{f}" for f in ING_FIELDS[category]]
+        rows = [row for _, ings in recipes for row in ings[category]]
+        ids = [i for i, (_, ings) in enumerate(recipes) for _ in ings[category]]
+        df = pd.DataFrame(rows, index=pd.Index(ids, dtype=int), columns=columns)
+        for field, col in zip(ING_FIELDS[category], columns):
+            if field not in STRING_FIELDS:
+                df[col] = df[col].astype(float)
+        frames[category] = df
+    columns = [col for df in frames.values() for col in df.columns]
+    return core.join(widen(frames, columns))
+
+
+def unit_rows(vecs, columns):
+    """Return recipe vectors (a DataFrame like recipes2vec returns) as a sparse
+    matrix over the ingredient columns (so without the boil time), with each
+    row scaled to unit length."""
+    matrix = sparse.csr_matrix(
+        vecs.reindex(columns=columns, fill_value=0).to_numpy(np.float32)
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1))).ravel()
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+
+def _json_float(value):
+    return None if pd.isna(value) else float(value)
+
+
+class RecipeService:
+    """The data the service answers from and an operation per endpoint. The
+    operations take a list of parsed recipes (see parse_recipes) and return a
+    list of results, one per recipe, ready to be sent as JSON. styles and
+    similar return MAX_K styles/recipes, for the endpoints to cut down."""
+
+    def __init__(self, maps, vocab, style_guide, ids, vectors):
+        """ids and vectors are the ids and unit vectors (see unit_rows) of the
+        recipes to search for similar recipes."""
+        self.maps = maps
+        self.vocab = vocab
+        self.columns = sorted(vocab.values())
+        self.style_ids, self.style_names, self.low, self.high = style_ranges(
+            style_guide
+        )
+        self.ids = np.asarray(ids)
+        self.vectors = vectors
+
+    @classmethod
+    def load(cls, vector_path=VECTOR_FILE):
+        """Load the maps, vocabulary, style guide and recipe vectors from the
+        data directory."""
+        vocab = load_vocab()
+        columns = sorted(vocab.values())
+        ids, parts = [], []
+        with pd.HDFStore(vector_path, "r") as store:
+            for vecs in store.select("/vecs", chunksize=VECTOR_CHUNK):
+                ids.append(vecs.index.to_numpy())
+                parts.append(unit_rows(vecs, columns))
+        if parts:
+            ids, vectors = np.concatenate(ids), sparse.vstack(parts).tocsr()
+        else:
+            ids, vectors = np.array([], dtype=int), sparse.csr_matrix((0, len(columns)))
+        return cls(load_maps(), vocab, get_style_guide(), ids, vectors)
+
+    def properties(self, recipes):
+        props = recipe_properties(to_frame(recipes))
+        props = props[PROPERTIES].reindex(range(len(recipes)))
+        return [
+            {prop: _json_float(value) for prop, value in row.items()}
+            for row in props.to_dict("records")
+        ]
+
+    def styles(self, recipes):
+        props = recipe_properties(to_frame(recipes))
+        props = props[PROPERTIES].reindex(range(len(recipes)))
+        values = props.to_numpy()[:, None, :]
+        width = self.high - self.low
+        width[width == 0] = 1
+        # How far each property is outside the range of each style, in widths
+        # of the range: (recipes, styles, properties)
+        outside = np.maximum(
+            np.maximum(self.low - values, values - self.high) / width, 0
+        )
+        known = ~np.isnan(outside)
+        counts = known.sum(axis=2)
+        distance = np.where(known, outside, 0).sum(axis=2) / np.maximum(counts, 1)
+        distance[counts == 0] = np.inf
+        order = np.argsort(distance, axis=1, kind="stable")[:, :MAX_K]
+        results = []
+        for i, styles in enumerate(order):
+            results.append(
+                {
+                    "styles": [
+                        {
+                            "id": self.style_ids[s],
+                            "name": self.style_names[s],
+                            "distance": _json_float(distance[i, s]),
+                            "in_range": [
+                                prop
+                                for prop, d in zip(PROPERTIES, outside[i, s])
+                                if d == 0
+                            ],
+                        }
+                        for s in styles
+                        if np.isfinite(distance[i, s])
+                    ]
+                }
+            )
+        return results
+
+    def vectorize(self, recipes):
+        """Return the unit vectors (see unit_rows) of recipes, and the names of
+        their ingredients that aren't in the maps or the vocabulary, per
+        recipe."""
+        df = to_frame(recipes)
+        unknown = [set() for _ in recipes]
+        for category in INGREDIENT_CATEGORIES:
+            col = f"{category}_name"
+            names = df[col]
+            mapped = names.map(self.maps[category])
+            for i, name in names[names.notna() & mapped.isna()].items():
+                unknown[i].add(name)
+            df[col] = mapped
+        df = finalize_names(scale_quantities(df))
+        for category in INGREDIENT_CATEGORIES:
+            col = f"{category}_name"
+            names = df[col]
+            missing = names.notna() & ~names.isin(self.vocab)
+            for i, name in names[missing].items():
+                unknown[i].add(name)
+            df[col] = names.where(~missing)
+        df["recipe_id"] = df.index
+        vecs = recipes2vec(df, self.vocab)
+        vecs = vecs.reindex(range(len(recipes)), fill_value=0)
+        return unit_rows(vecs, self.columns), [sorted(names) for names in unknown]
+
+    def similar(self, recipes):
+        queries, unknown = self.vectorize(recipes)
+        n_vectors = self.vectors.shape[0]
+        k = min(MAX_K, n_vectors)
+        step = max(1, SCORE_ELEMENTS // max(n_vectors, 1))
+        results = []
+        for start in range(0, len(recipes), step):
+            # Sparse recipes times dense queries gives dense scores directly
+            block = queries[start : start + step].toarray().T
+            scores = np.asarray(self.vectors @ block).T
+            if k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.empty((len(scores), 0), dtype=int)
+            for row, idx in zip(scores, top):
+                idx = idx[np.argsort(-row[idx], kind="stable")]
+                results.append(
+                    [
+                        {"id": int(self.ids[j]), "similarity": float(row[j])}
+                        for j in idx
+                        if row[j] > 0
+                    ]
+                )
+        return [
+            {"similar": similar, "unknown": names}
+            for similar, names in zip(results, unknown)
+        ]
+
+
+class Histogram:
+    """Counts of values (e.g. latencies) per bucket, given by the upper bound
+    of each bucket. Values above the last bound fall in an extra bucket."""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding the q-quantile (inf if
+        it's above the last bound), or None if nothing was observed."""
+        if not self.count:
+            return None
+        seen = 0
+        for bound, n in zip(self.bounds + [math.inf], self.counts):
+            seen += n
+            if seen >= q * self.count:
+                return bound
+
+    def to_dict(self):
+        """Return the histogram with cumulative counts per upper bound (None for
+        the last bucket), like Prometheus, and the p50/p90/p99."""
+        cumulative = np.cumsum(self.counts).tolist()
+        bounds = self.bounds + [None]
+        stats = {"count": self.count, "sum": self.total}
+        for q in [0.5, 0.9, 0.99]:
+            value = self.quantile(q)
+            stats[f"p{round(q * 100)}"] = None if value == math.inf else value
+        stats["buckets"] = [[b, c] for b, c in zip(bounds, cumulative)]
+        return stats
+
+
+class Batcher:
+    """Runs func on batches of the items of concurrent requests. func takes a
+    list of items and returns a list of results, one per item, and runs in
+    executor so the event loop keeps taking requests. A batch starts max_wait
+    seconds after its first request arrived or once it holds max_size items,
+    and only after the previous batch finished, so batches grow with the
+    load."""
+
+    def __init__(self, func, executor, max_size=MAX_BATCH, max_wait=MAX_WAIT):
+        self.func = func
+        self.executor = executor
+        self.max_size = max_size
+        self.max_wait = max_wait
+        # [(items, future)]
+        self.pending = []
+        self.size = 0
+        self.busy = False
+        self.timer = None
+        self.tasks = set()
+        self.batch_sizes = Histogram(BATCH_BUCKETS)
+
+    async def submit(self, items):
+        """Return the results of func for items."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((items, future))
+        self.size += len(items)
+        if self.size >= self.max_size:
+            self.flush()
+        elif self.timer is None and not self.busy:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        """Start a batch of the pending requests, unless one is running."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.busy or not self.pending:
+            return
+        size = 0
+        for n, (items, _) in enumerate(self.pending):
+            if size and size + len(items) > self.max_size:
+                break
+            size += len(items)
+        else:
+            n = len(self.pending)
+        batch, self.pending = self.pending[:n], self.pending[n:]
+        self.size -= size
+        self.busy = True
+        task = asyncio.ensure_future(self._run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch):
+        items = [item for items, _ in batch for item in items]
+        self.batch_sizes.observe(len(items))
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.func, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            start = 0
+            for items, future in batch:
+                # The request may have been cancelled
+                if not future.done():
+                    future.set_result(results[start : start + len(items)])
+                start += len(items)
+        finally:
+            self.busy = False
+            # Requests that arrived meanwhile have waited long enough
+            self.flush()
+
+
+SERVICE = web.AppKey("service", RecipeService)
+BATCHERS = web.AppKey("batchers", dict)
+LATENCIES = web.AppKey("latencies", dict)
+
+
+@web.middleware
+async def record_latency(request, handler):
+    start = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        resource = request.match_info.route.resource
+        name = resource.canonical if resource is not None else "unmatched"
+        latencies = request.app[LATENCIES]
+        if name not in latencies:
+            latencies[name] = Histogram(LATENCY_BUCKETS)
+        latencies[name].observe(time.perf_counter() - start)
+
+
+def _handler(operation):
+    async def handle(request):
+        try:
+            body = await request.json()
+            recipes = parse_recipes(body)
+            k = body.get("k", DEFAULT_K.get(operation))
+            if k is not None and (
+                isinstance(k, bool) or not isinstance(k, int) or not 0 < k <= MAX_K
+            ):
+                raise ValueError(f"k must be an integer from 1 to {MAX_K}.")
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        results = await request.app[BATCHERS][operation].submit(recipes)
+        if operation == "styles":
+            results = [{"styles": r["styles"][:k]} for r in results]
+        elif operation == "similar":
+            results = [{**r, "similar": r["similar"][:k]} for r in results]
+        return web.json_response({"results": results})
+
+    return handle
+
+
+async def metrics(request):
+    return web.json_response(
+        {
+            "latency": {
+                name: hist.to_dict() for name, hist in request.app[LATENCIES].items()
+            },
+            "batch_size": {
+                name: batcher.batch_sizes.to_dict()
+                for name, batcher in request.app[BATCHERS].items()
+            },
+        }
+    )
+
+
+async def health(request):
+    return web.json_response({"recipes": len(request.app[SERVICE].ids)})
+
+
+def make_app(service, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+    """Return the aiohttp app serving a RecipeService."""
+    app = web.Application(middlewares=[record_latency])
+    # The operations are mostly pandas code holding the GIL, so one thread
+    # runs them all
+    executor = ThreadPoolExecutor(max_workers=1)
+    app[SERVICE] = service
+    app[BATCHERS] = {
+        operation: Batcher(getattr(service, operation), executor, max_batch, max_wait)
+        for operation in OPERATIONS
+    }
+    app[LATENCIES] = {}
+    for operation in OPERATIONS:
+        app.router.add_post(f"/{operation}", _handler(operation))
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/health", health)
+
+    async def shutdown(app):
+        executor.shutdown()
+
+    app.on_cleanup.append(shutdown)
+    return app
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to serve recipe properties, style matches and "
+        "similar recipes over HTTP."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Default is 127.0.0.1.")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="Default is 8080.")
+    parser.add_argument(
+        "-v",
+        "--vectors",
+        default=VECTOR_FILE,
+        help="Recipe vectors to search for similar recipes. Default is "
+        f"{VECTOR_FILE}.",
+    )
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=MAX_BATCH,
+        help=f"Maximum recipes per batch. Default is {MAX_BATCH}.",
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=MAX_WAIT * 1000,
+        help="Milliseconds a request waits for others to batch with. Default is "
+        f"{MAX_WAIT * 1000:g}.",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+
+    service = RecipeService.load(args.vectors)
+    print(f"Loaded {len(service.ids)} recipe vectors.")
+    app = make_app(service, args.max_batch, args.max_wait / 1000)
+    web.run_app(app, host=args.host, port=args.port)
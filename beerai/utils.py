@@ -5,6 +5,10 @@ import pandas as pd
 
 from .config import DATA_DIR
 
+# The properties recipe_properties computes, which the style guide has ranges
+# for
+PROPERTIES = ["og", "fg", "ibu", "srm", "abv"]
+
 
 def get_style_guide():
     fname = os.path.join(DATA_DIR, "processed/styleguide.json")
@@ -12,6 +16,22 @@ def get_style_guide():
         return json.load(f)
 
 
+def style_ranges(style_guide):
+    """Return the ids and names of the styles in the style guide, and arrays
+    (styles, PROPERTIES) of the low and high ends of their ranges. Styles
+    without ranges (those that vary by base style) are left out."""
+    ids, names, low, high = [], [], [], []
+    for style_id, style in style_guide.items():
+        stats = style.get("stats", {})
+        if not all(prop in stats for prop in PROPERTIES):
+            continue
+        ids.append(style_id)
+        names.append(style["name"])
+        low.append([float(stats[prop]["low"]) for prop in PROPERTIES])
+        high.append([float(stats[prop]["high"]) for prop in PROPERTIES])
+    return ids, names, np.array(low), np.array(high)
+
+
 def split_series_on_range(series, min_value, max_value, return_mask=False):
     """
     Split a Series by whether its values are inside or outside a range.
@@ -124,7 +144,7 @@ def scale_hop(df, scale_volume_dry="batch_size", scale_volume_boil="batch_size")
     )
     # Set to numerical index for appending to keep order
     boil_scaled.index = bh_inds
-    scaled = dry_scaled.append(boil_scaled).sort_index()
+    scaled = pd.concat([dry_scaled, boil_scaled]).sort_index()
     # Reset to original index
     scaled.index = df.index
     scaled = scaled.replace([np.inf, -np.inf], np.nan)
@@ -148,7 +168,8 @@ def scale_misc(df, scale_volume="batch_size"):
     Return:
     =======
     Series representing the scaled miscellaneous ingredients in units of kg/L
-    in the batch kettle.
+    in the batch kettle. Miscs given as a count (e.g. tablets) are scaled by
+    their BeerXML amount, which is in kg or L; the count is in "misc_count".
     """
     misc_scaled = df["misc_amount"] / df[scale_volume]
     misc_scaled = misc_scaled.replace([np.inf, -np.inf], np.nan)
@@ -419,3 +440,36 @@ def abv(df, ferm_col="ferm_scaled", og_col="og", fg_col="fg"):
         fg = df[fg_col]
 
     return ((1.05 * (og - fg)) / fg) / 0.79 * 100.0
+
+
+def recipe_properties(df, utilization_factor=4.15):
+    """
+    Compute the properties of recipes: original and final gravity,
+    bitterness, colour and alcohol content.
+
+    Parameters
+    ==========
+    df: DataFrame
+        The core and ingredient columns of recipes, joined in the wide layout
+        (one row per k-th ingredient of each category). See the property
+        functions above for the columns they need.
+    utilization_factor: float, default 4.15
+        Passed to `ibu()`.
+
+    Return
+    ======
+    DataFrame with the columns "og", "fg", "ibu", "srm" and "abv", indexed by
+    recipe. Recipes without hops have an IBU of 0.
+    """
+    df = df.copy()
+    df["hop_scaled"] = scale_hop(df)
+    df["ferm_scaled"] = scale_ferm(df)
+    # The kettle gravity has to be computed over all the fermentables, before
+    # ibu() drops the rows with dry hops
+    df["pbg"] = df.index.map(gravity_kettle(df))
+    props = pd.DataFrame({"og": gravity_original(df), "fg": gravity_final(df)})
+    props["ibu"] = ibu(df, utilization_factor=utilization_factor)
+    props["ibu"] = props["ibu"].fillna(0)
+    props["srm"] = srm(df)
+    props["abv"] = abv(props)
+    return props
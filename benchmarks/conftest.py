@@ -0,0 +1,201 @@
+"""Fixtures for the benchmarks: synthetic recipes (see beerai.data.synthetic)
+at the sizes given by --bench-sizes, in the layouts each stage takes.
+
+Runs are saved to and compared against benchmarks/baselines (see the README).
+Only a reference run of the 1k corpus is committed, since timings depend on
+the machine; --bench-check compares a run against the latest saved run and fails on a
+regression of more than REGRESSION_THRESHOLD."""
+
+import glob
+import numpy as np
+import os
+import pytest
+
+from pytest_benchmark.utils import parse_compare_fail
+
+from beerai.config import INGREDIENT_CATEGORIES
+from beerai.data.recipe2vec import (
+    ING_COLS,
+    apply_map,
+    finalize_names,
+    recipes2vec,
+    scale_quantities,
+)
+from beerai.data.store import widen
+from beerai.data.synthetic import (
+    N_VARIANTS,
+    CorpusModel,
+    fit_model,
+    iter_beerxml,
+    make_recipes,
+    make_vocab,
+    recipes_for_rows,
+    write_corpus,
+)
+
+# Number of ingredient rows
+SIZES = {"1k": 1000, "100k": 100000, "1M": 1000000}
+DEFAULT_SIZES = "1k"
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+DEFAULT_STORAGE = "file://./.benchmarks"
+# The fastest round is the least affected by other load on the machine
+REGRESSION_THRESHOLD = "min:30%"
+# Rounds for the benchmarks that need a fresh copy of their input each round
+ROUNDS = 5
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--bench-sizes",
+        default=DEFAULT_SIZES,
+        help="Comma separated sizes (ingredient rows) to benchmark, from "
+        f"{', '.join(SIZES)}. Default is {DEFAULT_SIZES}.",
+    )
+    parser.addoption(
+        "--bench-fit",
+        action="store_true",
+        help="Draw the recipes from distributions fitted to the data in the "
+        "data directory (see beerai.data.synthetic.fit_model).",
+    )
+    parser.addoption(
+        "--bench-check",
+        action="store_true",
+        help="Compare against the latest saved run and fail if a benchmark "
+        f"regressed by more than {REGRESSION_THRESHOLD} (statistic:change).",
+    )
+
+
+def pytest_configure(config):
+    if config.getoption("benchmark_storage") == DEFAULT_STORAGE:
+        config.option.benchmark_storage = "file://" + BASELINE_DIR
+    if config.getoption("bench_check"):
+        storage = config.getoption("benchmark_storage")
+        runs = glob.glob(os.path.join(BASELINE_DIR, "*", "*.json"))
+        if storage == "file://" + BASELINE_DIR and not runs:
+            raise pytest.UsageError(
+                f"No saved runs in {BASELINE_DIR} to compare against. Baselines "
+                "are per machine and only a reference run is committed: save one with "
+                "--benchmark-save=baseline on the commit to compare to."
+            )
+        config.option.benchmark_compare = True
+        config.option.benchmark_compare_fail = [
+            parse_compare_fail(REGRESSION_THRESHOLD)
+        ]
+
+
+def pytest_generate_tests(metafunc):
+    if "n_rows" in metafunc.fixturenames:
+        sizes = metafunc.config.getoption("bench_sizes").split(",")
+        unknown = set(sizes).difference(SIZES)
+        if unknown:
+            raise pytest.UsageError(f"Unknown benchmark sizes {sorted(unknown)}")
+        metafunc.parametrize("n_rows", sizes, indirect=True, scope="session")
+
+
+def n_variants(n_rows):
+    """Number of raw names per standard name. Bigger datasets have more
+    spellings of each ingredient, like the real data."""
+    return N_VARIANTS * max(n_rows // 1000, 1)
+
+
+@pytest.fixture(scope="session")
+def n_rows(request):
+    """Number of ingredient rows to benchmark with."""
+    return SIZES[request.param]
+
+
+@pytest.fixture(scope="session")
+def model(request, n_rows):
+    if request.config.getoption("bench_fit"):
+        return fit_model()
+    return CorpusModel.default(n_variants(n_rows))
+
+
+@pytest.fixture(scope="session")
+def recipes(n_rows, model):
+    """(core, {category: DataFrame}) with about n_rows ingredients."""
+    return make_recipes(
+        recipes_for_rows(n_rows, model), np.random.default_rng(0), model=model
+    )
+
+
+@pytest.fixture(scope="session")
+def store_path(tmp_path_factory, n_rows, model):
+    """An HDF recipe store of about n_rows ingredients, like xml2h5 writes."""
+    path = str(tmp_path_factory.mktemp("store") / "all_recipes.h5")
+    write_corpus(recipes_for_rows(n_rows, model), path, model=model, jobs=1)
+    return path
+
+
+@pytest.fixture(scope="session")
+def maps(model):
+    return model.standard
+
+
+@pytest.fixture(scope="session")
+def vocab(maps):
+    return make_vocab(maps)
+
+
+@pytest.fixture(scope="session")
+def xml_docs(recipes, model):
+    """[(recipe id, BeerXML bytes)]"""
+    return list(iter_beerxml(*recipes, model=model))
+
+
+@pytest.fixture(scope="session")
+def wide(recipes):
+    """Core and ingredients joined in the legacy wide layout, with the names
+    as strings, like `prepare` has them before apply_map."""
+    core, ings = recipes
+    columns = ING_COLS + ["ferm_type", "ferm_color", "yeast_attenuation"]
+    df = core.join(widen(ings, columns))
+    for category in INGREDIENT_CATEGORIES:
+        df[f"{category}_name"] = df[f"{category}_name"].astype(object)
+    return df
+
+
+@pytest.fixture(scope="session")
+def vectors(prepared, vocab):
+    """The recipe vectors of prepared."""
+    return recipes2vec(prepared.copy(), vocab)
+
+
+@pytest.fixture(scope="session")
+def mapped(wide, maps):
+    return apply_map(wide.copy(), maps)
+
+
+@pytest.fixture(scope="session")
+def prepared(mapped):
+    """Recipes ready for recipes2vec, like `prepare` returns them."""
+    df = finalize_names(scale_quantities(mapped.copy()))
+    df["recipe_id"] = df.index
+    return df
+
+
+@pytest.fixture
+def benchmark_copy(benchmark):
+    """Like benchmark, for functions that modify the DataFrame they're given:
+    benchmark_copy(func, df, ...) times func on a fresh copy of df each
+    round, without timing the copy."""
+
+    def run(func, df, *args, **kwargs):
+        return benchmark.pedantic(
+            func, setup=lambda: ((df.copy(), *args), kwargs), rounds=ROUNDS
+        )
+
+    return run
+
+
+@pytest.fixture
+def record_rate(benchmark):
+    """record_rate(n) adds the recipes per second of the fastest round (for n
+    recipes) to the benchmark's extra_info. Does nothing when benchmarks are
+    disabled (--benchmark-disable), since there are no timings then."""
+
+    def record(n):
+        if benchmark.stats is not None:
+            benchmark.extra_info["recipes_per_s"] = n / benchmark.stats["min"]
+
+    return record
@@ -0,0 +1,67 @@
+import os
+import pytest
+
+from beerai.data.archive import HEADER, ArchiveWriter, read_archive
+
+RECIPES = [(f"{i}.xml", f"<RECIPE>{i}</RECIPE>".encode()) for i in range(3)]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """Path of an archive of RECIPES, and the offset of each record."""
+    path = str(tmp_path / "test.xmllog")
+    offsets = []
+    with ArchiveWriter(path) as writer:
+        for name, content in RECIPES:
+            writer.f.flush()
+            offsets.append(writer.f.tell())
+            writer.write(name, content)
+    return path, offsets
+
+
+def damage(path, offset, data):
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def test_read_archive(archive):
+    path, _ = archive
+    assert list(read_archive(path)) == RECIPES
+
+
+@pytest.mark.parametrize("cut", ["header", "data", "checksum"])
+def test_drop_truncated_last_record(archive, capsys, cut):
+    path, offsets = archive
+    size = os.path.getsize(path)
+    if cut == "header":
+        os.truncate(path, offsets[-1] + HEADER.size - 1)
+    elif cut == "data":
+        os.truncate(path, size - 1)
+    else:
+        # The data wasn't written before the crash
+        damage(path, size - 1, b"\0")
+    dropped = os.path.getsize(path) - offsets[-1]
+    with ArchiveWriter(path) as writer:
+        assert "2.xml" not in writer
+        assert f"({dropped} bytes)" in capsys.readouterr().err
+        writer.write(*RECIPES[-1])
+    assert list(read_archive(path)) == RECIPES
+
+
+def test_raise_on_corrupt_record(archive):
+    path, offsets = archive
+    size = os.path.getsize(path)
+    # Damaged magic number: neither appending nor reading loses the last record
+    damage(path, offsets[1], b"XXXX")
+    with pytest.raises(ValueError, match=f"at {offsets[1]} "):
+        ArchiveWriter(path)
+    with pytest.raises(ValueError, match=f"at {offsets[1]} "):
+        list(read_archive(path))
+    assert os.path.getsize(path) == size
+
+    # Damaged data in a record that isn't the last
+    damage(path, offsets[1], b"BXML")
+    damage(path, offsets[2] - 1, b"\0")
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        list(read_archive(path))
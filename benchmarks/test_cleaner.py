@@ -0,0 +1,39 @@
+import importlib.util
+import os
+import pytest
+
+from beerai.config import BASE
+
+SCRIPT = os.path.join(BASE, "scripts/clean_ingredient_names.py")
+
+
+@pytest.fixture(scope="module")
+def cleaner_module():
+    spec = importlib.util.spec_from_file_location("clean_ingredient_names", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize("category", ["ferm", "hop"])
+def test_match(benchmark, cleaner_module, recipes, maps, category):
+    """Find the next target and the names similar to it, the step the
+    cleaner runs before asking about each name."""
+    core, ings = recipes
+    cleaner = cleaner_module.Cleaner()
+    cleaner.category = category
+    cleaner.hdf_col = f"{category}_name"
+    cleaner.df = ings[category][[cleaner.hdf_col]].astype(object)
+    # Only the standard spellings have been mapped so far
+    cleaner.ingred_map = {v: v for v in set(maps[category].values())}
+
+    def match():
+        cleaner.set_cur_ingred_target()
+        cleaner.set_ingred_names_to_compare()
+        return cleaner.ingred_names_to_compare
+
+    names = benchmark(match)
+    # The target (the most common name left) matches itself, and none of the
+    # names have been mapped yet
+    assert cleaner.cur_ingred_target in names
+    assert not set(names).intersection(cleaner.ingred_map)
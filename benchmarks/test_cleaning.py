@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from beerai.cleaning import (
+    CleaningStats,
+    clean_efficiency,
+    clean_ferm_yield,
+    write_cleaned,
+)
+from beerai.data.store import copy_store, open_store, select_category
+
+
+def test_clean_ferm_yield(benchmark, recipes):
+    core, ings = recipes
+    ferm = ings["ferm"]
+    ferm_yield = benchmark(clean_ferm_yield, ferm)
+    assert len(ferm_yield) == len(ferm)
+    bad = ferm["ferm_yield"] < 0.03
+    assert bad.any()
+    means = ferm[~bad].groupby("ferm_type", observed=True)["ferm_yield"].mean()
+    expected = ferm.loc[bad, "ferm_type"].astype(object).map(means).to_numpy()
+    np.testing.assert_allclose(ferm_yield[bad.to_numpy()].to_numpy(), expected)
+    assert (ferm_yield[~bad.to_numpy()] == ferm.loc[~bad, "ferm_yield"]).all()
+
+
+def test_clean_efficiency(benchmark, recipes):
+    core, ings = recipes
+    efficiency = benchmark(clean_efficiency, core["efficiency"])
+    assert efficiency.between(0.5, 1).all()
+
+
+def test_cleaning_stats(benchmark, recipes):
+    core, ings = recipes
+
+    def run():
+        stats = CleaningStats().update(core, ings["ferm"])
+        return stats.clean(core, ings["ferm"])
+
+    cleaned_core, cleaned_ferm = benchmark(run)
+    assert len(cleaned_ferm) == len(ings["ferm"])
+    assert cleaned_ferm["ferm_yield"].between(0.03, 1).all()
+
+
+@pytest.mark.parametrize("with_type", [True, False], ids=["ferm_type", "legacy"])
+def test_write_cleaned(benchmark, store_path, tmp_path, with_type):
+    """Clean a store written by xml2h5 (or, for legacy, one written before
+    ferm_type was kept), with the statistics of all of its recipes."""
+    path = store_path
+    if not with_type:
+        path = str(tmp_path / "legacy.h5")
+        copy_store(
+            store_path,
+            path,
+            lambda table, df: df.drop(columns="ferm_type", errors="ignore"),
+        )
+    out_path = str(tmp_path / "clean.h5")
+    stats = benchmark.pedantic(write_cleaned, args=(path, out_path), rounds=1)
+
+    with open_store(path) as store, open_store(out_path) as out:
+        assert ("ferm_type" in store.columns("ferm")) == with_type
+        ferm = select_category(store, "ferm")
+        cleaned = select_category(out, "ferm")["ferm_yield"].to_numpy()
+        efficiency = out.select("core", columns=["efficiency"])["efficiency"]
+    bad = (ferm["ferm_yield"] < 0.03).to_numpy()
+    assert bad.any()
+    # Every bad yield gets a mean, none are left missing
+    assert np.isfinite(cleaned).all()
+    np.testing.assert_array_equal(cleaned[~bad], ferm["ferm_yield"].to_numpy()[~bad])
+    if with_type:
+        expected = ferm["ferm_type"].astype(object)[bad].map(stats.ferm_type_to_yield)
+    else:
+        expected = np.full(bad.sum(), stats.mean_yield)
+    np.testing.assert_allclose(cleaned[bad], expected, rtol=1e-6)
+    assert efficiency.between(0.5, 1).all()
@@ -0,0 +1,27 @@
+import numpy as np
+
+from beerai.data.dedup import (
+    PRIME,
+    band_keys,
+    hash_params,
+    recipe_tokens,
+    signatures,
+)
+
+
+def test_signatures(benchmark, record_rate, vectors, vocab):
+    columns = sorted(vocab.values())
+    a, b, band_multipliers = hash_params()
+
+    def run():
+        tokens = recipe_tokens(vectors, columns)
+        sigs = signatures(tokens, a, b)
+        return sigs, band_keys(sigs, band_multipliers)
+
+    sigs, keys = benchmark(run)
+    assert len(sigs) == len(keys) == len(vectors)
+    # The signature of a recipe holds the smallest hash of its tokens
+    tokens = recipe_tokens(vectors.iloc[:1], columns).indices.astype(np.uint64)
+    expected = ((tokens[:, None] * a + b) % np.uint64(PRIME)).min(axis=0)
+    assert np.array_equal(sigs[0], expected)
+    record_rate(len(vectors))
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from beerai.data import recipe2vec
+from beerai.data.vocabulary import vocab_version
+from beerai.generate import (
+    RecipeGenerator,
+    RecipeStats,
+    _style_totals,
+    category_of,
+)
+
+STYLES = ["american ipa", "german pils"]
+N_RECIPES = 1000
+
+
+@pytest.fixture(scope="session")
+def generator(prepared, vectors, vocab):
+    """A generator with the statistics of the benchmark recipes, split at
+    random between two styles."""
+    core = prepared.groupby(level=0)[["batch_size", "boil_size", "efficiency"]]
+    core = core.first().reindex(vectors.index)
+    core["style_name"] = np.random.default_rng(0).choice(STYLES, len(core))
+    columns = np.array(sorted(vocab.values()))
+    category = category_of(columns, vocab)
+    totals = dict(_style_totals(vectors, core, columns, category))
+    styles = sorted(totals)
+    arrays = {
+        name: np.stack([totals[style][name] for style in styles])
+        for name in totals[styles[0]]
+    }
+    props = np.ones((5, len(columns)))
+    stats = RecipeStats(
+        styles, columns, vocab_version(vocab), prop_sum=props, prop_n=props, **arrays
+    )
+    return RecipeGenerator(stats, vocab, style_guide={})
+
+
+def test_generate(benchmark, record_rate, generator):
+    recipes, props = benchmark(generator.generate, STYLES[0], N_RECIPES, 0)
+    assert len(props) == N_RECIPES
+    assert pd.Index(recipes["recipe"]).isin(props.index).all()
+    # Only ingredients the style's recipes use are drawn
+    style = list(generator.stats.styles).index(STYLES[0])
+    position = np.searchsorted(generator.stats.columns, generator._column_of(recipes))
+    assert (generator.stats.used[style][position] > 0).all()
+    record_rate(N_RECIPES)
+
+
+def test_build_unordered(monkeypatch, tmp_path, store_path, vectors, maps, vocab):
+    """The statistics don't depend on the order of the vectors: each chunk
+    only counts the ingredients of its own recipes."""
+    monkeypatch.setattr(recipe2vec, "CHUNK_SIZE", 50)
+    stats = {}
+    for order, vecs in [
+        ("sorted", vectors),
+        ("shuffled", vectors.sample(frac=1, random_state=0)),
+    ]:
+        vec_path = str(tmp_path / f"{order}.h5")
+        vecs.to_hdf(vec_path, key="vecs", format="table")
+        stats[order] = RecipeStats.build(vec_path, store_path, maps, vocab)
+    for name in RecipeStats.ARRAYS:
+        np.testing.assert_allclose(
+            getattr(stats["shuffled"], name), getattr(stats["sorted"], name)
+        )
+    assert stats["sorted"].prop_n.sum() > 0
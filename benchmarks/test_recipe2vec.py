@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from beerai.config import INGREDIENT_CATEGORIES
+from beerai.data import recipe2vec
+from beerai.data.recipe2vec import (
+    apply_map,
+    merge_vectors,
+    recipes2vec,
+    scale_quantities,
+)
+
+
+def test_apply_map(benchmark, wide, maps):
+    df = benchmark(apply_map, wide, maps)
+    # Recipes with a name that isn't in the maps are dropped
+    assert 0 < len(df) <= len(wide)
+    for category in INGREDIENT_CATEGORIES:
+        names = df[f"{category}_name"].dropna()
+        assert names.isin(set(maps[category].values())).all()
+
+
+def test_scale_quantities(benchmark_copy, mapped):
+    df = benchmark_copy(scale_quantities, mapped)
+    # Fermentables in kg per L of batch (the rows dropped have no amounts)
+    assert np.isclose(
+        (df["ferm_amount"] * df["batch_size"]).sum(), mapped["ferm_amount"].sum()
+    )
+
+
+def test_recipes2vec(benchmark_copy, prepared, vocab):
+    vecs = benchmark_copy(recipes2vec, prepared, vocab)
+    assert len(vecs) == prepared.index.nunique()
+    # Each ingredient's column holds its own amount, summed if it's used twice
+    rows = pd.concat(
+        prepared[[f"{category}_name", f"{category}_amount"]].set_axis(
+            ["name", "amount"], axis=1
+        )
+        for category in INGREDIENT_CATEGORIES
+    ).dropna(subset=["name"])
+    expected = rows.pivot_table(
+        index=rows.index,
+        columns=rows["name"].map(vocab),
+        values="amount",
+        aggfunc="sum",
+        fill_value=0,
+    )
+    expected = expected.reindex(index=vecs.index, columns=vecs.columns, fill_value=0)
+    np.testing.assert_allclose(
+        vecs.drop(columns="boil_time"), expected.drop(columns="boil_time")
+    )
+    boil_time = prepared.groupby(level=0)["boil_time"].first()
+    np.testing.assert_array_equal(vecs["boil_time"], boil_time.reindex(vecs.index))
+
+
+def test_merge_vectors(benchmark, vectors):
+    old = vectors.iloc[::2]
+    new = vectors.iloc[1::2]
+
+    def merge():
+        chunks = [old.iloc[i : i + 100] for i in range(0, len(old), 100)]
+        return pd.concat(merge_vectors(chunks, [new.iloc[:50], new.iloc[50:]]))
+
+    merged = benchmark(merge)
+    pd.testing.assert_frame_equal(merged, vectors)
+
+
+def test_update_vectors(monkeypatch, tmp_path, store_path, maps, vocab):
+    """A delta update gives the same vectors, in the same (id) order, as
+    vectorising every recipe with the new maps."""
+    new_maps = {category: dict(ing_map) for category, ing_map in maps.items()}
+    # Swap the standard names of two hops
+    hops = {std: raw for raw, std in maps["hop"].items()}
+    (std_a, a), (std_b, b) = list(hops.items())[:2]
+    new_maps["hop"][a], new_maps["hop"][b] = std_b, std_a
+    # Small chunks, so that the updated recipes are spread over several
+    monkeypatch.setattr(recipe2vec, "CHUNK_SIZE", 50)
+    monkeypatch.setattr(recipe2vec, "ING2INT", vocab)
+
+    def build(vec_path, ing_maps):
+        monkeypatch.setattr(recipe2vec, "load_maps", lambda: ing_maps)
+        with pd.HDFStore(vec_path, "w") as store:
+            for chunk, df in enumerate(recipe2vec.load_prepare_data(store_path)):
+                recipe2vec.append_vectors(store, df, chunk)
+
+    vec_path = str(tmp_path / "recipe_vecs.h5")
+    build(vec_path, maps)
+    monkeypatch.setattr(recipe2vec, "load_maps", lambda: new_maps)
+    recipe2vec.update_vectors(maps, store_path, vec_path)
+    full_path = str(tmp_path / "full_vecs.h5")
+    build(full_path, new_maps)
+
+    updated = pd.read_hdf(vec_path, "vecs")
+    assert updated.index.is_monotonic_increasing
+    pd.testing.assert_frame_equal(updated, pd.read_hdf(full_path, "vecs"))
@@ -0,0 +1,151 @@
+"""The scrapers against a stub server on localhost, so they don't need the
+network: retries, skipped recipes and resuming from a checkpoint."""
+
+import asyncio
+import collections
+import functools
+import os
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from beerai.config import DATA_DIR
+from beerai.data import fetch, scrape_brewersfriend, scrape_brewtoad
+from beerai.data.archive import DirectoryWriter
+
+# Seconds before the first retry, short so the tests don't wait on it
+BACKOFF = 0.01
+# A saved Brewtoad listing page: page 1 of 11094, with 30 recipes
+DEMO_PAGE = os.path.join(DATA_DIR, "external/brewtoad_demopage.html")
+
+
+def serve(routes, client):
+    """Run the coroutine function client(server) against a server for routes."""
+
+    async def run():
+        app = web.Application()
+        app.add_routes(routes)
+        async with TestServer(app) as server:
+            return await client(server)
+
+    return asyncio.run(run())
+
+
+def test_scrape_brewersfriend(monkeypatch, tmp_path):
+    requests = collections.Counter()
+
+    async def recipe(request):
+        recipe_id = request.match_info["id"]
+        requests[recipe_id] += 1
+        if recipe_id == "gone":
+            raise web.HTTPNotFound()
+        if recipe_id == "busy" and requests[recipe_id] == 1:
+            raise web.HTTPServiceUnavailable()
+        return web.Response(body=f"<RECIPE>{recipe_id}</RECIPE>".encode())
+
+    monkeypatch.setattr(
+        scrape_brewersfriend, "fetch", functools.partial(fetch.fetch, backoff=BACKOFF)
+    )
+    recipe_ids = ["1", "busy", "gone", "2"]
+    checkpoint_file = str(tmp_path / "checkpoint.pickle")
+
+    def scrape(done, path):
+        async def client(server):
+            with DirectoryWriter(path) as writer:
+                await scrape_brewersfriend.scrape(
+                    recipe_ids,
+                    done,
+                    writer,
+                    url=str(server.make_url("/recipe/")),
+                    checkpoint_file=checkpoint_file,
+                    rate=0,
+                )
+
+        serve([web.get("/recipe/{id}", recipe)], client)
+
+    done = set()
+    scrape(done, tmp_path / "first")
+    # The 503 is retried and the 404 skipped
+    assert requests == {"1": 1, "busy": 2, "gone": 1, "2": 1}
+    assert done == {"1", "busy", "2"}
+    assert sorted(os.listdir(tmp_path / "first")) == ["1.xml", "2.xml", "busy.xml"]
+    assert (tmp_path / "first" / "busy.xml").read_bytes() == b"<RECIPE>busy</RECIPE>"
+
+    # Resuming only asks for the recipe that wasn't done, even though the
+    # downloads go to an empty directory this time
+    done = scrape_brewersfriend.load_checkpoint(recipe_ids, checkpoint_file)
+    assert done == {"1", "busy", "2"}
+    scrape(done, tmp_path / "second")
+    assert requests == {"1": 1, "busy": 2, "gone": 2, "2": 1}
+    assert os.listdir(tmp_path / "second") == []
+
+
+def test_parse_brewtoad_page():
+    with open(DEMO_PAGE, "rb") as f:
+        html = scrape_brewtoad.parse_page(f.read())
+    assert scrape_brewtoad.parse_n_pages(html) == 11094
+    links = scrape_brewtoad.parse_recipe_links(html, "http://localhost")
+    assert len(links) == len(set(links)) == 30
+    assert links[0] == "http://localhost/recipes/rainy-day-ipa-1.xml"
+
+
+def test_scrape_brewtoad(monkeypatch, tmp_path):
+    with open(DEMO_PAGE) as f:
+        demo_page = f.read()
+    requests = collections.Counter()
+    broken = {"p2-oatmeal-stout-8.xml"}
+
+    async def listing(request):
+        page = request.query["page"]
+        requests[page] += 1
+        # The same recipes on every page, under different names
+        text = demo_page.replace("href='/recipes/", f"href='/recipes/p{page}-")
+        return web.Response(text=text, content_type="text/html")
+
+    async def recipe(request):
+        name = request.match_info["name"]
+        requests[name] += 1
+        if name in broken:
+            raise web.HTTPNotFound()
+        return web.Response(body=f"<RECIPE>{name}</RECIPE>".encode())
+
+    monkeypatch.setattr(
+        scrape_brewtoad, "fetch", functools.partial(fetch.fetch, backoff=BACKOFF)
+    )
+    checkpoint_file = str(tmp_path / "checkpoint.pickle")
+    path = tmp_path / "recipes"
+
+    def scrape(start):
+        async def client(server):
+            with DirectoryWriter(path) as writer:
+                return await scrape_brewtoad.scrape(
+                    start,
+                    writer,
+                    n_pages=3,
+                    url=str(server.make_url("/recipes")) + "?page={}",
+                    website=str(server.make_url("")).rstrip("/"),
+                    checkpoint_file=checkpoint_file,
+                    rate=0,
+                )
+
+        routes = [web.get("/recipes", listing), web.get("/recipes/{name}", recipe)]
+        return serve(routes, client)
+
+    # A recipe missing from page 2 holds the checkpoint at page 1, although
+    # page 3 is complete
+    assert scrape(1) == 1
+    assert scrape_brewtoad.load_checkpoint(checkpoint_file) == 1
+    assert [requests[str(page)] for page in [1, 2, 3]] == [1, 1, 1]
+    assert len(os.listdir(path)) == 3 * 30 - 1
+
+    # The next run starts from page 2, where only the missing recipe is
+    # downloaded
+    broken.clear()
+    downloads = sum(requests.values())
+    assert scrape(scrape_brewtoad.load_checkpoint(checkpoint_file) + 1) == 3
+    assert scrape_brewtoad.load_checkpoint(checkpoint_file) == 3
+    assert [requests[str(page)] for page in [1, 2, 3]] == [1, 2, 2]
+    # Pages 2 and 3, and the missing recipe
+    assert sum(requests.values()) == downloads + 2 + 1
+    assert requests["p2-oatmeal-stout-8.xml"] == 2
+    assert len(os.listdir(path)) == 3 * 30
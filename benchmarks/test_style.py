@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from beerai.data.vocabulary import vocab_version
+from beerai.models.style import StylePredictor
+
+# About as many styles as the style guide has
+N_STYLES = 100
+
+
+@pytest.fixture(scope="session")
+def predictor(vectors, vocab):
+    """A predictor with random coefficients, which score as fast as trained
+    ones."""
+    rng = np.random.default_rng(0)
+    columns = vectors.columns
+    return StylePredictor(
+        rng.normal(size=(len(columns), N_STYLES)),
+        rng.normal(size=N_STYLES),
+        [f"style {i}" for i in range(N_STYLES)],
+        columns,
+        vocab_version(vocab),
+    )
+
+
+def test_predict(benchmark, record_rate, predictor, vectors):
+    matrix = predictor.to_matrix(vectors)
+    styles, probabilities = benchmark(predictor.predict, matrix, 3)
+    assert styles.shape == probabilities.shape == (len(vectors), 3)
+    # The most likely styles first
+    assert (np.diff(probabilities, axis=1) <= 0).all()
+    assert (
+        (probabilities > 0) & (probabilities.sum(axis=1, keepdims=True) <= 1 + 1e-5)
+    ).all()
+    assert np.isin(styles, predictor.classes).all()
+    record_rate(len(vectors))
+
+
+def test_load(benchmark, predictor, vocab, tmp_path):
+    path = tmp_path / "style_classifier.npz"
+    predictor.save(path)
+    loaded = benchmark(StylePredictor.load, path, vocab)
+    assert np.array_equal(loaded.coef, predictor.coef)
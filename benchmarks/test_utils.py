@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from beerai import utils
+
+# A check of the values each function returns for the benchmark recipes:
+# scaled amounts per ingredient row, properties one per recipe
+CHECKS = {
+    utils.scale_ferm: lambda r, df: np.allclose(
+        r, df["ferm_amount"] / df["batch_size"], equal_nan=True
+    ),
+    utils.scale_hop: lambda r, df: (r.dropna() > 0).all(),
+    utils.scale_misc: lambda r, df: np.allclose(
+        r, df["misc_amount"] / df["batch_size"], equal_nan=True
+    ),
+    utils.scale_yeast: lambda r, df: (r == 1).all()
+    and len(r) == df["yeast_name"].notna().sum(),
+    utils.ibu: lambda r, df: (r >= 0).all(),
+    utils.gravity_wort: lambda r, df: (r > 1).all(),
+    # The same extract in more wort
+    utils.gravity_kettle: lambda r, df: (r < utils.gravity_original(df)).all(),
+    utils.gravity_original: lambda r, df: (r > 1).all(),
+    utils.gravity_final: lambda r, df: (
+        (r > 1) & (r < utils.gravity_original(df))
+    ).all(),
+    utils.srm: lambda r, df: (r > 0).all(),
+    utils.abv: lambda r, df: (r > 0).all(),
+}
+SCALE_FUNCTIONS = [
+    utils.scale_ferm,
+    utils.scale_hop,
+    utils.scale_misc,
+    utils.scale_yeast,
+]
+
+
+@pytest.fixture(scope="session")
+def scaled(wide):
+    """Recipes with the columns ibu and srm expect."""
+    df = wide.copy()
+    df["hop_scaled"] = utils.scale_hop(df)
+    df["ferm_scaled"] = utils.scale_ferm(df)
+    return df
+
+
+@pytest.mark.parametrize("func", list(CHECKS), ids=lambda f: f.__name__)
+def test_property(benchmark, func, scaled):
+    result = benchmark(func, scaled)
+    assert CHECKS[func](result, scaled)
+    if func not in SCALE_FUNCTIONS:
+        # One value per recipe
+        assert result.index.is_unique
+        assert result.index.isin(pd.Index(scaled.index)).all()
@@ -0,0 +1,16 @@
+from beerai.data.store import widen
+from beerai.data.validate import RULES, _columns, check
+
+
+def test_check(benchmark, record_rate, recipes):
+    core, ings = recipes
+    core_cols, ing_cols = _columns(RULES)
+    wide = widen(ings, ing_cols)
+    flags = benchmark(check, core[core_cols], wide)
+    assert len(flags) == len(core)
+    # Bit 0 is the efficiency rule
+    efficiency = core["efficiency"]
+    bad = ~efficiency.between(0.5, 1)
+    assert bad.any()
+    assert ((flags & 1).astype(bool) == bad).all()
+    record_rate(len(core))
@@ -0,0 +1,15 @@
+import pickle
+
+from beerai.data import vocabulary
+
+
+def test_create_vocab(benchmark, maps, vocab, tmp_path, monkeypatch):
+    for category, ing_map in maps.items():
+        with open(tmp_path / f"{category}map.pickle", "wb") as f:
+            pickle.dump(ing_map, f)
+    monkeypatch.setattr(vocabulary, "MAP_NAME", str(tmp_path / "{}map.pickle"))
+    out_file = tmp_path / "vocab.pickle"
+
+    benchmark(vocabulary.create_vocab, out_file)
+    with open(out_file, "rb") as f:
+        assert pickle.load(f) == vocab
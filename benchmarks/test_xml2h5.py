@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pybeerxml import Parser
+
+from beerai.data.synthetic import ORIGINS
+from beerai.data.units import normalize_amounts, parse_display_amounts
+from beerai.data.xml2h5 import check_origin, convert_runner, parse_xml, recipe_to_dicts
+
+
+def test_convert_runner(benchmark, xml_docs, recipes):
+    def convert():
+        return [convert_runner(f"{i}.xml", ORIGINS[0], i, xml) for i, xml in xml_docs]
+
+    results = benchmark(convert)
+    assert all(r is not None for r in results)
+    core, ings = recipes
+    names = [r[0]["name"] for r in results]
+    assert names == core["name"].astype(str).str.lower().str.strip().tolist()
+    n_ferms = [len(r[1]["ferm"]) for r in results]
+    assert (
+        n_ferms
+        == ings["ferm"].index.value_counts().reindex(core.index, fill_value=0).tolist()
+    )
+
+
+def test_recipe_to_dicts(benchmark, xml_docs, recipes):
+    parser = Parser()
+    parsed = [(i, parse_xml(parser, xml)[0]) for i, xml in xml_docs]
+
+    def convert():
+        return [recipe_to_dicts(r, f"{i}.xml", i, ORIGINS[0]) for i, r in parsed]
+
+    results = benchmark(convert)
+    ferm = pd.DataFrame([d for _, ings in results for d in ings["ferm"]])
+    # The fermentable types are kept, for cleaning and the gravities
+    expected = recipes[1]["ferm"]["ferm_type"].astype(str).tolist()
+    assert ferm["ferm_type"].tolist() == expected
+
+
+def test_check_origin(benchmark, recipes):
+    core, ings = recipes
+    # Half of the names have an origin, e.g. "2 row (US)"
+    names = ings["ferm"]["ferm_name"].astype(str) + " (US)"
+    with_origin = names.index % 2 == 0
+    names = names.where(with_origin, ings["ferm"]["ferm_name"].astype(str))
+    names = names.tolist()
+
+    results = benchmark(lambda: [check_origin(name) for name in names])
+    origins = [origin for _, origin in results]
+    assert origins == ["US" if w else None for w in with_origin]
+
+
+def test_normalize_amounts(benchmark, recipes):
+    core, ings = recipes
+    misc = ings["misc"].copy()
+    # Every other amount converted twice, which the display amount corrects
+    amounts = misc["misc_amount"].to_numpy().copy()
+    amounts[::2] *= 1000
+    misc["misc_amount"] = amounts
+
+    normalized = benchmark(normalize_amounts, misc, "misc")
+    confidence = normalized["misc_unit_confidence"].to_numpy()
+    assert (confidence[::2] == "medium").all()
+    assert (confidence[1::2] == "high").all()
+    # The display amounts are rounded to 0.1 g or 0.01 tsp
+    expected = ings["misc"]["misc_amount"]
+    assert np.allclose(normalized["misc_amount"], expected, rtol=0.05)
+
+
+@pytest.mark.parametrize(
+    "display, amount, unit",
+    [
+        ("5.5 lbs", 5.5 * 0.453592, "lbs"),
+        ("1 1/2 lbs", 1.5 * 0.453592, "lbs"),
+        ("1 lbs 4.0 oz", 0.453592 + 4 * 0.0283495, "lbs"),
+        ("1,5 kg", 1.5, "kg"),
+        ("1,500 g", 1.5, "g"),
+        ("2 tsp ground", 2 * 0.00492892, "tsp"),
+        ("2 Whirlfloc Tablets", 2, "tablets"),
+        ("1 pkg", 1, "pkg"),
+        ("about 2 tsp", np.nan, None),
+        ("11 g 3", np.nan, None),
+    ],
+)
+def test_parse_display_amounts(display, amount, unit):
+    parsed = parse_display_amounts(pd.Series([display])).iloc[0]
+    if unit is None:
+        assert pd.isna(parsed["amount"])
+    else:
+        assert parsed["unit"] == unit
+        assert np.isclose(parsed["amount"], amount)
+
+
+def test_normalize_amounts_keeps_unparsed():
+    # Partial parses ("1/2" of "1 1/2", "5" of "1,5") used to replace the
+    # right XML amounts
+    ferm = pd.DataFrame(
+        {
+            "ferm_amount": [1.5 * 0.453592, 1.5, 0.2],
+            "ferm_display_amount": ["1 1/2 lbs", "1,5 kg", "approx. 7 oz"],
+        }
+    )
+    normalized = normalize_amounts(ferm, "ferm")
+    assert np.allclose(normalized["ferm_amount"], ferm["ferm_amount"])
+    assert normalized["ferm_unit_confidence"].tolist() == ["high", "high", "low"]
+    misc = pd.DataFrame(
+        {
+            "misc_amount": [0.002],
+            "misc_display_amount": ["2 Whirlfloc Tablets"],
+            "misc_amount_is_weight": [True],
+        }
+    )
+    normalized = normalize_amounts(misc, "misc")
+    assert normalized["misc_amount"].iloc[0] == np.float32(0.002)
+    assert normalized["misc_count"].iloc[0] == 2
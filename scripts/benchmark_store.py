@@ -0,0 +1,147 @@
+"""Compare the HDF and Parquet recipe stores: write and read throughput, and
+size on disk. The recipes of an existing store are copied into a fresh store of
+each format (optionally repeated, with new ids, to get a bigger dataset) and
+then read back in the ways the pipeline reads them."""
+
+import argparse
+import os
+import pandas as pd
+import tempfile
+import time
+
+from beerai.config import DATA_DIR
+from beerai.data.recipe2vec import CORE_COLS, ING_COLS
+from beerai.config import INGREDIENT_CATEGORIES
+from beerai.data.schema import CATEGORY_TABLES
+from beerai.data.store import open_store, select_category
+from beerai.data.xml2h5 import CORE_COLUMNS, append_frames, conform
+
+RECIPE_FILE = os.path.join(DATA_DIR, "interim/all_recipes.h5")
+BATCH_SIZE = 10000
+CHUNK_SIZE = 10000
+
+
+def load_source(path):
+    """Read the core table and the ingredients of each category from a store,
+    conformed the way xml2h5 hands them to a store."""
+    with open_store(path) as store:
+        core = conform(store.select("core"), CORE_COLUMNS)
+        ings = {
+            cat: conform(select_category(store, cat), CATEGORY_TABLES[cat])
+            for cat in INGREDIENT_CATEGORIES
+        }
+    return core, ings
+
+
+def repeat(core, ings, n):
+    """Stack n copies of the recipes, shifting the ids of each copy."""
+    step = core.index.max() + 1
+
+    def copies(df):
+        return pd.concat([df.set_axis(df.index + i * step) for i in range(n)])
+
+    return copies(core), {cat: copies(df) for cat, df in ings.items()}
+
+
+def disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(dirpath, f))
+        for dirpath, _, filenames in os.walk(path)
+        for f in filenames
+    )
+
+
+def timed(func):
+    """Return (seconds, result) for a call of func."""
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def write(path, core, ings, batch_size=BATCH_SIZE):
+    ids = core.index.unique()
+    with open_store(path, "w") as store:
+        for i in range(0, len(ids), batch_size):
+            lo, hi = ids[i], ids[min(i + batch_size, len(ids)) - 1]
+            batch = {cat: df.loc[lo:hi] for cat, df in ings.items()}
+            append_frames(store, core.loc[lo:hi], batch)
+
+
+def chunked_pass(path):
+    """Read the columns recipe2vec uses, chunk by chunk, like
+    load_prepare_data does."""
+    n = 0
+    with open_store(path) as store:
+        for core in store.select("core", columns=CORE_COLS, chunksize=CHUNK_SIZE):
+            id_range = (core.index[0], core.index[-1] + 1)
+            n += len(store.select("ingredients", columns=ING_COLS, id_range=id_range))
+    return n
+
+
+def benchmark(path, core, ings, batch_size=BATCH_SIZE):
+    """Return {measurement: seconds or MB} for one store format."""
+    results = {}
+    results["write (s)"], _ = timed(lambda: write(path, core, ings, batch_size))
+    results["size (MB)"] = disk_size(path) / 1e6
+
+    ids = core.index
+    lo = ids[len(ids) // 2]
+    hi = ids[min(len(ids) // 2 + max(len(ids) // 100, 1), len(ids) - 1)]
+    style = core["style_name"].value_counts().index[0]
+    reads = {
+        "full read (s)": lambda s: (s.select("core"), s.select("ingredients")),
+        "2 columns (s)": lambda s: s.select("hop", columns=["hop_name", "hop_amount"]),
+        "1% id range (s)": lambda s: s.select("ingredients", id_range=(lo, hi)),
+        "one style (s)": lambda s: s.select("ingredients", styles=[style]),
+    }
+    for name, read in reads.items():
+        with open_store(path) as store:
+            results[name], _ = timed(lambda: read(store))
+    results["recipe2vec pass (s)"], _ = timed(lambda: chunked_pass(path))
+    return results
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to compare the write/read speed and size of the "
+        "HDF and Parquet recipe stores."
+    )
+    parser.add_argument(
+        "-f",
+        "--filename",
+        default=RECIPE_FILE,
+        help="Recipe store to copy the recipes from. Default is "
+        "`data/interim/all_recipes.h5`.",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=1,
+        help="Number of copies of the recipes to write. Default is 1.",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"Recipes per append. Default is {BATCH_SIZE}.",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+
+    core, ings = repeat(*load_source(args.filename), args.repeat)
+    n_ings = sum(len(df) for df in ings.values())
+    print(f"Benchmarking with {len(core)} recipes, {n_ings} ingredients.")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt, fname in [("hdf", "recipes.h5"), ("parquet", "recipes.parquet")]:
+            path = os.path.join(tmp, fname)
+            results[fmt] = benchmark(path, core, ings, args.batch_size)
+    print(pd.DataFrame(results).round(3).to_string())
@@ -8,6 +8,9 @@ import shutil
 
 from cmd import Cmd
 
+from beerai.data.name_index import NameIndex, index_path
+from beerai.data.store import open_store, select_category
+
 # Categories to play the game with
 VALID_CATEGORIES = ["ferm", "hop", "yeast", "misc"]
 
@@ -36,6 +39,8 @@ class Cleaner(Cmd):
     # Are we currently mapping an ingredient?
     active = False
     record_file = None
+    # Name -> recipe index for the HDF, if it has been built
+    index = None
 
     # ------ Dynamic properties ------
     @property
@@ -130,6 +135,15 @@ class Cleaner(Cmd):
         print(
             f"Records affected by mapping {self.cur_ingred_compare}: {num_records_affected}"
         )
+        if self.index is not None:
+            # Names to clean have had " yeast" removed, so look up both
+            names = [self.cur_ingred_compare, self.cur_ingred_compare + " yeast"]
+            num_recipes_affected = len(
+                self.index.recipes(any_of=[(self.category, name) for name in names])
+            )
+            print(
+                f"Recipes affected by mapping {self.cur_ingred_compare}: {num_recipes_affected}"
+            )
 
     def help_impact(self, arg):
         print(
@@ -346,8 +360,11 @@ class Cleaner(Cmd):
     def load_df(self):
         """Load the dataframe of global data."""
         # XXX - update the number below to be a passed in parameter
-        with pd.HDFStore(self.hdf_path, "r") as store:
-            self.df = store.select("ingredients", columns=[self.hdf_col])
+        with open_store(self.hdf_path) as store:
+            self.df = select_category(store, self.category, columns=[self.hdf_col])
+        self.df[self.hdf_col] = self.df[self.hdf_col].astype(object)
+        if os.path.exists(index_path(self.hdf_path)):
+            self.index = NameIndex.load(index_path(self.hdf_path))
 
     def advance_ingred(self):
         """Pop the next ingredient to compare to the current ingredient (if
@@ -457,7 +474,8 @@ def make_arg_parser():
         "-f",
         "--filename",
         default="all_recipes.h5",
-        help="path of HDF file containing ingredients. Default is "
+        help="path of HDF file (or Parquet directory) containing ingredients. "
+        "Default is "
         "'all_recipes.h5' in current directory.",
     )
     parser.add_argument(
@@ -1,21 +1,61 @@
 # How many recipes are completely cleaned by our maps?
 # Completely cleaned means every ingredient is a key in a map
 
-import pandas as pd
+import os
 import numpy as np
 import pickle
 
+from beerai.data.name_index import NameIndex, index_path
+from beerai.data.store import open_store, select_category
+
 VALID_CATEGORIES = ["ferm", "hop", "yeast", "misc"]
 
+
+def covered_by_index(index, cat, ing_map):
+    """Use the name index to get the recipe IDs that use at least one
+    ingredient of a category and whose ingredients of that category are all
+    keys in the map."""
+    names = [(cat, name) for name in index.names(cat)]
+    if not names:
+        return set()
+    unmapped = [(cat, name) for cat, name in names if name not in ing_map]
+    covered = set(index.recipes(any_of=names))
+    if unmapped:
+        covered.difference_update(index.recipes(any_of=unmapped))
+    return covered
+
+
+def covered_by_df(df, cat, ing_map):
+    """Scan the name column of the ingredients to get the recipe IDs that use
+    at least one ingredient of a category and whose ingredients of that
+    category are all keys in the map."""
+    col = "{}_name".format(cat)
+    cur_data = df[col].dropna()
+    ingred_in_map = cur_data.isin(ing_map.keys())
+    all_ingred_in_map = ingred_in_map.groupby(cur_data.index).agg(np.all)
+    return set(all_ingred_in_map[all_ingred_in_map].index)
+
+
 if __name__ == "__main__":
-    # Load ingredient DataFrame
-    col_names = [f"{cat}_name" for cat in VALID_CATEGORIES]
-    with pd.HDFStore("all_recipes.h5") as store:
-        df = store.select("ingredients", columns=col_names)
+    # Load the name index if it exists, otherwise the ingredient names
+    index = None
+    if os.path.exists(index_path("all_recipes.h5")):
+        index = NameIndex.load(index_path("all_recipes.h5"))
+        all_ids = set()
+        for cat in VALID_CATEGORIES:
+            names = [(cat, name) for name in index.names(cat)]
+            if names:
+                all_ids.update(index.recipes(any_of=names))
+    else:
+        dfs = {}
+        with open_store("all_recipes.h5") as store:
+            for cat in VALID_CATEGORIES:
+                dfs[cat] = select_category(store, cat, columns=[f"{cat}_name"])
+        all_ids = set().union(*(df.index for df in dfs.values()))
 
     # Get the set of unique recipe IDs that are completely covered by each map
     maps = {}
-    s = set(df.index)
+    s = set(all_ids)
     for cat in VALID_CATEGORIES:
         # Load the map
         fname = f"{cat}map.pickle"
@@ -28,15 +68,14 @@ if __name__ == "__main__":
             print("File not found.")
 
         # Get the recipe IDs covered by the map
-        col = "{}_name".format(cat)
-        cur_data = df[col].dropna()
-        ingred_in_map = cur_data.isin(maps[cat].keys())
-        all_ingred_in_map = ingred_in_map.groupby(cur_data.index).agg(np.all)
-        s_cat = set(all_ingred_in_map[all_ingred_in_map].index)
+        if index is not None:
+            s_cat = covered_by_index(index, cat, maps[cat])
+        else:
+            s_cat = covered_by_df(dfs[cat], cat, maps[cat])
 
         n_mapped_cat = len(s_cat)
-        n_total_cat = df.index.max()
-        pct_mapped_cat = 100 * len(s_cat) / df.index.max()
+        n_total_cat = max(all_ids)
+        pct_mapped_cat = 100 * len(s_cat) / max(all_ids)
         print(
             "Coverage: {} out of {} recipes by the {} map. ({:.0f}%)".format(
                 n_mapped_cat, n_total_cat, cat, pct_mapped_cat
@@ -48,8 +87,8 @@ if __name__ == "__main__":
 
     # Count the number of recipes covered by the map
     n_mapped = len(s)
-    n_total = df.index.max()
-    pct_mapped = 100 * len(s) / df.index.max()
+    n_total = max(all_ids)
+    pct_mapped = 100 * len(s) / max(all_ids)
     print(
         "Coverage: {} out of {} recipes by all maps. ({:.0f}%)".format(
             n_mapped, n_total, pct_mapped
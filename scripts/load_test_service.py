@@ -0,0 +1,238 @@
+"""Load test the recipe service (beerai.service): send requests from concurrent
+clients and compare the p50 and p99 latency of each endpoint to targets. Exits
+with status 1 if an endpoint misses a target or a request fails.
+
+By default the service is started in this process, on synthetic recipes (see
+beerai.data.synthetic), so no data is needed. --url tests a running service
+instead; the requests still hold synthetic recipes, so /similar will mostly
+find their ingredients unknown."""
+
+import argparse
+import asyncio
+import numpy as np
+import pandas as pd
+import sys
+import time
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+from beerai.config import INGREDIENT_CATEGORIES
+from beerai.data.recipe2vec import ING_COLS, prepare, recipes2vec
+from beerai.data.store import widen
+from beerai.data.synthetic import CorpusModel, make_recipes, make_vocab
+from beerai.service import (
+    ING_FIELDS,
+    MAX_BATCH,
+    MAX_WAIT,
+    OPERATIONS,
+    RecipeService,
+    make_app,
+    unit_rows,
+)
+from beerai.utils import get_style_guide
+
+# (p50, p99) latency targets in ms per endpoint, for the default load (32
+# clients sending one recipe per request) on a single core
+TARGETS = {"properties": (100, 200), "styles": (100, 250), "similar": (250, 500)}
+
+
+def to_requests(core, ings):
+    """Turn synthetic recipes into recipes for the service."""
+    recipes = {}
+    for i, row in zip(core.index, core.to_dict("records")):
+        recipe = {col: row[col] for col in ["batch_size", "boil_size", "boil_time"]}
+        recipe["efficiency"] = row["efficiency"]
+        recipes[i] = {k: None if pd.isna(v) else float(v) for k, v in recipe.items()}
+    for category in INGREDIENT_CATEGORIES:
+        df = ings[category]
+        fields = {f"{category}_{f}": f for f in ING_FIELDS[category]}
+        fields = {col: f for col, f in fields.items() if col in df}
+        for i, row in zip(df.index, df[list(fields)].to_dict("records")):
+            recipes[i].setdefault(category, []).append(
+                {
+                    fields[col]: None
+                    if pd.isna(v)
+                    else (str(v) if isinstance(v, str) else float(v))
+                    for col, v in row.items()
+                }
+            )
+    return list(recipes.values())
+
+
+def synthetic_service(n_recipes, seed=0):
+    """Return a RecipeService over n_recipes synthetic recipes."""
+    model = CorpusModel.default(4)
+    maps = model.standard
+    vocab = make_vocab(maps)
+    core, ings = make_recipes(n_recipes, np.random.default_rng(seed), model=model)
+    df = prepare(core, widen(ings, ING_COLS), maps)
+    vecs = recipes2vec(df, vocab)
+    vectors = unit_rows(vecs, sorted(vocab.values()))
+    return RecipeService(maps, vocab, get_style_guide(), vecs.index, vectors), model
+
+
+async def client(session, url, queue, bodies, latencies, errors):
+    while True:
+        try:
+            i = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        start = time.perf_counter()
+        async with session.post(url, json=bodies[i % len(bodies)]) as resp:
+            await resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+        latencies.append(time.perf_counter() - start)
+
+
+async def load_test(base_url, operation, bodies, n_requests, concurrency):
+    """Send n_requests to an endpoint from concurrency clients. Return the
+    latencies in seconds, the number of failed requests and the total time."""
+    queue = asyncio.Queue()
+    for i in range(n_requests):
+        queue.put_nowait(i)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    async with ClientSession(timeout=ClientTimeout(total=60)) as session:
+        await asyncio.gather(
+            *[
+                client(
+                    session, f"{base_url}/{operation}", queue, bodies, latencies, errors
+                )
+                for _ in range(concurrency)
+            ]
+        )
+    return np.array(latencies), len(errors), time.perf_counter() - start
+
+
+async def run(args):
+    service, model = synthetic_service(args.recipes)
+    queries = make_recipes(
+        args.batch * 100, np.random.default_rng(1), start=args.recipes, model=model
+    )
+    recipes = to_requests(*queries)
+    bodies = [
+        {"recipes": recipes[i : i + args.batch]}
+        for i in range(0, len(recipes), args.batch)
+    ]
+
+    runner = None
+    base_url = args.url
+    if base_url is None:
+        app = make_app(service, args.max_batch, args.max_wait / 1000)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        base_url = f"http://127.0.0.1:{port}"
+
+    rows = {}
+    try:
+        for operation in args.endpoints:
+            # Warm up
+            await load_test(base_url, operation, bodies, args.concurrency, 1)
+            latencies, errors, seconds = await load_test(
+                base_url, operation, bodies, args.requests, args.concurrency
+            )
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            p50_target, p99_target = TARGETS[operation]
+            p50_target = args.p50 or p50_target
+            p99_target = args.p99 or p99_target
+            rows[operation] = {
+                "req/s": len(latencies) / seconds,
+                "p50 (ms)": p50,
+                "p99 (ms)": p99,
+                "max (ms)": latencies.max() * 1000,
+                "errors": errors,
+                "p50 target": p50_target,
+                "p99 target": p99_target,
+                "ok": p50 <= p50_target and p99 <= p99_target and not errors,
+            }
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def _setup_argparser():
+    parser = argparse.ArgumentParser(
+        description="Program to load test the recipe service and check the "
+        "latency of each endpoint."
+    )
+    parser.add_argument(
+        "-n",
+        "--requests",
+        type=int,
+        default=1000,
+        help="Number of requests per endpoint. Default is 1000.",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=32,
+        help="Number of concurrent clients. Default is 32.",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        type=int,
+        default=1,
+        help="Recipes per request. Default is 1.",
+    )
+    parser.add_argument(
+        "-r",
+        "--recipes",
+        type=int,
+        default=100000,
+        help="Number of synthetic recipes to search for similar recipes. "
+        "Default is 100000.",
+    )
+    parser.add_argument(
+        "-e",
+        "--endpoints",
+        nargs="+",
+        choices=OPERATIONS,
+        default=OPERATIONS,
+        help="Endpoints to test. Default is all of them.",
+    )
+    parser.add_argument(
+        "--p50",
+        type=float,
+        help="Target p50 latency in ms for all endpoints. Default is "
+        "given per endpoint in TARGETS.",
+    )
+    parser.add_argument(
+        "--p99",
+        type=float,
+        help="Target p99 latency in ms for all endpoints. Default is "
+        "given per endpoint in TARGETS.",
+    )
+    parser.add_argument(
+        "--url", help="Test the service at this URL instead of starting one."
+    )
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=MAX_BATCH,
+        help=f"Maximum recipes per batch. Default is {MAX_BATCH}.",
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=MAX_WAIT * 1000,
+        help="Milliseconds a request waits for others to batch with. Default is "
+        f"{MAX_WAIT * 1000:g}.",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _setup_argparser()
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(results.round(1).to_string())
+    if not results["ok"].all():
+        sys.exit(1)
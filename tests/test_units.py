@@ -1,7 +1,8 @@
 """Identify if columns of data in the recipes are within expected ranges."""
 
 import argparse
-import pandas as pd
+
+from beerai.data.store import open_store
 
 function_map = {}
 
@@ -95,9 +96,9 @@ def main(functions=[]):
     # test size
     n = 1000
 
-    with pd.HDFStore("../all_recipes.h5", "r") as store:
-        core = store.select("core", where=f"index < {n}")
-        ing = store.select("ingredients", where=f"index < {n}")
+    with open_store("../all_recipes.h5") as store:
+        core = store.select("core", id_range=(0, n))
+        ing = store.select("ingredients", id_range=(0, n))
 
     for func_str in functions:
         function_map[func_str](core, ing)